@@ -4,6 +4,7 @@ AxonDeepSeg utilities module.
 
 import os
 import sys
+import warnings
 from pathlib import Path
 import configparser
 from distutils.util import strtobool
@@ -256,20 +257,171 @@ def imread(filename, bitdepth=8):
     """
     if 'tif' in str(filename):
         raw_img = imageio.imread(filename, format='tiff-pil')
-        if len(raw_img.shape) > 2:
-            raw_img = imageio.imread(filename, format='tiff-pil', as_gray=True)
     else:
         raw_img = imageio.imread(filename)
-        if len(raw_img.shape) > 2:
-            raw_img = imageio.imread(filename, as_gray=True)
 
-    img = imageio.core.image_as_uint(raw_img, bitdepth=bitdepth)
+    # Color images are converted to grayscale from the decoded pixels, as the regions of image_region_as_uint()
+    img = imageio.core.image_as_uint(image_as_gray(raw_img), bitdepth=bitdepth)
     return img
 
-def imwrite(filename, img, format='png'):
+def image_as_gray(image):
+    """ Convert an image to grayscale, as Pillow does: the color images are converted to float32 with the ITU-R 601-2
+    luma transform, and the alpha channel is ignored.
+    :param image: array of shape (height, width) or (height, width, channels).
+    :return: 2D array, the image itself if it is already in grayscale.
+    """
+    image = np.asarray(image)
+    if image.ndim == 2:
+        return image
+
+    if image.shape[-1] < 3:
+        # Grayscale image with an alpha channel
+        return image[..., 0].astype(np.float32)
+
+    if image.dtype == np.uint8:
+        from PIL import Image
+        return np.asarray(Image.fromarray(np.ascontiguousarray(image[..., :3])).convert('F'))
+
+    return ((image[..., 0] * 299. + image[..., 1] * 587. + image[..., 2] * 114.) / 1000.).astype(np.float32)
+
+def imread_shape(filename):
+    """ Read the dimensions of an image from the header of its file, without decoding the pixels.
+    Falls back to decoding the image with imread() if the header can't be read.
+    :param filename: path of the image.
+    :return: tuple (height, width) of the image.
+    """
+    filename = str(filename)
+
+    if filename.endswith('.npy'):
+        return tuple(np.load(filename, mmap_mode='r').shape[:2])
+
+    from PIL import Image
+
+    try:
+        # Opening the image only parses its header, the pixels are decoded when they are accessed
+        with Image.open(filename) as image:
+            width, height = image.size
+        return height, width
+    except (IOError, OSError, ValueError, Image.DecompressionBombError):
+        return tuple(imread(filename).shape[:2])
+
+def imwrite(filename, img, format='png', compress_level=None):
     """ Write image.
+    :param compress_level: zlib compression level of PNG images, from 0 (no compression, fastest) to 9 (smallest
+    file, slowest). If None, the default level of the writer is used.
     """
-    imageio.imwrite(filename, img, format=format)
+    if (compress_level is not None) and (format == 'png'):
+        from PIL import Image
+        Image.fromarray(np.ascontiguousarray(img)).save(str(filename), format='PNG', compress_level=compress_level)
+    else:
+        imageio.imwrite(filename, img, format=format)
+
+def get_tifffile():
+    """ Return the tifffile module, or the version bundled with scikit-image, if it supports memory-mapping.
+    :return: tifffile module, or None if it is not available.
+    """
+    try:
+        import tifffile
+    except ImportError:
+        try:
+            from skimage.external import tifffile
+        except ImportError:
+            return None
+    return tifffile if hasattr(tifffile, 'memmap') else None
+
+def imread_lazy(filename):
+    """ Open an image without loading all its pixels in memory, when the file format allows it.
+    Uncompressed TIFF files and .npy files are memory-mapped. Compressed TIFF files are decoded strip by strip (or tile
+    by tile) into a memory-mapped temporary file. Other images are read in full with imread(), with a warning.
+    :param filename: path of the image.
+    :return: array of shape (height, width) or (height, width, channels), possibly memory-mapped.
+    """
+    filename = str(filename)
+
+    if filename.endswith('.npy'):
+        return np.load(filename, mmap_mode='r')
+
+    if 'tif' in filename:
+        tifffile = get_tifffile()
+        if tifffile is not None:
+            try:
+                return tifffile.memmap(filename, mode='r')
+            except ValueError:
+                # Compressed TIFF files can't be memory-mapped
+                pass
+            try:
+                return tifffile.imread(filename, out='memmap')
+            except (TypeError, ValueError):
+                pass
+
+    warnings.warn("{0} is loaded in full in memory: only TIFF and .npy files are read without loading all their "
+                  "pixels.".format(filename))
+    return imread(filename)
+
+def image_value_range(image, bitdepth=8, n_rows=256):
+    """ Range of the grayscale values of an image opened with imread_lazy(), with which imread() scales the image to
+    the desired bitdepth. The image is read by blocks of rows, so that a memory-mapped image is not loaded in full.
+    :param image: array of shape (height, width) or (height, width, channels).
+    :param bitdepth: bitdepth of the output.
+    :param n_rows: number of rows read at once.
+    :return: tuple (minimum, maximum), or None if the conversion does not depend on the values of the image (unsigned
+    integer grayscale images with at least bitdepth bits).
+    """
+    if image.ndim == 2 and image.dtype.kind == 'u' and image.dtype.itemsize * 8 >= bitdepth:
+        return None
+
+    minimum, maximum = np.inf, -np.inf
+    for start in range(0, image.shape[0], n_rows):
+        block = image_as_gray(image[start:start + n_rows])
+        minimum, maximum = min(minimum, np.nanmin(block)), max(maximum, np.nanmax(block))
+
+    return minimum, maximum
+
+def image_region_as_uint(region, bitdepth=8, value_range=None):
+    """ Convert a region of an image opened with imread_lazy() to grayscale and to the desired bitdepth.
+    Given the range of the whole image, the region is scaled as imread() scales the whole image, so that the regions
+    of an image can be processed separately.
+    :param region: array, region of the image.
+    :param bitdepth: bitdepth of the output.
+    :param value_range: tuple (minimum, maximum), the range of the whole image (see image_value_range()). If None, the
+    range of the region is used.
+    :return: 2D array.
+    """
+    region = image_as_gray(region)
+    out_type = np.uint8 if bitdepth == 8 else np.uint16
+
+    # Conversions that do not depend on the values of the image (none, or dropping the low bits)
+    if (value_range is None) or (region.dtype == out_type) or \
+            (region.dtype.kind == 'u' and region.dtype.itemsize > np.dtype(out_type).itemsize):
+        return imageio.core.image_as_uint(region, bitdepth=bitdepth)
+
+    # Same scaling as imageio.core.image_as_uint, with the range of the whole image
+    minimum, maximum = value_range
+    scale = np.power(2.0, bitdepth) - 1
+    if region.dtype.kind == 'f' and minimum >= 0 and maximum <= 1:
+        return (region.astype(np.float64) * scale + 0.499999999).astype(out_type)
+    if maximum == minimum:
+        return region.astype(out_type)
+    return ((region.astype(np.float64) - minimum) / (maximum - minimum) * scale + 0.499999999).astype(out_type)
+
+def imwrite_mmap(filename, shape, dtype=np.uint8):
+    """ Create an image file memory-mapped for writing.
+    :param filename: path of the image, either a .tif or a .npy file.
+    :param shape: shape of the image.
+    :param dtype: data type of the image.
+    :return: memory-mapped array, written to the file when flushed or deleted.
+    """
+    filename = str(filename)
+
+    if filename.endswith('.npy'):
+        return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=tuple(shape))
+
+    tifffile = get_tifffile()
+    if tifffile is None:
+        raise ImportError("The tifffile package is required to write memory-mapped TIFF files. "
+                          "Install it or use a .npy file instead.")
+
+    return tifffile.memmap(filename, shape=tuple(shape), dtype=dtype)
 
 def extract_axon_and_myelin_masks_from_image_data(image_data):
     """
@@ -1,23 +1,32 @@
 # -*- coding: utf-8 -*-
+import collections
+import concurrent.futures
+import itertools
+import queue
+import threading
 import numpy as np
-from skimage.transform import rescale, resize
 import AxonDeepSeg.ads_utils as ads
 from AxonDeepSeg.ads_utils import convert_path
-from AxonDeepSeg.network_construction import *
-from AxonDeepSeg.visualization.get_masks import get_masks
-from AxonDeepSeg.patch_management_tools import im2patches_overlap, patches2im_overlap
+from AxonDeepSeg.visualization.get_masks import split_segmentation, masks_paths
+from AxonDeepSeg.patch_management_tools import im2patches_overlap, patches2im_overlap, patches2im_blend
 from AxonDeepSeg.config_tools import update_config, default_configuration
+from AxonDeepSeg.resampling import resize_labels, resize_probabilities, rescale_image
+from AxonDeepSeg.pixel_size import PixelSizeResolver
+from AxonDeepSeg.inference_backends import create_inference_backend
 from config import axonmyelin_suffix
 
-#Keras import
-from keras import backend as K
+# Ways of stitching the segmented patches of an acquisition, see process_segmented_patches.
+stitching_modes = ['crop', 'blend']
 
 
 def apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder, config_dict, ckpt_name='model',
                   inference_batch_size=1, overlap_value=25, resampled_resolutions=[0.1],
-                  prediction_proba_activate=False, gpu_per=1.0, verbosity_level=0):
+                  prediction_proba_activate=False, gpu_per=1.0, verbosity_level=0, stitching_mode='crop',
+                  skip_threshold=None, proba_dtype=np.float32, path_probability_maps=None,
+                  resampling_backend='skimage', cache=None, inference_backend='auto'):
     """
     Preprocesses the images, transform them into patches, applies the network, stitches the predictions and return them.
+    The network is built and restored for this call only; use a Segmenter object to reuse it across several calls.
     :param path_acquisitions: List of path to the acquisitions.
     :param acquisitions_resolutions: List of the acquisitions resolutions (floats).
     :param path_model_folder: Path to the model folder.
@@ -29,6 +38,16 @@ def apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder
     :param prediction_proba_activate: Boolean, whether to compute the probability maps or not.
     :param gpu_per: Float, percentage of GPU to use if we use it.
     :param verbosity_level: Int, how much information to display.
+    :param stitching_mode: String, how the segmented patches are stitched: 'crop' or 'blend'.
+    :param skip_threshold: Float or None. If not None, the patches whose standard deviation of intensity is lower or
+    equal to this value are labelled as background without running the network.
+    :param proba_dtype: Type of the probability maps: np.float32, or np.uint8 for probabilities quantised to 0-255.
+    :param path_probability_maps: List of the paths of the files where to save the probability maps, or None. The
+    .npy files are written as memory maps while the maps are resampled; other paths are saved as compressed .npz files.
+    :param resampling_backend: String, implementation of the resampling of the acquisitions to the resolution of the
+    model: 'skimage', 'area' or 'opencv' (see AxonDeepSeg.resampling.rescale_image).
+    :param cache: ResamplingCache object where the resampled acquisitions are looked up and stored, or None.
+    :param inference_backend: String, the backend running the network (see AxonDeepSeg.inference_backends).
     :return: List of segmentations, and list of probability maps if requested.
     """
 
@@ -36,159 +55,574 @@ def apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder
     path_acquisitions = convert_path(path_acquisitions)
     path_model_folder = convert_path(path_model_folder)
 
-    # We set the logging from python and Tensorflow to a high level, to avoid messages
-    # in the console when performing segmentation.
-    from logging import ERROR
-    tf.logging.set_verbosity(ERROR)
-    import warnings
-    warnings.filterwarnings('ignore')
-
-    # Network Parameters
-    patch_size = config_dict["trainingset_patchsize"]
-    n_classes = config_dict["n_classes"]
-
-    # STEP 1: Load and rescale the acquisitions, and transform them into patches.
-
-    rs_acquisitions, rs_coeffs, original_acquisitions_shapes = load_acquisitions(
-        path_acquisitions, acquisitions_resolutions, resampled_resolutions, verbose_mode=verbosity_level)
-
     # If we are unable to load the model, we return an error message
     if not path_model_folder.exists():
         print('Error: unable to find the requested model.')
         return [None] * len(path_acquisitions)
 
-    L_data, L_n_patches, L_positions = prepare_patches(rs_acquisitions, patch_size, overlap_value)
-
-    # STEP 2: Construct Tensorflow's computing graph and restoration of the session
-
-    # Construction of the graph
-    if verbosity_level >= 2:
-        print("Graph construction ...")
-
-    x = tf.placeholder(tf.float32, shape=(None, patch_size, patch_size, 1))
-
-    model = uconv_net(config_dict, bn_updated_decay=None, verbose=True)  # inference
-    pred = model.output
-
-
-    saver = tf.train.Saver()  # Load previous model
-
-    # We limit the amount of GPU for inference
-    config_gpu = tf.ConfigProto(log_device_placement=False)
-    config_gpu.gpu_options.per_process_gpu_memory_fraction = gpu_per
+    with Segmenter(path_model_folder, config_dict, ckpt_name=ckpt_name, gpu_per=gpu_per,
+                   verbosity_level=verbosity_level, inference_backend=inference_backend) as segmenter:
 
-    # Launch the session (this part takes time). All images will be processed by loading the session just once.
+        outputs = segmenter.segment(path_acquisitions, acquisitions_resolutions,
+                                    inference_batch_size=inference_batch_size, overlap_value=overlap_value,
+                                    resampled_resolutions=resampled_resolutions,
+                                    prediction_proba_activate=prediction_proba_activate,
+                                    stitching_mode=stitching_mode, skip_threshold=skip_threshold,
+                                    proba_dtype=proba_dtype, path_probability_maps=path_probability_maps,
+                                    resampling_backend=resampling_backend, cache=cache)
 
-    sess = tf.Session(config=config_gpu)
-    K.set_session(sess)
+        if skip_threshold is not None and verbosity_level >= 1:
+            print(segmenter.skipped_patches_summary())
 
-    model_previous_path = path_model_folder.joinpath(ckpt_name).with_suffix('.ckpt')
-    saver.restore(sess, str(model_previous_path))
+        return outputs
 
-    # STEP 3: Inference
 
-    if verbosity_level >= 2:
-        print("Beginning inference ...")
+class Segmenter(object):
+    """
+    Segmentation model loaded in memory. The model is loaded once, when the object is created, by an inference backend
+    (see AxonDeepSeg.inference_backends), and is then used to segment any number of acquisitions. By default, the
+    frozen graph of the checkpoint (see AxonDeepSeg.model_export) is loaded if it is up to date, which is faster to load
+    and to run, and the network is built and its checkpoint restored otherwise.
+    """
 
-    n_patches = len(L_data)
-    it, rem = divmod(n_patches, inference_batch_size)
+    def __init__(self, path_model_folder, config_dict, ckpt_name='model', gpu_per=1.0, verbosity_level=0,
+                 intra_op_threads=0, inter_op_threads=0, inference_backend='auto'):
+        """
+        Loads the model.
+        :param path_model_folder: Path to the model folder.
+        :param config_dict: Dictionary containing the model's parameters.
+        :param ckpt_name: String, checkpoint to use.
+        :param gpu_per: Float, percentage of GPU to use if we use it.
+        :param verbosity_level: Int, how much information to display.
+        :param intra_op_threads: Int, number of threads used by the backend inside an operation (0: chosen by the
+        backend).
+        :param inter_op_threads: Int, number of operations run in parallel by the backend (0: chosen by the backend).
+        :param inference_backend: String, the backend running the network: 'keras', 'tensorflow' (frozen graph),
+        'onnxruntime', 'onnxruntime_int8', or 'auto' (frozen graph if it is up to date, else Keras).
+        """
+
+        # If string, convert to Path objects
+        self.path_model_folder = convert_path(path_model_folder)
+        self.ckpt_name = ckpt_name
+        self.verbosity_level = verbosity_level
+
+        # Ensuring that the config file is valid
+        self.config_dict = update_config(default_configuration(), config_dict)
+
+        # We set the logging from python to a high level, to avoid messages in the console when performing
+        # segmentation.
+        import warnings
+        warnings.filterwarnings('ignore')
+
+        # Network Parameters
+        self.patch_size = self.config_dict["trainingset_patchsize"]
+        self.n_classes = self.config_dict["n_classes"]
+
+        # Number of patches segmented by this object, and number of those detected as background and not fed to the
+        # network (see skip_threshold in segment_stream).
+        self.n_patches = 0
+        self.n_skipped_patches = 0
+
+        self.backend = create_inference_backend(inference_backend, self.path_model_folder, self.config_dict,
+                                                ckpt_name=ckpt_name, gpu_per=gpu_per,
+                                                intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads,
+                                                verbosity_level=verbosity_level)
+
+    @property
+    def session(self):
+        """
+        Session of the backend (Tensorflow or ONNX Runtime), or None once the segmenter is closed.
+        """
+        return None if self.backend is None else self.backend.session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Releases the model.
+        :return: Nothing.
+        """
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+
+    def skipped_patches_summary(self):
+        """
+        Summary of the number of patches detected as background and not fed to the network.
+        :return: String.
+        """
+        return skipped_patches_summary(self.n_skipped_patches, self.n_patches)
+
+    def predict_patches(self, patches, inference_batch_size=1, prediction_proba_activate=False):
+        """
+        Applies the network to a list of patches. The patches are packed into batches of exactly inference_batch_size
+        elements, the last batch being padded with empty patches whose predictions are discarded. When the patches are
+        given as a single array, its full batches are fed to the network as slices of this array, without copy. The
+        labels of each batch are computed by the backend and copied into a single array.
+        :param patches: List or array of patches (arrays of shape (patch_size, patch_size)) to segment.
+        :param inference_batch_size: Int, batch size to use when doing inference.
+        :param prediction_proba_activate: Boolean, whether to compute the probability maps or not.
+        :return: Array of shape (number of patches, patch_size, patch_size) and of dtype uint8, the segmentation of the
+        patches, and optionally array of shape (number of patches, patch_size, patch_size, n_classes), the probability
+        maps of the patches.
+        """
+
+        patch_size = self.patch_size
+        n_patches = len(patches)
+        n_batches = -(-n_patches // inference_batch_size)
+
+        predictions = np.empty((n_patches, patch_size, patch_size), dtype=np.uint8)
+        predictions_proba = None
+        if prediction_proba_activate:
+            predictions_proba = np.empty((n_patches, patch_size, patch_size, self.n_classes), dtype=np.float32)
 
-    predictions_list = []
-    predictions_proba_list = []
+        # The batch buffer is allocated once; the padding of the last batch is left to zero.
+        batch_x = np.zeros((inference_batch_size, patch_size, patch_size, 1), dtype=np.uint8)
 
-    # Inference of complete batches
-    for i in range(it):
+        for i in range(n_batches):
 
-        if verbosity_level >= 3:
-            print(('processing patch %s of %s' % (i + 1, it)))
+            if self.verbosity_level >= 3:
+                print(('processing batch %s of %s' % (i + 1, n_batches)))
 
-        batch_x = np.array(L_data[i * inference_batch_size:(i + 1) * inference_batch_size], dtype=np.uint8)
+            current_patches = patches[i * inference_batch_size:(i + 1) * inference_batch_size]
+            n_valid = len(current_patches)
 
-        if prediction_proba_activate:
+            if isinstance(current_patches, np.ndarray) and n_valid == inference_batch_size:
+                current_batch_x = current_patches.reshape(current_patches.shape[:3] + (1,))
+            else:
+                batch_x[:n_valid, :, :, 0] = current_patches
+                batch_x[n_valid:] = 0
+                current_batch_x = batch_x
 
-            # First we perform inference on the input.
             current_batch_prediction, current_batch_prediction_proba = perform_batch_inference(
-                model, sess, pred, x, batch_x, inference_batch_size, patch_size,
-                n_classes, prediction_proba_activate=prediction_proba_activate)
+                self.backend, current_batch_x, prediction_proba_activate=prediction_proba_activate)
 
-            # Update of the predictions lists.
-            predictions_list.extend(current_batch_prediction)
-            predictions_proba_list.extend(current_batch_prediction_proba)
+            # Update of the predictions, without the padding patches.
+            start = i * inference_batch_size
+            predictions[start:start + n_valid] = current_batch_prediction[:n_valid]
+            if prediction_proba_activate:
+                predictions_proba[start:start + n_valid] = current_batch_prediction_proba[:n_valid]
 
+        if prediction_proba_activate:
+            return predictions, predictions_proba
         else:
-            current_batch_prediction = perform_batch_inference(model, sess, pred, x, batch_x, inference_batch_size,
-                                                               patch_size, n_classes,
-                                                               prediction_proba_activate=prediction_proba_activate)
-            # Update of the predictions lists.
-            predictions_list.extend(current_batch_prediction)
-
-    # Last batch if needed
-
-    if rem != 0:
-
-        if verbosity_level >= 4:
-            print('processing last patch')
-
-        batch_x = np.asarray(L_data[it * inference_batch_size:])
+            return predictions
+
+    def segment(self, path_acquisitions, acquisitions_resolutions, inference_batch_size=1, overlap_value=25,
+                resampled_resolutions=[0.1], prediction_proba_activate=False, n_workers=0, stitching_mode='crop',
+                skip_threshold=None, proba_dtype=np.float32, path_probability_maps=None,
+                resampling_backend='skimage', cache=None):
+        """
+        Preprocesses the images, transform them into patches, applies the network, stitches the predictions and
+        return them.
+        :param path_acquisitions: List of path to the acquisitions, or of acquisitions already loaded as arrays.
+        :param acquisitions_resolutions: List of the acquisitions resolutions (floats).
+        :param inference_batch_size: Int, batch size to use when doing inference.
+        :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
+        :param resampled_resolutions: List of resolutions (floats) to resample to before performing inference.
+        :param prediction_proba_activate: Boolean, whether to compute the probability maps or not.
+        :param n_workers: Int, number of threads used to load and to reconstruct the acquisitions during inference.
+        :param stitching_mode: String, how the segmented patches are stitched: 'crop' keeps the central part of each
+        patch, 'blend' averages the probabilities of the overlapping patches with a smooth window.
+        :param skip_threshold: Float or None. If not None, the patches whose standard deviation of intensity is lower
+        or equal to this value are labelled as background without running the network.
+        :param proba_dtype: Type of the probability maps: np.float32, or np.uint8 for probabilities quantised to 0-255.
+        :param path_probability_maps: List of the paths of the files where to save the probability maps, or None.
+        The .npy files are written as memory maps while the maps are resampled; other paths are saved as compressed
+        .npz files.
+        :param resampling_backend: String, implementation of the resampling of the acquisitions to the resolution of
+        the model: 'skimage', 'area' or 'opencv' (see AxonDeepSeg.resampling.rescale_image).
+        :param cache: ResamplingCache object where the resampled acquisitions are looked up and stored, or None.
+        :return: List of segmentations, and list of probability maps if requested.
+        """
+
+        # If string, convert to Path objects
+        path_acquisitions = convert_acquisitions(path_acquisitions)
+
+        predictions = [None] * len(path_acquisitions)
+        predictions_proba = [None] * len(path_acquisitions)
+
+        for outputs in self.segment_stream(path_acquisitions, acquisitions_resolutions,
+                                           inference_batch_size=inference_batch_size, overlap_value=overlap_value,
+                                           resampled_resolutions=resampled_resolutions,
+                                           prediction_proba_activate=prediction_proba_activate,
+                                           n_workers=n_workers, stitching_mode=stitching_mode,
+                                           skip_threshold=skip_threshold, proba_dtype=proba_dtype,
+                                           path_probability_maps=path_probability_maps,
+                                           resampling_backend=resampling_backend, cache=cache):
+            if prediction_proba_activate:
+                i, predictions[i], predictions_proba[i] = outputs
+            else:
+                i, predictions[i] = outputs
 
         if prediction_proba_activate:
-
-            # First we perform inference on the input.
-            current_batch_prediction, current_batch_prediction_proba = perform_batch_inference(model,
-                                                                                               sess, pred, batch_x, rem,
-                                                                                               patch_size,
-                                                                                               n_classes,
-                                                                                               prediction_proba_activate=prediction_proba_activate)
-
-            # Update of the predictions lists.
-            predictions_list.extend(current_batch_prediction)
-            predictions_proba_list.extend(current_batch_prediction_proba)
-
+            return predictions, predictions_proba
         else:
-            current_batch_prediction = perform_batch_inference(model, sess, pred, batch_x, rem,
-                                                               patch_size, n_classes,
-                                                               prediction_proba_activate=prediction_proba_activate)
-            # Update of the predictions lists.
-            predictions_list.extend(current_batch_prediction)
-
-    # End of the inference step.
-    tf.reset_default_graph()
-
-    # Now we have to transform the list of predictions in list of lists,
-    # one for each full image : we put in each sublist the patches corresponding to a full image.
-
-    ########### STEP 4: Reconstruction of the segmented patches into segmentations of acquisitions and
-    # resampling to the original size
-
-    if prediction_proba_activate:
-
-        predictions, predictions_proba = process_segmented_patches(predictions_list, L_n_patches, L_positions,
-                                                                   original_acquisitions_shapes,
-                                                                   overlap_value, n_classes,
-                                                                   predictions_proba_list=predictions_proba_list,
-                                                                   prediction_proba_activate=prediction_proba_activate,
-                                                                   verbose_mode=0)
-
-        return predictions, predictions_proba
-
-    else:
-        predictions = process_segmented_patches(predictions_list, L_n_patches, L_positions,
-                                                original_acquisitions_shapes,
-                                                overlap_value, n_classes,
-                                                predictions_proba_list=None,
+            return predictions
+
+    def segment_stream(self, path_acquisitions, acquisitions_resolutions, inference_batch_size=1, overlap_value=25,
+                       resampled_resolutions=[0.1], prediction_proba_activate=False, n_workers=0, queue_size=4,
+                       postprocessing=None, stitching_mode='crop', skip_threshold=None, proba_dtype=np.float32,
+                       path_probability_maps=None, resampling_backend='skimage',
+                       cache=None):
+        """
+        Segments a sequence of acquisitions, pooling the patches of consecutive acquisitions into shared inference
+        batches. The acquisitions are loaded one after the other, when their patches are needed, and each segmentation
+        is yielded as soon as all of its patches have been predicted.
+        With n_workers > 0, the segmentation runs as a pipeline: the acquisitions are decoded and resampled by a pool of
+        loading threads, which fill a bounded queue of patch batches consumed by the network, while the stitching, the
+        resampling to the original size and the postprocessing are done by a pool of writing threads.
+        :param path_acquisitions: List of path to the acquisitions, or of acquisitions already loaded as arrays.
+        :param acquisitions_resolutions: List of the acquisitions resolutions (floats).
+        :param inference_batch_size: Int, batch size to use when doing inference.
+        :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
+        :param resampled_resolutions: List of resolutions (floats) to resample to before performing inference.
+        :param prediction_proba_activate: Boolean, whether to compute the probability maps or not.
+        :param n_workers: Int, number of loading threads and of writing threads. 0 runs every step in the calling
+        thread.
+        :param queue_size: Int, maximum number of patch batches waiting for the network.
+        :param postprocessing: Function called on each output tuple once the segmentation is reconstructed (for instance
+        to save it), by the writing threads if n_workers > 0.
+        :param stitching_mode: String, how the segmented patches are stitched: 'crop' or 'blend'.
+        :param skip_threshold: Float or None. If not None, the patches whose standard deviation of intensity is lower
+        or equal to this value (empty background, resin) are labelled as background without running the network. The
+        skipped patches are counted in n_skipped_patches.
+        :param proba_dtype: Type of the probability maps: np.float32, or np.uint8 for probabilities quantised to 0-255.
+        :param path_probability_maps: List of the paths of the files where to save the probability maps, or None.
+        The .npy files are written as memory maps while the maps are resampled; other paths are saved as compressed
+        .npz files.
+        :param resampling_backend: String, implementation of the resampling of the acquisitions to the resolution of
+        the model: 'skimage', 'area' or 'opencv' (see AxonDeepSeg.resampling.rescale_image).
+        :param cache: ResamplingCache object where the resampled acquisitions are looked up and stored, or None.
+        :return: Generator of (index of the acquisition, segmentation) tuples, or of (index of the acquisition,
+        segmentation, probability map) tuples if the probability maps are requested.
+        """
+
+        # If string, convert to Path objects
+        path_acquisitions = convert_acquisitions(path_acquisitions)
+        path_probability_maps = convert_path(path_probability_maps)
+
+        check_stitching_mode(stitching_mode)
+
+        # The blending of the patches is done on their probability maps.
+        compute_proba = prediction_proba_activate or stitching_mode == 'blend'
+
+        acquisitions_resolutions, resampled_resolutions = list(map(
+            ensure_list_type, [acquisitions_resolutions, resampled_resolutions]))
+
+        if len(acquisitions_resolutions) != len(path_acquisitions):
+            acquisitions_resolutions = [acquisitions_resolutions[0]] * len(path_acquisitions)
+
+        if len(resampled_resolutions) != len(path_acquisitions):
+            resampled_resolutions = [resampled_resolutions[0]] * len(path_acquisitions)
+
+        # Acquisitions whose patches are being predicted, indexed by their position in path_acquisitions.
+        pending = {}
+
+        # Predictions of the skipped patches, shared by all of them.
+        background = np.zeros((self.patch_size, self.patch_size), dtype=np.uint8)
+        background_proba = np.zeros((self.patch_size, self.patch_size, self.n_classes), dtype=np.float32)
+        background_proba[..., 0] = 1
+
+        def load(i):
+            # STEP 1: Load and rescale the acquisition, and transform it into patches.
+            rs_acquisitions, _, original_acquisitions_shapes = load_acquisitions(
+                [path_acquisitions[i]], [acquisitions_resolutions[i]], [resampled_resolutions[i]],
+                verbose_mode=self.verbosity_level, resampling_backend=resampling_backend,
+                cache=cache)
+
+            _, patches, positions = im2patches_overlap(rs_acquisitions[0], overlap_value, self.patch_size)
+
+            state = {
+                'shape': original_acquisitions_shapes[0],
+                'positions': positions,
+                'predictions': [None] * len(patches),
+                'predictions_proba': [None] * len(patches),
+                'n_remaining': len(patches),
+                'n_skipped': 0
+            }
+
+            # Only the patches that are not background are fed to the network; indices maps them to their position.
+            indices = np.arange(len(patches))
+            if skip_threshold is not None:
+                skipped = background_patches(patches, skip_threshold)
+                for k in np.flatnonzero(skipped):
+                    state['predictions'][k] = background
+                    state['predictions_proba'][k] = background_proba
+                state['n_skipped'] = int(np.count_nonzero(skipped))
+                state['n_remaining'] -= state['n_skipped']
+                if state['n_skipped'] > 0:
+                    indices, patches = indices[~skipped], patches[~skipped]
+
+            return state, patches, indices
+
+        def finish(i, state):
+            # STEP 3: Reconstruction of the segmented patches of the acquisition and resampling to its original size.
+            # The probability map is resampled directly into its file when it is saved as a .npy file.
+            proba_output = None
+            if prediction_proba_activate and path_probability_maps is not None and \
+                    path_probability_maps[i].suffix == '.npy':
+                proba_output = ads.imwrite_mmap(path_probability_maps[i], tuple(state['shape'][:2]) + (self.n_classes,),
+                                                proba_dtype)
+
+            outputs = process_segmented_patches(state['predictions'], [len(state['predictions'])],
+                                                [state['positions']], [state['shape']],
+                                                overlap_value, self.n_classes,
+                                                predictions_proba_list=state['predictions_proba'],
                                                 prediction_proba_activate=prediction_proba_activate,
-                                                verbose_mode=0)
-
-        return predictions
-
-        #######################################################################################################################
+                                                verbose_mode=0, stitching_mode=stitching_mode,
+                                                proba_dtype=proba_dtype, L_proba_outputs=[proba_output])
+            if prediction_proba_activate:
+                result = (i, outputs[0][0], outputs[1][0])
+                if path_probability_maps is not None:
+                    save_probability_map(result[2], path_probability_maps[i])
+            else:
+                result = (i, outputs[0])
+
+            if postprocessing is not None:
+                postprocessing(*result)
+
+            return result
+
+        def generate_loaded(loader_pool):
+            # The loading threads work at most n_workers acquisitions ahead of the network.
+            if loader_pool is None:
+                for i in range(len(path_acquisitions)):
+                    yield i, load(i)
+            else:
+                loads = collections.deque()
+                for i in range(len(path_acquisitions)):
+                    loads.append((i, loader_pool.submit(load, i)))
+                    if len(loads) > n_workers:
+                        j, future = loads.popleft()
+                        yield j, future.result()
+                while loads:
+                    j, future = loads.popleft()
+                    yield j, future.result()
+
+        def generate_batches(loader_pool):
+            # Each batch comes with the acquisitions loaded since the previous batch, which are registered by the
+            # consumer of the batches.
+            loaded, batch_keys, batch_patches = [], [], []
+
+            for i, (state, patches, indices) in generate_loaded(loader_pool):
+                loaded.append((i, state))
+
+                k = 0
+                while k < len(patches):
+                    if not batch_keys and len(patches) - k >= inference_batch_size:
+                        # Full batch taken from a single acquisition: a slice of its patches array, without copy.
+                        yield loaded, [(i, j) for j in indices[k:k + inference_batch_size]], \
+                            patches[k:k + inference_batch_size]
+                        loaded = []
+                        k += inference_batch_size
+                        continue
+
+                    batch_keys.append((i, indices[k]))
+                    batch_patches.append(patches[k])
+                    k += 1
+
+                    if len(batch_keys) == inference_batch_size:
+                        yield loaded, batch_keys, batch_patches
+                        loaded, batch_keys, batch_patches = [], [], []
+
+            # Last (partial) batch if needed, or acquisitions left without patches to predict
+            if batch_keys or loaded:
+                yield loaded, batch_keys, batch_patches
+
+        def produce(loader_pool, batch_queue, stop):
+            # Fills the queue of batches from a separate thread; the end is marked with None. The thread ends as soon
+            # as the consumer stops, without loading the next acquisitions.
+            def put(item):
+                while not stop.is_set():
+                    try:
+                        batch_queue.put(item, timeout=0.1)
+                        return
+                    except queue.Full:
+                        continue
+
+            try:
+                for item in itertools.chain(generate_batches(loader_pool), [None]):
+                    if stop.is_set():
+                        return
+                    put(item)
+            except Exception as e:
+                # Dropped if the consumer already stopped (the loading pool is then shut down)
+                put(e)
+
+        def consume(batch_queue):
+            while True:
+                item = batch_queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+
+        if self.verbosity_level >= 2:
+            print("Beginning inference ...")
+
+        loader_pool, writer_pool, stop = None, None, threading.Event()
+
+        if n_workers > 0:
+            loader_pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+            writer_pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+            batch_queue = queue.Queue(maxsize=queue_size)
+            producer = threading.Thread(target=produce, args=(loader_pool, batch_queue, stop), daemon=True)
+            producer.start()
+            batches = consume(batch_queue)
+        else:
+            batches = generate_batches(None)
+
+        writes = collections.deque()
+
+        try:
+            for loaded, batch_keys, batch_patches in batches:
+
+                completed = []
+                for i, state in loaded:
+                    pending[i] = state
+                    self.n_patches += len(state['predictions'])
+                    self.n_skipped_patches += state['n_skipped']
+                    if state['n_remaining'] == 0:
+                        # Every patch of the acquisition was skipped
+                        completed.append(i)
+
+                # STEP 2: Inference, then routing of each prediction to its acquisition, at its position.
+                if batch_keys:
+                    outputs = self.predict_patches(batch_patches, inference_batch_size=inference_batch_size,
+                                                   prediction_proba_activate=compute_proba)
+                else:
+                    outputs = ([], []) if compute_proba else []
+                if compute_proba:
+                    batch_predictions, batch_predictions_proba = outputs
+                else:
+                    batch_predictions, batch_predictions_proba = outputs, [None] * len(outputs)
+
+                for (i, k), prediction, prediction_proba in zip(batch_keys, batch_predictions,
+                                                                batch_predictions_proba):
+                    pending[i]['predictions'][k] = prediction
+                    pending[i]['predictions_proba'][k] = prediction_proba
+                    pending[i]['n_remaining'] -= 1
+                    if pending[i]['n_remaining'] == 0:
+                        completed.append(i)
+
+                for i in sorted(completed):
+                    if writer_pool is None:
+                        yield finish(i, pending.pop(i))
+                    else:
+                        writes.append(writer_pool.submit(finish, i, pending.pop(i)))
+
+                # The finished segmentations are returned in order. We wait for the writing threads if too many
+                # segmentations are waiting to be written, to bound the memory used.
+                while writes and (writes[0].done() or len(writes) > 2 * n_workers):
+                    yield writes.popleft().result()
+
+            while writes:
+                yield writes.popleft().result()
+
+        finally:
+            stop.set()
+            if loader_pool is not None:
+                loader_pool.shutdown(wait=False)
+                writer_pool.shutdown(wait=True)
+
+    def segment_tiled(self, path_acquisition, acquisition_resolution, path_segmentation, resampled_resolution=0.1,
+                      tile_size=2048, inference_batch_size=1, overlap_value=25, n_workers=0, stitching_mode='crop',
+                      skip_threshold=None, resampling_backend='skimage'):
+        """
+        Segments an acquisition too large to fit in memory. The acquisition is read region by region (memory-mapped when
+        the file format allows it), one row of tiles at a time, and the segmentation image (values in range 0-255) is
+        written directly into a memory-mapped TIFF (or .npy) file, so the memory used is proportional to a row of tiles.
+        :param path_acquisition: Path to the acquisition.
+        :param acquisition_resolution: Float, the resolution of the acquisition.
+        :param path_segmentation: Path of the segmentation file to create (.tif or .npy).
+        :param resampled_resolution: Float, resolution to resample to before performing inference.
+        :param tile_size: Int, size of the tiles in pixels, at the resampled resolution.
+        :param inference_batch_size: Int, batch size to use when doing inference.
+        :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
+        :param n_workers: Int, number of threads used to resample and reconstruct the tiles during inference.
+        :param stitching_mode: String, how the segmented patches are stitched: 'crop' or 'blend'.
+        :param skip_threshold: Float or None. If not None, the patches whose standard deviation of intensity is lower
+        or equal to this value are labelled as background without running the network.
+        :param resampling_backend: String, implementation of the resampling of the acquisitions to the resolution of
+        the model: 'skimage', 'area' or 'opencv' (see AxonDeepSeg.resampling.rescale_image).
+        :return: the path of the segmentation file.
+        """
+
+        # If string, convert to Path objects
+        path_acquisition = convert_path(path_acquisition)
+        path_segmentation = convert_path(path_segmentation)
+
+        image = ads.imread_lazy(path_acquisition)
+        height, width = image.shape[:2]
+
+        # Sizes in the original resolution: each tile is read with a margin of context around it, which is cropped out
+        # of its segmentation, and is enlarged if needed to still contain a full patch once resampled.
+        resampling_coeff = acquisition_resolution / resampled_resolution
+        tile = max(1, int(round(tile_size / resampling_coeff)))
+        margin = int(np.ceil(overlap_value / resampling_coeff))
+        minimum_size = int(np.ceil(self.patch_size / resampling_coeff)) + 1
+
+        def expand_window(start, stop, size):
+            start, stop = max(0, start - margin), min(size, stop + margin)
+            if stop - start < minimum_size:
+                stop = min(size, start + minimum_size)
+                start = max(0, stop - minimum_size)
+            return start, stop
+
+        # The tiles are scaled to 8 bits with the range of the whole image, as when the image is read in full
+        value_range = ads.image_value_range(image)
+
+        segmentation = ads.imwrite_mmap(path_segmentation, (height, width), np.uint8)
+
+        for y0 in range(0, height, tile):
+            y1 = min(y0 + tile, height)
+            ry0, ry1 = expand_window(y0, y1, height)
+
+            if self.verbosity_level >= 2:
+                print("Segmenting rows {0} to {1} of {2} ...".format(y0, y1, height))
+
+            regions, windows = [], []
+            for x0 in range(0, width, tile):
+                x1 = min(x0 + tile, width)
+                rx0, rx1 = expand_window(x0, x1, width)
+
+                regions.append(ads.image_region_as_uint(image[ry0:ry1, rx0:rx1], value_range=value_range))
+                windows.append((slice(y0, y1), slice(x0, x1), slice(y0 - ry0, y1 - ry0), slice(x0 - rx0, x1 - rx0)))
+
+            tiles_segmentations = self.segment_stream(regions, [acquisition_resolution] * len(regions),
+                                                      inference_batch_size=inference_batch_size,
+                                                      overlap_value=overlap_value,
+                                                      resampled_resolutions=[resampled_resolution] * len(regions),
+                                                      n_workers=n_workers, stitching_mode=stitching_mode,
+                                                      skip_threshold=skip_threshold,
+                                                      resampling_backend=resampling_backend)
+
+            for i, prediction in tiles_segmentations:
+                rows, cols, tile_rows, tile_cols = windows[i]
+                paint_segmentation(prediction[tile_rows, tile_cols], self.n_classes, out=segmentation[rows, cols])
+
+            if hasattr(segmentation, 'flush'):
+                segmentation.flush()
+
+        del segmentation
+
+        return path_segmentation
 
 
 def axon_segmentation(path_acquisitions_folders, acquisitions_filenames, path_model_folder, config_dict,
                       ckpt_name='model',
                       segmentations_filenames=[str(axonmyelin_suffix)], inference_batch_size=1,
                       overlap_value=25, resampled_resolutions=0.1, acquired_resolution=None,
-                      prediction_proba_activate=False, write_mode=True, gpu_per=1.0, verbosity_level=0):
+                      prediction_proba_activate=False, write_mode=True, gpu_per=1.0, verbosity_level=0,
+                      segmenter=None, stitching_mode='crop', skip_threshold=None, proba_dtype=np.float32,
+                      path_probability_maps=None, resampling_backend='skimage', cache=None,
+                      pixel_size_resolver=None, n_writers=2, compress_level=None, inference_backend='auto'):
     """
     Wrapper performing the segmentation of all the requested acquisitions and generates (if requested) the segmentation
     images.
@@ -206,6 +640,25 @@ def axon_segmentation(path_acquisitions_folders, acquisitions_filenames, path_mo
     :param write_mode: Boolean, whether to create segmentation images or not.
     :param gpu_per: Percentage of the GPU to use, if we use it.
     :param verbosity_level: Int, level of verbosity. The higher, the more information is displayed.
+    :param segmenter: Segmenter object with the model already loaded. If None, the model located in path_model_folder
+    is loaded for this call only.
+    :param stitching_mode: String, how the segmented patches are stitched: 'crop' keeps the central part of each patch,
+    'blend' averages the probabilities of the overlapping patches with a smooth window.
+    :param skip_threshold: Float or None. If not None, the patches whose standard deviation of intensity is lower or
+    equal to this value are labelled as background without running the network.
+    :param proba_dtype: Type of the probability maps: np.float32, or np.uint8 for probabilities quantised to 0-255.
+    :param path_probability_maps: List of the paths of the files where to save the probability maps, or None. The
+    .npy files are written as memory maps while the maps are resampled; other paths are saved as compressed .npz files.
+    :param resampling_backend: String, implementation of the resampling of the acquisitions to the resolution of the
+    model: 'skimage', 'area' or 'opencv' (see AxonDeepSeg.resampling.rescale_image).
+    :param cache: ResamplingCache object where the resampled acquisitions are looked up and stored, or None.
+    :param pixel_size_resolver: PixelSizeResolver object finding the pixel size of each acquisition when
+    acquired_resolution is None. If None, the sidecar files, TIFF tags and pixel_size_in_micrometer.txt files are used.
+    :param n_writers: Int, number of threads encoding and writing the segmentation images when write_mode is True.
+    :param compress_level: Int, zlib compression level of the PNG segmentation images, from 0 (fastest) to 9 (smallest
+    files), or None for the default level.
+    :param inference_backend: String, the backend running the network when segmenter is None (see
+    AxonDeepSeg.inference_backends).
     :return: List of predictions, and optionally of probability maps.
     """
 
@@ -229,13 +682,13 @@ def axon_segmentation(path_acquisitions_folders, acquisitions_filenames, path_mo
     # Generating the patch to acquisitions and loading the acquisitions resolutions.
     path_acquisitions = [path_acquisitions_folders[i] / e for i, e in enumerate(acquisitions_filenames)]
 
-    # If we did not receive any resolution we read the pixel size in micrometer from each pixel.
+    # If we did not receive any resolution we find the pixel size in micrometer of each acquisition.
     if acquired_resolution == None:
-        if (path_acquisitions_folders[0] / 'pixel_size_in_micrometer.txt').exists():
-            resolutions_files = [open(path_acquisition_folder / 'pixel_size_in_micrometer.txt', 'r')
-                                 for path_acquisition_folder in path_acquisitions_folders]
-            acquisitions_resolutions = [float(file_.read()) for file_ in resolutions_files]
-        else:
+        if pixel_size_resolver is None:
+            pixel_size_resolver = PixelSizeResolver()
+        acquisitions_resolutions = [pixel_size_resolver.resolve(path_acquisition)
+                                    for path_acquisition in path_acquisitions]
+        if None in acquisitions_resolutions:
             exception_msg = "ERROR: No pixel size is provided, and there is no pixel_size_in_micrometer.txt file in image folder. " \
                             "Please provide a pixel size (using argument -s), or add a pixel_size_in_micrometer.txt file " \
                             "containing the pixel size value."
@@ -248,41 +701,39 @@ def axon_segmentation(path_acquisitions_folders, acquisitions_filenames, path_mo
     # Ensuring that the config file is valid
     config_dict = update_config(default_configuration(), config_dict)
 
-    # Perform the segmentation of all the requested images.
+    # Perform the segmentation of all the requested images, with the already loaded model if one was supplied.
+    if segmenter is not None:
+        outputs = segmenter.segment(path_acquisitions, acquisitions_resolutions,
+                                    inference_batch_size=inference_batch_size, overlap_value=overlap_value,
+                                    resampled_resolutions=resampled_resolutions,
+                                    prediction_proba_activate=prediction_proba_activate,
+                                    stitching_mode=stitching_mode, skip_threshold=skip_threshold,
+                                    proba_dtype=proba_dtype, path_probability_maps=path_probability_maps,
+                                    resampling_backend=resampling_backend, cache=cache)
+    else:
+        outputs = apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder, config_dict,
+                                ckpt_name=ckpt_name, inference_batch_size=inference_batch_size,
+                                overlap_value=overlap_value, resampled_resolutions=resampled_resolutions,
+                                prediction_proba_activate=prediction_proba_activate, gpu_per=gpu_per,
+                                verbosity_level=verbosity_level, stitching_mode=stitching_mode,
+                                skip_threshold=skip_threshold, proba_dtype=proba_dtype,
+                                path_probability_maps=path_probability_maps,
+                                resampling_backend=resampling_backend, cache=cache,
+                                inference_backend=inference_backend)
+
+    # Predictions are shape of image, value = class of pixel
     if prediction_proba_activate:
-        prediction, prediction_proba = apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder,
-                                                     config_dict, ckpt_name=ckpt_name,
-                                                     inference_batch_size=inference_batch_size,
-                                                     overlap_value=overlap_value,
-                                                     resampled_resolutions=resampled_resolutions,
-                                                     prediction_proba_activate=prediction_proba_activate,
-                                                     gpu_per=gpu_per, verbosity_level=verbosity_level)
-        # Predictions are shape of image, value = class of pixel
+        prediction, prediction_proba = outputs
     else:
-        prediction = apply_convnet(path_acquisitions, acquisitions_resolutions, path_model_folder, config_dict,
-                                   ckpt_name=ckpt_name, inference_batch_size=inference_batch_size,
-                                   overlap_value=overlap_value, resampled_resolutions=resampled_resolutions,
-                                   prediction_proba_activate=prediction_proba_activate, gpu_per=gpu_per,
-                                   verbosity_level=verbosity_level)
-        # Predictions are shape of image, value = class of pixel
+        prediction = outputs
 
     # Final part of the function : generating the image if needed/ returning values
     if write_mode:
-        for i, pred in enumerate(prediction):
-            # Transform the prediction to an image
-            n_classes = config_dict['n_classes']
-            paint_vals = [int(255 * float(j) / (n_classes - 1)) for j in range(n_classes)]
-
-            # Create the mask with values in range 0-255
-            mask = np.zeros_like(pred)
-            for j in range(n_classes):
-                mask[pred == j] = paint_vals[j]
-                
-            # Then we save the image
-            image_name = convert_path(acquisitions_filenames[i]).stem
-            ads.imwrite(path_acquisitions_folders[i] / (image_name + segmentations_filenames[i]), mask, 'png')
-
-            axon_prediction, myelin_prediction = get_masks(path_acquisitions_folders[i] / (image_name + segmentations_filenames[i]))
+        with SegmentationWriter(n_workers=n_writers, compress_level=compress_level) as writer:
+            for i, pred in enumerate(prediction):
+                image_name = convert_path(acquisitions_filenames[i]).stem
+                writer.save(pred, path_acquisitions_folders[i] / (image_name + segmentations_filenames[i]),
+                            config_dict['n_classes'])
 
     if prediction_proba_activate:
         return prediction, prediction_proba
@@ -290,6 +741,140 @@ def axon_segmentation(path_acquisitions_folders, acquisitions_filenames, path_mo
         return prediction
 
 
+def save_segmentation(prediction, path_segmentation, n_classes, compress_level=None):
+    """
+    Writes a segmentation as an image with values in range 0-255, as well as the separate axon and myelin masks.
+    :param prediction: Array, the segmentation with the class of each pixel as value.
+    :param path_segmentation: Path of the segmentation image to create.
+    :param n_classes: Int, number of classes.
+    :param compress_level: Int, zlib compression level of the PNG images (0-9), or None for the default level.
+    :return: the axon and myelin masks.
+    """
+    with SegmentationWriter(n_workers=0, compress_level=compress_level) as writer:
+        return writer.save(prediction, path_segmentation, n_classes)
+
+
+class SegmentationWriter(object):
+    """
+    Writes segmentations (the segmentation image and the axon and myelin masks) from a pool of threads, so that the
+    PNG encoding of the images is done in the background. The masks are computed from the segmentation in memory.
+    """
+
+    def __init__(self, n_workers=2, compress_level=None):
+        """
+        :param n_workers: Int, number of writing threads. 0 writes the images in the calling thread.
+        :param compress_level: Int, zlib compression level of the PNG images, from 0 (fastest) to 9 (smallest files),
+        or None for the default level.
+        """
+
+        self.compress_level = compress_level
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) if n_workers > 0 else None
+        self.writes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, path_image, image):
+        """
+        Writes a PNG image, in the background if the writer has threads.
+        :param path_image: Path of the image.
+        :param image: Array of dtype uint8, the image.
+        :return: Nothing.
+        """
+
+        if self.pool is None:
+            ads.imwrite(path_image, image, 'png', compress_level=self.compress_level)
+        else:
+            self.writes.append(self.pool.submit(ads.imwrite, path_image, image, 'png',
+                                                compress_level=self.compress_level))
+
+    def save(self, prediction, path_segmentation, n_classes):
+        """
+        Writes a segmentation as an image with values in range 0-255, as well as the separate axon and myelin masks.
+        :param prediction: Array, the segmentation with the class of each pixel as value.
+        :param path_segmentation: Path of the segmentation image to create.
+        :param n_classes: Int, number of classes.
+        :return: the axon and myelin masks.
+        """
+
+        # Transform the prediction to an image with values in range 0-255
+        mask = paint_segmentation(prediction, n_classes)
+        axon_mask, myelin_mask = split_segmentation(mask)
+        path_axon, path_myelin = masks_paths(path_segmentation)
+
+        self.write(path_segmentation, mask)
+        self.write(path_axon, axon_mask.view(np.uint8) * np.uint8(255))
+        self.write(path_myelin, myelin_mask.view(np.uint8) * np.uint8(255))
+
+        return axon_mask, myelin_mask
+
+    def close(self):
+        """
+        Waits for the images being written, and stops the writing threads.
+        :return: Nothing. Raises the first error raised while writing an image.
+        """
+
+        if self.pool is not None:
+            try:
+                for write in self.writes:
+                    write.result()
+            finally:
+                self.writes = []
+                self.pool.shutdown()
+
+
+def save_probability_map(prediction_proba, path_probability_map):
+    """
+    Saves a probability map. A memory-mapped map is only flushed to its file, a .npy path is saved with np.save and
+    any other path as a compressed .npz file (key 'probabilities').
+    :param prediction_proba: Array of shape (height, width, n_classes), the probability map.
+    :param path_probability_map: Path of the file.
+    :return: Nothing.
+    """
+
+    if isinstance(prediction_proba, np.memmap):
+        prediction_proba.flush()
+    elif path_probability_map.suffix == '.npy':
+        np.save(str(path_probability_map), prediction_proba)
+    else:
+        np.savez_compressed(str(path_probability_map), probabilities=prediction_proba)
+
+
+def convert_acquisitions(acquisitions):
+    """
+    Converts an acquisition or a list of acquisitions to a list of Path objects, leaving untouched the acquisitions
+    that are already loaded as arrays.
+    :param acquisitions: string, Path object or array, or a list of these.
+    :return: list of Path objects and arrays.
+    """
+    return [e if isinstance(e, np.ndarray) else convert_path(e) for e in ensure_list_type(acquisitions)]
+
+
+def paint_segmentation(prediction, n_classes, out=None):
+    """
+    Transforms a segmentation into an image with values in range 0-255 (0: background, 127: myelin, 255: axon).
+    :param prediction: Array, the segmentation with the class of each pixel as value.
+    :param n_classes: Int, number of classes.
+    :param out: Array of dtype uint8 and of the shape of prediction where to write the segmentation image. If None, an
+    array is allocated.
+    :return: Array of dtype uint8, the segmentation image.
+    """
+    paint_vals = [int(255 * float(j) / (n_classes - 1)) for j in range(n_classes)]
+
+    # Lookup table of the value of each class, in one pass over the image. The values that are not classes are painted
+    # 0 (the indices out of the table are clipped to its last entry, and the negative ones to the background).
+    lut = np.zeros(max(256, n_classes + 1), dtype=np.uint8)
+    lut[:n_classes] = paint_vals
+
+    if out is None:
+        out = np.empty(prediction.shape, dtype=np.uint8)
+
+    return np.take(lut, prediction, out=out, mode='clip')
+
+
 def ensure_list_type(elem):
     """
     Transforms the argument elem into a list if it's not already its type.
@@ -301,20 +886,25 @@ def ensure_list_type(elem):
     return elem
 
 
-def load_acquisitions(path_acquisitions, acquisitions_resolutions, resampled_resolutions, verbose_mode=0):
+def load_acquisitions(path_acquisitions, acquisitions_resolutions, resampled_resolutions, verbose_mode=0,
+                      resampling_backend='skimage', cache=None):
     """
     Load and resamples acquisitions located in the indicated folders' paths.
-    :param path_acquisitions: List of paths to the acquisitions images.
+    :param path_acquisitions: List of paths to the acquisitions images. Acquisitions already loaded in memory can also
+    be given as arrays.
     :param acquisitions_resolutions: List of float containing the resolutions the acquisitions were acquired with.
     :param resampled_resolutions: List of resolutions (floats) to resample to.
     :param verbose_mode: Int, how much information to display.
+    :param resampling_backend: String, implementation of the resampling: 'skimage', 'area' or 'opencv' (see
+    AxonDeepSeg.resampling.rescale_image).
+    :param cache: ResamplingCache object where the resampled acquisitions are looked up and stored, or None.
     :return:
     """
     # If string, convert to Path objects
-    path_acquisitions = convert_path(path_acquisitions)
+    path_acquisitions = convert_acquisitions(path_acquisitions)
 
-    path_acquisitions, acquisitions_resolutions, resampled_resolutions = list(map(
-        ensure_list_type, [path_acquisitions, acquisitions_resolutions, resampled_resolutions]))
+    acquisitions_resolutions, resampled_resolutions = list(map(
+        ensure_list_type, [acquisitions_resolutions, resampled_resolutions]))
 
     if verbose_mode >= 2:
         print("Loading acquisitions ...")
@@ -322,12 +912,26 @@ def load_acquisitions(path_acquisitions, acquisitions_resolutions, resampled_res
     # Reading acquisitions images and loading them in the RAM, with their respective acquisition resolution.
     # Then resampling the acquisitions images to the target resolution that the network uses.
 
-    original_acquisitions, resampled_acquisitions, original_acquisitions_shapes = [], [], []
+    # The acquisitions found in the cache are neither read nor resampled.
+
+    resampled_acquisitions = [None] * len(path_acquisitions)
+    original_acquisitions_shapes = [None] * len(path_acquisitions)
+    original_acquisitions, cache_keys = {}, {}
 
-    for path_img in path_acquisitions:
+    for i, path_img in enumerate(path_acquisitions):
 
-        original_acquisitions.append(ads.imread(path_img))
-        original_acquisitions_shapes.append(original_acquisitions[-1].shape)
+        if isinstance(path_img, np.ndarray):
+            original_acquisitions[i] = path_img
+        else:
+            if cache is not None:
+                cache_keys[i] = cache.key(path_img, acquisitions_resolutions[i], resampled_resolutions[i],
+                                          resampling_backend)
+                cached = cache.get(cache_keys[i])
+                if cached is not None:
+                    resampled_acquisitions[i], original_acquisitions_shapes[i] = cached
+                    continue
+            original_acquisitions[i] = ads.imread(path_img)
+        original_acquisitions_shapes[i] = original_acquisitions[i].shape
 
     # Resampling acquisitions to the target resolution
 
@@ -337,9 +941,11 @@ def load_acquisitions(path_acquisitions, acquisitions_resolutions, resampled_res
     resampling_coeffs = [current_acquisition_resolution / resampled_resolutions[i]
                          for i, current_acquisition_resolution in enumerate(acquisitions_resolutions)]
 
-    for i, current_original_acquisition in enumerate(original_acquisitions):
-        resampled_acquisitions.append(rescale(current_original_acquisition, resampling_coeffs[i],
-                                              preserve_range=True).astype(int))
+    for i, current_original_acquisition in original_acquisitions.items():
+        resampled_acquisitions[i] = rescale_image(current_original_acquisition, resampling_coeffs[i],
+                                                  backend=resampling_backend)
+        if i in cache_keys:
+            cache.put(cache_keys[i], resampled_acquisitions[i], original_acquisitions_shapes[i])
 
     return resampled_acquisitions, resampling_coeffs, original_acquisitions_shapes
 
@@ -374,14 +980,15 @@ def prepare_patches(resampled_acquisitions, patch_size, overlap_value=25):
         L_n_patches.append(len(data))
 
     # Now we concatenate the list of patches to process them all together.
-    L_data = [e for sublist in L_data for e in sublist]
+    L_data = np.concatenate(L_data)
 
     return L_data, L_n_patches, L_positions
 
 
 def process_segmented_patches(predictions_list, L_n_patches, L_positions, L_original_acquisitions_shapes,
                               overlap_value, n_classes,
-                              predictions_proba_list=None, prediction_proba_activate=False, verbose_mode=0):
+                              predictions_proba_list=None, prediction_proba_activate=False, verbose_mode=0,
+                              stitching_mode='crop', proba_dtype=np.float32, L_proba_outputs=None):
     """
     Gathers the segmented patches into lists corresponding to each acquisition, stitches them and resamples them.
     :param predictions_list: List of all segmented patches.
@@ -393,9 +1000,17 @@ def process_segmented_patches(predictions_list, L_n_patches, L_positions, L_orig
     :param predictions_proba_list: List of the prediction probabilities for all patches. Optional.
     :param prediction_proba_activate: Boolean, whether to activate or not the prediction of probabilities.
     :param verbose_mode: Int, the level of verbosity.
+    :param stitching_mode: String, how the patches are stitched: 'crop' keeps the central part of each segmented patch,
+    'blend' averages the probabilities of the overlapping patches with a smooth window before taking the most probable
+    class (predictions_proba_list is then required).
+    :param proba_dtype: Type of the probability maps: np.float32, or np.uint8 for probabilities quantised to 0-255.
+    :param L_proba_outputs: List of the arrays where to write the probability map of each acquisition (for instance
+    memory-mapped arrays), of shape (height, width, n_classes). Optional.
     :return: the reconstructed list of segmentations, as well as the list of probability maps for each acquisition,
     if requested.
     """
+    check_stitching_mode(stitching_mode)
+
     patch_size = predictions_list[0].shape[0]
     L_predictions = []
     L_predictions_proba = []
@@ -410,42 +1025,45 @@ def process_segmented_patches(predictions_list, L_n_patches, L_positions, L_orig
         i1 = L_n_patches_cum[i + 1]
         L_predictions.append(predictions_list[i0:i1])
 
-        if prediction_proba_activate:
+        if prediction_proba_activate or stitching_mode == 'blend':
             L_predictions_proba.append(predictions_proba_list[i0:i1])
 
-    # We stitch and resample each segmented patch to reconstruct the total segmentation
-    prediction_stitcheds = [patches2im_overlap(pred_list, L_positions[i], overlap_value, patch_size) for i, pred_list in
-                            enumerate(L_predictions)]
-    predictions = [resize(prediction_stitched, L_original_acquisitions_shapes[i]) for i, prediction_stitched in
-                   enumerate(prediction_stitcheds)]
-    predictions = [prediction.astype(np.uint8) for prediction in
-                   predictions]  # Rescaling operation can change the value of the pixels to float.
+    # We stitch and resample each segmented patch to reconstruct the total segmentation. The labels are stitched in
+    # uint8 arrays.
+    if stitching_mode == 'blend':
+        L_blended_proba = [patches2im_blend(proba_list, L_positions[i], patch_size)
+                           for i, proba_list in enumerate(L_predictions_proba)]
+        prediction_stitcheds = [np.argmax(e, axis=-1).astype(np.uint8) for e in L_blended_proba]
+    else:
+        prediction_stitcheds = [patches2im_overlap(pred_list, L_positions[i], overlap_value, patch_size,
+                                                   out=np.empty(np.max(L_positions[i], axis=0) + patch_size, np.uint8))
+                                for i, pred_list in enumerate(L_predictions)]
+    # The labels are resampled with nearest neighbour interpolation, which keeps them as uint8 and does not create
+    # intermediate labels at the boundaries between classes.
+    predictions = [resize_labels(prediction_stitched, L_original_acquisitions_shapes[i])
+                   for i, prediction_stitched in enumerate(prediction_stitcheds)]
 
     # Performing the same steps for the probability maps
 
     if prediction_proba_activate:
 
-        # First we create an empty list that will store all processed prediction_proba
-        # (meaning reshaped so that each element of the list corresponds to a predicted image,
-        # each element being of shape (patch_size, patch_size, n_classes)
-
+        # Each probability map is stitched with all its classes at once and resampled in float32, directly into its
+        # output array if one is given.
         predictions_proba = []
 
         for i, prediction_proba_list in enumerate(L_predictions_proba):
-            # We generate the predict proba matrix
-            tmp = np.split(np.stack(prediction_proba_list, axis=0), n_classes, axis=-1)
-            predictions_proba_list = [list(map(np.squeeze, np.split(e, L_n_patches[i], axis=0))) for e in
-                                      tmp]  # We now have a list (n_classes elements) of list (n_patches elements)
-            # [ class0:[ patch0:[], patch1:[], ...], class1:[ patch0:[], patch1:[],... ] ... ]
 
-            # Stitching each class
-            prediction_proba_stitched = [patches2im_overlap(e, L_positions[i], overlap_value, patch_size) for j, e in
-                                         enumerate(predictions_proba_list)]  # for each class, we have a list of patches
+            if stitching_mode == 'blend':
+                # The probabilities have already been stitched
+                prediction_proba_stitched = L_blended_proba[i]
+            else:
+                prediction_proba_stitched = patches2im_overlap(
+                    prediction_proba_list, L_positions[i], overlap_value, patch_size,
+                    out=np.empty(tuple(np.max(L_positions[i], axis=0) + patch_size) + (n_classes,), np.float32))
 
-            # Stacking in order to have juste one image with a depth of 3, one for each class
-            prediction_proba = np.stack(
-                [resize(e, L_original_acquisitions_shapes[i]) for e in prediction_proba_stitched], axis=-1)
-            predictions_proba.append(prediction_proba)
+            predictions_proba.append(resize_probabilities(
+                prediction_proba_stitched, L_original_acquisitions_shapes[i], dtype=proba_dtype,
+                out=None if L_proba_outputs is None else L_proba_outputs[i]))
 
         return predictions, predictions_proba
     else:
@@ -453,36 +1071,51 @@ def process_segmented_patches(predictions_list, L_n_patches, L_positions, L_orig
         return predictions
 
 
-def perform_batch_inference(model, tf_session, tf_prediction_op, tf_input, batch_x, size_batch, input_size, n_classes,
-                            prediction_proba_activate=False):
+def background_patches(patches, threshold):
     """
-    Performs the segmentation of all the patches in the batch.
-    :param tf_session: Current Tensorflow session.
-    :param tf_prediction_op: Tensorflow prediction operator.
-    :param batch_x: List, batch of patches to segment.
-    :param size_batch: Int, size of the current batch.
-    :param input_size: Int, size of a patch.
-    :param n_classes: Int, number of classes.
-    :param prediction_proba_activate: Boolean, whether to compute the probability maps or not.
-    :return: List of segmentation of the patches, and optionally list of the probabilty maps for each patch.
+    Detects the patches of background (empty areas, resin) on which the network does not need to be run: the patches
+    whose intensity is almost constant.
+    :param patches: Array of patches, of shape (n_patches, patch_size, patch_size).
+    :param threshold: Float, the maximal standard deviation of the intensity of a background patch.
+    :return: Boolean array of shape (n_patches,), True for the background patches.
     """
 
-    batch_x = np.reshape(batch_x,(size_batch, input_size, input_size, 1))
+    patches = np.asarray(patches)
 
-    p = model.predict(batch_x)
+    # Standard deviation of all the patches at once, accumulated in float32.
+    return patches.std(axis=(1, 2), dtype=np.float32) <= threshold
 
-    Mask = np.argmax(p, axis=3)  # Now Mask is a 256*256 mask with Mask[i,j] = pixel_class
 
-    batch_predictions_list = [np.squeeze(e) for e in np.split(Mask, size_batch, axis=0)]
+def skipped_patches_summary(n_skipped_patches, n_patches):
+    """
+    Summary of the number of patches detected as background and not fed to the network.
+    :param n_skipped_patches: Int, the number of patches skipped as background.
+    :param n_patches: Int, the number of patches segmented.
+    :return: String.
+    """
+    return "{0} of {1} patches skipped as background.".format(n_skipped_patches, n_patches)
 
-    if prediction_proba_activate:
-        # Generating the probas for each element of the batch (basically changing the shape of the prediction)
-        p = p.reshape(size_batch, input_size, input_size, n_classes)
 
-        # Reshaping and adding to the preivous list (each patch is now of size (patch_size, patch_size, n_classes) )
-        batch_predictions_proba_list = [np.squeeze(e) for e in np.split(p, size_batch, axis=0)]
+def check_stitching_mode(stitching_mode):
+    """
+    Checks that the stitching mode is one of the supported modes.
+    :param stitching_mode: String, the stitching mode to check.
+    """
 
-        return batch_predictions_list, batch_predictions_proba_list
+    if stitching_mode not in stitching_modes:
+        raise ValueError("Unknown stitching mode: {0}. Expected one of {1}.".format(stitching_mode, stitching_modes))
 
-    else:
-        return batch_predictions_list
+
+def perform_batch_inference(backend, batch_x, prediction_proba_activate=False):
+    """
+    Performs the segmentation of all the patches in the batch. The labels are computed by the model itself, and the
+    probabilities are only computed and fetched when they are requested.
+    :param backend: InferenceBackend object with the model loaded (see AxonDeepSeg.inference_backends).
+    :param batch_x: Array of shape (batch size, patch size, patch size, 1), batch of patches to segment.
+    :param prediction_proba_activate: Boolean, whether to compute the probability maps or not.
+    :return: Array of shape (batch size, patch size, patch size) and of dtype uint8, the segmentation of the patches,
+    and array of shape (batch size, patch size, patch size, n_classes), their probability maps, or None if they are
+    not requested.
+    """
+
+    return backend.predict(batch_x, prediction_proba_activate=prediction_proba_activate)
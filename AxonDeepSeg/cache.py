@@ -0,0 +1,185 @@
+# On-disk cache of the acquisitions resampled to the resolution of a model, so that segmenting the same images again
+# (with another checkpoint, overlap value or model) does not decode and resample them again.
+
+import os
+import hashlib
+import threading
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from AxonDeepSeg.ads_utils import convert_path
+
+default_cache_folder = Path.home() / '.axondeepseg' / 'resampling_cache'
+default_cache_size = 2 * 1024 ** 3  # bytes
+
+# Content hashes of the files already hashed by this process, indexed by (path, size, modification time). They are
+# shared by the resampling cache and the segmentation manifests (see AxonDeepSeg.incremental), so that each image is
+# read once to be hashed.
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+
+def file_sha256(path_file):
+    """
+    Computes the hash of the content of a file, read by blocks.
+    :param path_file: Path of the file.
+    :return: String, the hexadecimal SHA-256 digest of the file.
+    """
+
+    sha = hashlib.sha256()
+    with open(str(path_file), 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def file_hash(path_file):
+    """
+    Computes the hash of the content of a file, reusing the previous hash if the file has not been modified since.
+    :param path_file: Path of the file.
+    :return: String, the hexadecimal SHA-256 digest of the file.
+    """
+
+    stat = os.stat(str(path_file))
+    file_id = (os.path.abspath(str(path_file)), stat.st_size, stat.st_mtime_ns)
+
+    with _file_hashes_lock:
+        digest = _file_hashes.get(file_id)
+
+    if digest is None:
+        digest = file_sha256(path_file)
+        with _file_hashes_lock:
+            _file_hashes[file_id] = digest
+
+    return digest
+
+
+class ResamplingCache(object):
+    """
+    Cache of resampled acquisitions, stored as .npz files named after a key computed from the content of the
+    acquisition file, its pixel size, the target resolution and the resampling backend. When the files exceed the size
+    limit, the least recently used ones are deleted.
+    """
+
+    def __init__(self, path_cache_folder=default_cache_folder, max_size=default_cache_size):
+        """
+        :param path_cache_folder: Path of the folder where the resampled acquisitions are stored. Created if needed.
+        :param max_size: Int, maximal size of the cache, in bytes.
+        """
+
+        self.path_cache_folder = convert_path(path_cache_folder)
+        self.path_cache_folder.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+
+    def key(self, path_acquisition, acquisition_resolution, resampled_resolution, resampling_backend='skimage'):
+        """
+        Computes the key of a resampled acquisition.
+        :param path_acquisition: Path of the acquisition file.
+        :param acquisition_resolution: Float, the pixel size of the acquisition.
+        :param resampled_resolution: Float, the resolution the acquisition is resampled to.
+        :param resampling_backend: String, the implementation of the resampling.
+        :return: String, the key.
+        """
+
+        parameters = '{0!r}-{1!r}-{2}'.format(float(acquisition_resolution), float(resampled_resolution),
+                                                resampling_backend)
+        return hashlib.sha256((file_hash(path_acquisition) + parameters).encode()).hexdigest()
+
+    def path(self, key):
+        """
+        :param key: String, the key of a resampled acquisition.
+        :return: the path of the file of the resampled acquisition.
+        """
+        return self.path_cache_folder / (key + '.npz')
+
+    def get(self, key):
+        """
+        Reads a resampled acquisition from the cache.
+        :param key: String, the key of the resampled acquisition.
+        :return: the resampled acquisition and the shape of the original acquisition, or None if the key is not in the
+        cache.
+        """
+
+        path_entry = self.path(key)
+
+        try:
+            with np.load(str(path_entry)) as entry:
+                resampled_acquisition = entry['resampled']
+                original_shape = tuple(int(e) for e in entry['original_shape'])
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+        # The modification time of the entry records its last use, for the eviction.
+        try:
+            os.utime(str(path_entry))
+        except OSError:
+            pass
+
+        return resampled_acquisition, original_shape
+
+    def put(self, key, resampled_acquisition, original_shape):
+        """
+        Stores a resampled acquisition in the cache, then deletes the least recently used entries if the cache is too
+        large.
+        :param key: String, the key of the resampled acquisition.
+        :param resampled_acquisition: Array, the resampled acquisition.
+        :param original_shape: Tuple, the shape of the original acquisition.
+        :return: Nothing.
+        """
+
+        # The entry is written to a temporary file and then renamed, so that a partially written entry is never read.
+        fd, path_tmp = tempfile.mkstemp(suffix='.tmp', dir=str(self.path_cache_folder))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, resampled=resampled_acquisition, original_shape=np.array(original_shape))
+            os.replace(path_tmp, str(self.path(key)))
+        except Exception:
+            if os.path.exists(path_tmp):
+                os.remove(path_tmp)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache fits in its size limit.
+        :return: Nothing.
+        """
+
+        with self._lock:
+            entries = []
+            for path_entry in self.path_cache_folder.glob('*.npz'):
+                try:
+                    stat = path_entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path_entry))
+
+            total_size = sum(size for _, size, _ in entries)
+
+            for _, size, path_entry in sorted(entries, key=lambda e: e[0]):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    path_entry.unlink()
+                except OSError:
+                    pass
+                total_size -= size
+
+    def clear(self):
+        """
+        Deletes all the entries of the cache.
+        :return: Nothing.
+        """
+
+        with self._lock:
+            for path_entry in self.path_cache_folder.glob('*.npz'):
+                try:
+                    path_entry.unlink()
+                except OSError:
+                    pass
@@ -0,0 +1,126 @@
+# Incremental segmentation of folders: a manifest stored next to the segmentations records, for each image, the hash of
+# the image and the parameters of its segmentation, so that the images whose inputs did not change are not segmented
+# again.
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.cache import file_hash
+
+manifest_name = 'segmentation_manifest.json'
+manifest_version = 1
+
+
+def model_checksum(path_model, config, ckpt_name='model'):
+    """
+    Computes a checksum of a model: the hashes of its checkpoint files and its configuration. The checkpoint files
+    are only hashed once per process, unless they are modified (see AxonDeepSeg.cache.file_hash).
+    :param path_model: Path of the model folder.
+    :param config: Dict, the configuration of the network.
+    :param ckpt_name: String, the name of the checkpoint.
+    :return: String, the checksum of the model.
+    """
+
+    path_model = convert_path(path_model)
+    hashes = ['{0}:{1}'.format(path_ckpt.name, file_hash(path_ckpt))
+              for path_ckpt in sorted(path_model.glob(ckpt_name + '.ckpt*'))]
+    hashes.append(json.dumps(config, sort_keys=True))
+
+    return hashlib.sha256('\n'.join(hashes).encode()).hexdigest()
+
+
+class SegmentationManifest(object):
+    """
+    Manifest of the segmentations of a folder, stored as a JSON file in the folder. Each entry is indexed by the name of
+    an image and contains the hash of the image and the parameters of its segmentation (model checksum, overlap,
+    resolutions, ...).
+    """
+
+    def __init__(self, path_folder, parameters):
+        """
+        Reads the manifest of a folder, if it exists.
+        :param path_folder: Path of the folder of the images and their segmentations.
+        :param parameters: Dict, the parameters of the current segmentation. Must be serializable to JSON.
+        """
+
+        self.path_manifest = convert_path(path_folder) / manifest_name
+        # The parameters go through JSON so that they compare equal to the ones read from the manifest.
+        self.parameters = json.loads(json.dumps(parameters))
+        self.entries = {}
+
+        self._lock = threading.Lock()
+
+        try:
+            with open(str(self.path_manifest), 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == manifest_version:
+                self.entries = manifest['images']
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            # A missing or unreadable manifest only means that every image is segmented again.
+            self.entries = {}
+
+    def entry(self, path_image, **fields):
+        """
+        :param path_image: Path of an image of the folder.
+        :param fields: the parameters of the segmentation specific to the image (for instance its pixel size).
+        :return: Dict, the entry of the image for the current segmentation.
+        """
+
+        # The hash of the image is shared with the resampling cache (see AxonDeepSeg.cache.file_hash)
+        entry = {'image_hash': file_hash(path_image)}
+        entry.update(self.parameters)
+        entry.update(json.loads(json.dumps(fields)))
+
+        return entry
+
+    def is_up_to_date(self, path_image, path_segmentation, **fields):
+        """
+        Checks if the segmentation of an image was done with the same image and the same parameters.
+        :param path_image: Path of the image.
+        :param path_segmentation: Path of the segmentation of the image.
+        :param fields: the parameters of the segmentation specific to the image.
+        :return: Bool, True if the segmentation exists and the image and the parameters did not change.
+        """
+
+        path_image = convert_path(path_image)
+
+        if not convert_path(path_segmentation).exists():
+            return False
+
+        return self.entries.get(path_image.name) == self.entry(path_image, **fields)
+
+    def record(self, path_image, **fields):
+        """
+        Records that an image was segmented with the current parameters, and writes the manifest so that the
+        segmentations already done are kept if the run is interrupted.
+        :param path_image: Path of the image.
+        :param fields: the parameters of the segmentation specific to the image.
+        :return: Nothing.
+        """
+
+        entry = self.entry(path_image, **fields)
+
+        with self._lock:
+            self.entries[convert_path(path_image).name] = entry
+            self.save()
+
+    def save(self):
+        """
+        Writes the manifest. It is written to a temporary file and then renamed, so that a partially written manifest is
+        never read.
+        :return: Nothing.
+        """
+
+        fd, path_tmp = tempfile.mkstemp(suffix='.tmp', dir=str(self.path_manifest.parent))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': manifest_version, 'images': self.entries}, f, indent=2, sort_keys=True)
+            os.replace(path_tmp, str(self.path_manifest))
+        except Exception:
+            if os.path.exists(path_tmp):
+                os.remove(path_tmp)
+            raise
@@ -0,0 +1,255 @@
+# Backends running the network on batches of patches for the Segmenter (see AxonDeepSeg.apply_model): the Keras model
+# built from the checkpoint, the frozen Tensorflow graph exported from it, or the ONNX model exported from the frozen
+# graph (see AxonDeepSeg.model_export), or its int8 quantisation (see AxonDeepSeg.quantization), run by ONNX Runtime.
+
+import numpy as np
+
+from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.model_export import read_frozen_model_metadata, frozen_model_paths
+
+# 'auto' uses the frozen Tensorflow graph when it is up to date, and the Keras model otherwise.
+inference_backends = ['auto', 'keras', 'tensorflow', 'onnxruntime', 'onnxruntime_int8']
+
+# Format of the model exported for each backend, see AxonDeepSeg.model_export.frozen_model_paths
+backend_export_formats = {'tensorflow': 'tensorflow', 'onnxruntime': 'onnx', 'onnxruntime_int8': 'onnx_int8'}
+
+# Tool writing the exported model of each backend
+backend_export_tools = {'tensorflow': 'axondeepseg_export_model',
+                        'onnxruntime': 'axondeepseg_export_model --format onnx',
+                        'onnxruntime_int8': 'axondeepseg_quantize_model'}
+
+
+class InferenceBackend(object):
+    """
+    Interface of the backends: a model loaded in memory that predicts the labels, and optionally the probabilities, of
+    batches of patches.
+    """
+
+    def predict(self, batch_x, prediction_proba_activate=False):
+        """
+        Applies the network to a batch of patches.
+        :param batch_x: Array of shape (batch size, patch size, patch size, 1) and of dtype uint8, the patches.
+        :param prediction_proba_activate: Boolean, whether to compute the probability maps or not.
+        :return: Array of shape (batch size, patch size, patch size) and of dtype uint8, the labels of the patches, and
+        array of shape (batch size, patch size, patch size, number of classes), their probabilities, or None if they are
+        not requested.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Releases the model.
+        :return: Nothing.
+        """
+        pass
+
+
+class KerasBackend(InferenceBackend):
+    """
+    Keras model built with uconv_net and restored from the checkpoint, in its own Tensorflow graph and session. The
+    uint8 labels are computed in the graph, after the softmax of the model, so that the probabilities are only fetched
+    when they are requested.
+    """
+
+    def __init__(self, path_model_folder, config_dict, ckpt_name='model', session_config=None, verbosity_level=0):
+        """
+        :param path_model_folder: Path to the model folder.
+        :param config_dict: Dictionary containing the model's parameters (completed with the default configuration).
+        :param ckpt_name: String, checkpoint to use.
+        :param session_config: tf.ConfigProto of the session, or None.
+        :param verbosity_level: Int, how much information to display.
+        """
+
+        import tensorflow as tf
+        from keras import backend as K
+        from AxonDeepSeg.network_construction import uconv_net
+
+        # Construction of the graph.
+        if verbosity_level >= 2:
+            print("Graph construction ...")
+
+        self.graph = tf.Graph()
+
+        with self.graph.as_default():
+
+            self.model = uconv_net(config_dict, bn_updated_decay=None, verbose=True)  # inference
+            self.labels = tf.cast(tf.argmax(self.model.output, axis=-1, output_type=tf.int32), tf.uint8)
+
+            # The layers that behave differently during training are run in inference mode, as by model.predict.
+            self.feed_dict = {K.learning_phase(): 0} if self.model.uses_learning_phase else {}
+
+            saver = tf.train.Saver()  # Load previous model
+
+            # Launch the session (this part takes time). All images will be processed by loading the session just once.
+            self.session = tf.Session(graph=self.graph, config=session_config)
+            K.set_session(self.session)
+
+            model_previous_path = convert_path(path_model_folder).joinpath(ckpt_name).with_suffix('.ckpt')
+            saver.restore(self.session, str(model_previous_path))
+
+    def predict(self, batch_x, prediction_proba_activate=False):
+        feed_dict = dict(self.feed_dict)
+        feed_dict[self.model.input] = batch_x
+
+        if prediction_proba_activate:
+            return tuple(self.session.run([self.labels, self.model.output], feed_dict=feed_dict))
+
+        return self.session.run(self.labels, feed_dict=feed_dict), None
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+
+class FrozenGraphBackend(InferenceBackend):
+    """
+    Frozen Tensorflow graph of the model, which computes the labels itself: the probabilities are only computed when
+    they are requested.
+    """
+
+    def __init__(self, path_model_folder, metadata, ckpt_name='model', session_config=None, verbosity_level=0):
+        """
+        :param path_model_folder: Path to the model folder.
+        :param metadata: Dict, the description of the frozen graph (see read_frozen_model_metadata).
+        :param ckpt_name: String, checkpoint the graph was exported from.
+        :param session_config: tf.ConfigProto of the session, or None.
+        :param verbosity_level: Int, how much information to display.
+        """
+
+        import tensorflow as tf
+
+        if verbosity_level >= 2:
+            print("Loading of the frozen graph ...")
+
+        path_graph, _ = frozen_model_paths(path_model_folder, ckpt_name, 'tensorflow')
+        graph_def = tf.GraphDef()
+        with open(str(path_graph), 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+        self.tensors = {key: self.graph.get_tensor_by_name(metadata[key])
+                        for key in ('input', 'labels', 'probabilities')}
+        self.session = tf.Session(graph=self.graph, config=session_config)
+
+    def predict(self, batch_x, prediction_proba_activate=False):
+        feed_dict = {self.tensors['input']: batch_x}
+
+        if prediction_proba_activate:
+            return tuple(self.session.run([self.tensors['labels'], self.tensors['probabilities']],
+                                          feed_dict=feed_dict))
+
+        return self.session.run(self.tensors['labels'], feed_dict=feed_dict), None
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    ONNX model exported from the frozen graph, or its int8 quantisation, run on the CPU by ONNX Runtime with all its
+    graph optimisations.
+    """
+
+    def __init__(self, path_model_folder, metadata, ckpt_name='model', intra_op_threads=0, inter_op_threads=0,
+                 verbosity_level=0, export_format='onnx'):
+        """
+        :param path_model_folder: Path to the model folder.
+        :param metadata: Dict, the description of the ONNX model (see read_frozen_model_metadata).
+        :param ckpt_name: String, checkpoint the model was exported from.
+        :param intra_op_threads: Int, number of threads used inside an operation (0: chosen by ONNX Runtime).
+        :param inter_op_threads: Int, number of operations run in parallel (0: chosen by ONNX Runtime).
+        :param verbosity_level: Int, how much information to display.
+        :param export_format: String, the format of the ONNX model: 'onnx' (float) or 'onnx_int8'.
+        """
+
+        import onnxruntime
+
+        if verbosity_level >= 2:
+            print("Loading of the ONNX model ...")
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        path_onnx_model, _ = frozen_model_paths(path_model_folder, ckpt_name, export_format)
+        self.session = onnxruntime.InferenceSession(str(path_onnx_model), sess_options=options)
+        self.names = {key: metadata[key] for key in ('input', 'labels', 'probabilities')}
+
+    def predict(self, batch_x, prediction_proba_activate=False):
+        feed_dict = {self.names['input']: np.ascontiguousarray(batch_x)}
+
+        if prediction_proba_activate:
+            return tuple(self.session.run([self.names['labels'], self.names['probabilities']], feed_dict))
+
+        return self.session.run([self.names['labels']], feed_dict)[0], None
+
+    def close(self):
+        self.session = None
+
+
+def create_inference_backend(inference_backend, path_model_folder, config_dict, ckpt_name='model', gpu_per=1.0,
+                             intra_op_threads=0, inter_op_threads=0, verbosity_level=0):
+    """
+    Loads a model with an inference backend.
+    :param inference_backend: String, the backend: 'keras', 'tensorflow' (frozen graph), 'onnxruntime',
+    'onnxruntime_int8' (int8 quantised ONNX model), or 'auto' for the frozen graph if it is up to date and the Keras
+    model otherwise.
+    :param path_model_folder: Path to the model folder.
+    :param config_dict: Dictionary containing the model's parameters (completed with the default configuration).
+    :param ckpt_name: String, checkpoint to use.
+    :param gpu_per: Float, percentage of GPU to use if we use it (Tensorflow backends).
+    :param intra_op_threads: Int, number of threads used inside an operation (0: chosen by the backend).
+    :param inter_op_threads: Int, number of operations run in parallel (0: chosen by the backend).
+    :param verbosity_level: Int, how much information to display.
+    :return: InferenceBackend object.
+    """
+
+    if inference_backend not in inference_backends:
+        raise ValueError("Unknown inference backend: {0}. Expected one of {1}.".format(inference_backend,
+                                                                                     inference_backends))
+
+    metadata = None
+    if inference_backend != 'keras':
+        metadata = read_frozen_model_metadata(path_model_folder, config_dict, ckpt_name,
+                                              backend_export_formats.get(inference_backend, 'tensorflow'))
+
+    if metadata is None:
+        if inference_backend == 'auto':
+            inference_backend = 'keras'
+        elif inference_backend != 'keras':
+            raise ValueError("The model {0} has no up to date export for the {1} backend. Export it with "
+                             "{2}.".format(path_model_folder, inference_backend,
+                                           backend_export_tools[inference_backend]))
+    elif inference_backend == 'auto':
+        inference_backend = 'tensorflow'
+
+    if inference_backend in ('onnxruntime', 'onnxruntime_int8'):
+        return OnnxRuntimeBackend(path_model_folder, metadata, ckpt_name, intra_op_threads=intra_op_threads,
+                                  inter_op_threads=inter_op_threads, verbosity_level=verbosity_level,
+                                  export_format=backend_export_formats[inference_backend])
+
+    import tensorflow as tf
+
+    # We set the logging from Tensorflow to a high level, to avoid messages in the console when performing segmentation.
+    from logging import ERROR
+    tf.logging.set_verbosity(ERROR)
+
+    # We limit the amount of GPU for inference
+    session_config = tf.ConfigProto(log_device_placement=False,
+                                    intra_op_parallelism_threads=intra_op_threads,
+                                    inter_op_parallelism_threads=inter_op_threads)
+    session_config.gpu_options.per_process_gpu_memory_fraction = gpu_per
+
+    if inference_backend == 'tensorflow':
+        return FrozenGraphBackend(path_model_folder, metadata, ckpt_name, session_config=session_config,
+                                  verbosity_level=verbosity_level)
+
+    return KerasBackend(path_model_folder, config_dict, ckpt_name, session_config=session_config,
+                        verbosity_level=verbosity_level)
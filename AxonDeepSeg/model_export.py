@@ -0,0 +1,467 @@
+# Export of a trained model to a frozen, inference-only Tensorflow graph: the weights are stored as constants, the
+# batch normalizations are folded into the convolutions, the dropout layers are removed, and the graph directly outputs
+# the uint8 labels (argmax of the logits) next to the probabilities. The Segmenter loads this graph, when it is up to date,
+# instead of building the network with uconv_net and restoring the checkpoint. The frozen graph can also be converted
+# to an ONNX model, run by the onnxruntime inference backend (see AxonDeepSeg.inference_backends), and the ONNX model
+# quantised to int8 (see AxonDeepSeg.quantization).
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.config_tools import update_config, default_configuration
+from AxonDeepSeg.incremental import model_checksum
+
+frozen_model_suffix = '_frozen'
+# Version 2: the labels are uint8 instead of int64.
+frozen_model_version = 2
+
+# Extension of the exported model for each format
+export_formats = {'tensorflow': '.pb', 'onnx': '.onnx', 'onnx_int8': '_int8.onnx'}
+default_onnx_opset = 10
+
+# Names of the tensors of the frozen graph
+input_tensor_name = 'input:0'
+labels_tensor_name = 'labels:0'
+probabilities_tensor_name = 'probabilities:0'
+
+
+def frozen_model_paths(path_model_folder, ckpt_name='model', export_format='tensorflow'):
+    '''
+    :param path_model_folder: Path of the model folder.
+    :param ckpt_name: String, the name of the checkpoint.
+    :param export_format: String, the format of the exported model: 'tensorflow', 'onnx' or 'onnx_int8'.
+    :return: tuple (path of the exported model, path of its description), in the model folder.
+    '''
+
+    path_model = convert_path(path_model_folder) / (ckpt_name + frozen_model_suffix + export_formats[export_format])
+
+    return path_model, path_model.with_name(path_model.name + '.json')
+
+
+def checkpoint_files_stats(path_model_folder, ckpt_name='model'):
+    '''
+    :param path_model_folder: Path of the model folder.
+    :param ckpt_name: String, the name of the checkpoint.
+    :return: Dict, the size and the modification time (in nanoseconds) of each file of the checkpoint, indexed by name.
+    '''
+
+    stats = {}
+    for path_ckpt in sorted(convert_path(path_model_folder).glob(ckpt_name + '.ckpt*')):
+        stat = path_ckpt.stat()
+        stats[path_ckpt.name] = [stat.st_size, stat.st_mtime_ns]
+
+    return stats
+
+
+def read_frozen_model_metadata(path_model_folder, config_dict, ckpt_name='model', export_format='tensorflow'):
+    '''
+    Reads the description of an exported model, and checks that it was exported from the current checkpoint and
+    configuration. The checkpoint is only hashed if the size or modification time of one of its files changed since
+    the export; the description is then updated so that the next reads do not hash it again.
+    :param path_model_folder: Path of the model folder.
+    :param config_dict: Dictionary containing the model's parameters.
+    :param ckpt_name: String, the name of the checkpoint.
+    :param export_format: String, the format of the exported model: 'tensorflow', 'onnx' or 'onnx_int8'.
+    :return: Dict, the description of the exported model, or None if there is none or if it is out of date.
+    '''
+
+    path_graph, path_metadata = frozen_model_paths(path_model_folder, ckpt_name, export_format)
+
+    if not (path_graph.exists() and path_metadata.exists()):
+        return None
+
+    try:
+        with open(str(path_metadata), 'r') as f:
+            metadata = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    config_dict = update_config(default_configuration(), config_dict)
+    if metadata.get('version') != frozen_model_version:
+        return None
+
+    # The configuration goes through JSON so that it compares equal to the one read from the description.
+    checkpoint_files = checkpoint_files_stats(path_model_folder, ckpt_name)
+    if metadata.get('checkpoint_files') == checkpoint_files and \
+            metadata.get('config') == json.loads(json.dumps(config_dict)):
+        return metadata
+
+    if metadata.get('model_checksum') != model_checksum(path_model_folder, config_dict, ckpt_name):
+        return None
+
+    # Same checkpoint with other modification times (copied model for instance)
+    metadata.update(checkpoint_files=checkpoint_files, config=config_dict)
+    try:
+        with open(str(path_metadata), 'w') as f:
+            json.dump(metadata, f, indent=2)
+    except (IOError, OSError):
+        pass
+
+    return metadata
+
+
+def batch_norm_coefficients(gamma, beta, moving_mean, moving_variance, epsilon):
+    '''
+    Computes the coefficients of an inference batch normalization, which is the affine transformation
+    x * scale + offset of each channel.
+    :param gamma: Array of shape (channels,), the scale of the batch normalization, or None if it has none.
+    :param beta: Array of shape (channels,), the offset of the batch normalization, or None if it has none.
+    :param moving_mean: Array of shape (channels,), the moving mean of the batch normalization.
+    :param moving_variance: Array of shape (channels,), the moving variance of the batch normalization.
+    :param epsilon: Float, the epsilon of the batch normalization.
+    :return: tuple (scale, offset), arrays of shape (channels,) of dtype float32.
+    '''
+
+    scale = 1. / np.sqrt(moving_variance.astype(np.float64) + epsilon)
+    if gamma is not None:
+        scale = scale * gamma
+
+    offset = -moving_mean * scale
+    if beta is not None:
+        offset = offset + beta
+
+    return scale.astype(np.float32), offset.astype(np.float32)
+
+
+def fold_batch_norm(kernel, bias, gamma, beta, moving_mean, moving_variance, epsilon):
+    '''
+    Folds an inference batch normalization into the convolution that precedes it: bn(conv(x, kernel) + bias) is equal to
+    conv(x, folded kernel) + folded bias.
+    :param kernel: Array of shape (height, width, input channels, output channels), the kernel of the convolution.
+    :param bias: Array of shape (output channels,), the bias of the convolution, or None if it has none.
+    :param gamma: Array of shape (output channels,), the scale of the batch normalization, or None if it has none.
+    :param beta: Array of shape (output channels,), the offset of the batch normalization, or None if it has none.
+    :param moving_mean: Array of shape (output channels,), the moving mean of the batch normalization.
+    :param moving_variance: Array of shape (output channels,), the moving variance of the batch normalization.
+    :param epsilon: Float, the epsilon of the batch normalization.
+    :return: tuple (folded kernel, folded bias), of dtype float32.
+    '''
+
+    scale, offset = batch_norm_coefficients(gamma, beta, moving_mean, moving_variance, epsilon)
+
+    folded_kernel = (kernel * scale).astype(np.float32)
+    folded_bias = offset if bias is None else (bias * scale + offset).astype(np.float32)
+
+    return folded_kernel, folded_bias
+
+
+def inbound_layers(layer):
+    '''
+    :param layer: Keras layer of a model where each layer is called once.
+    :return: list of the layers whose outputs are the inputs of the layer.
+    '''
+
+    nodes = layer._inbound_nodes if hasattr(layer, '_inbound_nodes') else layer.inbound_nodes
+    return list(nodes[0].inbound_layers)
+
+
+def n_outbound_nodes(layer):
+    nodes = layer._outbound_nodes if hasattr(layer, '_outbound_nodes') else layer.outbound_nodes
+    return len(nodes)
+
+
+def activation_name(layer):
+    return layer.get_config().get('activation', 'linear')
+
+
+def build_inference_graph(model, session, patch_size):
+    '''
+    Builds the inference graph of a Keras U-net (see AxonDeepSeg.network_construction.uconv_net) from its layers and
+    the values of its weights: the weights become constants, each batch normalization that follows a convolution is
+    folded into it, and the dropout layers are removed. The input is a batch of uint8 patches, and the graph outputs
+    the probabilities (softmax of the logits) and the uint8 labels (argmax of the logits, which is the argmax of the
+    probabilities without computing them).
+    :param model: Keras model, the network.
+    :param session: Tensorflow session where the weights of the model are restored.
+    :param patch_size: Int, the size of the patches.
+    :return: the Tensorflow graph.
+    '''
+
+    import tensorflow as tf
+
+    layers = model.layers
+
+    # Batch normalizations folded into the convolution that precedes them, indexed by the name of the convolution.
+    folded = {}
+    for layer in layers:
+        if type(layer).__name__ == 'BatchNormalization':
+            inbound, = inbound_layers(layer)
+            if type(inbound).__name__ == 'Conv2D' and activation_name(inbound) == 'linear' and \
+                    n_outbound_nodes(inbound) == 1:
+                folded[inbound.name] = layer
+
+    output_layer = layers[-1]
+    if type(output_layer).__name__ != 'Conv2D' or activation_name(output_layer) != 'softmax':
+        raise ValueError("The last layer of the model must be a convolution with a softmax activation.")
+
+    graph = tf.Graph()
+    tensors = {}
+
+    with graph.as_default():
+        x = tf.placeholder(tf.uint8, shape=(None, patch_size, patch_size, 1), name='input')
+
+        for layer in layers:
+            layer_type = type(layer).__name__
+
+            if layer_type == 'InputLayer':
+                tensors[layer.name] = tf.cast(x, tf.float32)
+                continue
+
+            inputs = [tensors[inbound.name] for inbound in inbound_layers(layer)]
+
+            with tf.name_scope(layer.name):
+
+                if layer_type == 'Conv2D':
+                    kernel = session.run(layer.kernel)
+                    bias = session.run(layer.bias) if layer.use_bias else None
+
+                    if layer.name in folded:
+                        bn = folded[layer.name]
+                        kernel, bias = fold_batch_norm(
+                            kernel, bias,
+                            session.run(bn.gamma) if bn.scale else None,
+                            session.run(bn.beta) if bn.center else None,
+                            session.run(bn.moving_mean), session.run(bn.moving_variance), bn.epsilon)
+
+                    net = tf.nn.conv2d(inputs[0], tf.constant(kernel), strides=(1,) + tuple(layer.strides) + (1,),
+                                       padding=layer.padding.upper(),
+                                       dilations=(1,) + tuple(layer.dilation_rate) + (1,))
+                    if bias is not None:
+                        net = tf.nn.bias_add(net, tf.constant(bias))
+
+                    activation = 'linear' if layer is output_layer else activation_name(layer)
+
+                elif layer_type == 'BatchNormalization':
+                    if inbound_layers(layer)[0].name in folded:
+                        tensors[layer.name] = inputs[0]
+                        continue
+
+                    # A batch normalization that cannot be folded is kept as an affine transformation of the channels.
+                    scale, offset = batch_norm_coefficients(session.run(layer.gamma) if layer.scale else None,
+                                                            session.run(layer.beta) if layer.center else None,
+                                                            session.run(layer.moving_mean),
+                                                            session.run(layer.moving_variance), layer.epsilon)
+                    net = inputs[0] * tf.constant(scale) + tf.constant(offset)
+                    activation = 'linear'
+
+                elif layer_type == 'Activation':
+                    net = inputs[0]
+                    activation = activation_name(layer)
+
+                elif layer_type == 'Dropout':
+                    tensors[layer.name] = inputs[0]
+                    continue
+
+                elif layer_type == 'MaxPooling2D':
+                    net = tf.nn.max_pool(inputs[0], ksize=(1,) + tuple(layer.pool_size) + (1,),
+                                         strides=(1,) + tuple(layer.strides) + (1,), padding=layer.padding.upper())
+                    activation = 'linear'
+
+                elif layer_type == 'UpSampling2D':
+                    height, width = (int(d) for d in inputs[0].shape[1:3])
+                    net = tf.image.resize_nearest_neighbor(inputs[0], (height * layer.size[0], width * layer.size[1]))
+                    activation = 'linear'
+
+                elif layer_type == 'Concatenate':
+                    net = tf.concat(inputs, axis=layer.axis)
+                    activation = 'linear'
+
+                else:
+                    raise ValueError("Layer {0} of type {1} cannot be exported.".format(layer.name, layer_type))
+
+                if activation == 'relu':
+                    net = tf.nn.relu(net)
+                elif activation != 'linear':
+                    raise ValueError("Activation {0} of layer {1} cannot be exported.".format(activation, layer.name))
+
+            tensors[layer.name] = net
+
+        logits = tensors[output_layer.name]
+        tf.nn.softmax(logits, axis=-1, name='probabilities')
+        # The labels are fetched without the probabilities, as uint8: an eighth of the bytes of int64 labels, and a
+        # twelfth of the bytes of the float32 probabilities of 3 classes.
+        tf.cast(tf.argmax(logits, axis=-1, output_type=tf.int32), tf.uint8, name='labels')
+
+    return graph
+
+
+def write_frozen_model_metadata(path_model_folder, config_dict, ckpt_name, export_format, **fields):
+    '''
+    Writes the description of an exported model, with the checksum of the checkpoint and configuration it was exported
+    from, the configuration, and the size and modification time of the files of the checkpoint.
+    :param path_model_folder: Path of the model folder.
+    :param config_dict: Dictionary containing the model's parameters, completed with the default configuration.
+    :param ckpt_name: String, the name of the checkpoint.
+    :param export_format: String, the format of the exported model.
+    :param fields: other fields of the description.
+    :return: Dict, the description.
+    '''
+
+    _, path_metadata = frozen_model_paths(path_model_folder, ckpt_name, export_format)
+
+    metadata = {
+        'version': frozen_model_version,
+        'format': export_format,
+        'model_checksum': model_checksum(path_model_folder, config_dict, ckpt_name),
+        'checkpoint_files': checkpoint_files_stats(path_model_folder, ckpt_name),
+        'config': config_dict,
+        'patch_size': config_dict["trainingset_patchsize"],
+        'n_classes': config_dict["n_classes"],
+        'input': input_tensor_name,
+        'labels': labels_tensor_name,
+        'probabilities': probabilities_tensor_name
+    }
+    metadata.update(fields)
+
+    with open(str(path_metadata), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    return metadata
+
+
+def export_frozen_model(path_model_folder, config_dict, ckpt_name='model', verbosity_level=0):
+    '''
+    Exports the frozen inference graph of a model next to its checkpoint, with a description used to check that the
+    graph is up to date (see read_frozen_model_metadata).
+    :param path_model_folder: Path of the model folder.
+    :param config_dict: Dictionary containing the model's parameters.
+    :param ckpt_name: String, the name of the checkpoint.
+    :param verbosity_level: Int, how much information to display.
+    :return: Path of the frozen graph.
+    '''
+
+    import tensorflow as tf
+    from keras import backend as K
+    from AxonDeepSeg.network_construction import uconv_net
+
+    path_model_folder = convert_path(path_model_folder)
+    config_dict = update_config(default_configuration(), config_dict)
+    path_graph, path_metadata = frozen_model_paths(path_model_folder, ckpt_name)
+
+    # The Keras model is only built to restore the weights of the checkpoint.
+    keras_graph = tf.Graph()
+    with keras_graph.as_default():
+        K.set_learning_phase(0)
+        model = uconv_net(config_dict, bn_updated_decay=None, verbose=False)
+        saver = tf.train.Saver()
+
+        with tf.Session(graph=keras_graph) as session:
+            saver.restore(session, str(path_model_folder.joinpath(ckpt_name).with_suffix('.ckpt')))
+            graph = build_inference_graph(model, session, config_dict["trainingset_patchsize"])
+
+    graph_def = tf.graph_util.extract_sub_graph(graph.as_graph_def(), ['labels', 'probabilities'])
+    with open(str(path_graph), 'wb') as f:
+        f.write(graph_def.SerializeToString())
+
+    write_frozen_model_metadata(path_model_folder, config_dict, ckpt_name, 'tensorflow')
+
+    if verbosity_level >= 1:
+        print("Frozen graph of {0} written to {1} ({2} nodes, {3} batch normalizations folded).".format(
+            path_model_folder, path_graph, len(graph_def.node),
+            sum(type(layer).__name__ == 'BatchNormalization' for layer in model.layers)))
+
+    return path_graph
+
+
+def export_onnx_model(path_model_folder, config_dict, ckpt_name='model', opset=default_onnx_opset,
+                      verbosity_level=0):
+    '''
+    Converts the frozen graph of a model to an ONNX model, with tf2onnx. The frozen graph is exported first if it is
+    missing or out of date. The ONNX model has the inputs and outputs of the frozen graph.
+    :param path_model_folder: Path of the model folder.
+    :param config_dict: Dictionary containing the model's parameters.
+    :param ckpt_name: String, the name of the checkpoint.
+    :param opset: Int, the ONNX opset of the model.
+    :param verbosity_level: Int, how much information to display.
+    :return: Path of the ONNX model.
+    '''
+
+    import tensorflow as tf
+    import tf2onnx
+
+    path_model_folder = convert_path(path_model_folder)
+    config_dict = update_config(default_configuration(), config_dict)
+
+    if read_frozen_model_metadata(path_model_folder, config_dict, ckpt_name) is None:
+        export_frozen_model(path_model_folder, config_dict, ckpt_name, verbosity_level=verbosity_level)
+
+    path_graph, _ = frozen_model_paths(path_model_folder, ckpt_name, 'tensorflow')
+    path_onnx_model, _ = frozen_model_paths(path_model_folder, ckpt_name, 'onnx')
+
+    graph_def = tf.GraphDef()
+    with open(str(path_graph), 'rb') as f:
+        graph_def.ParseFromString(f.read())
+
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        onnx_graph = tf2onnx.tfonnx.process_tf_graph(graph, opset=opset, input_names=[input_tensor_name],
+                                                     output_names=[labels_tensor_name, probabilities_tensor_name])
+
+    onnx_graph = tf2onnx.optimizer.optimize_graph(onnx_graph)
+    model_proto = onnx_graph.make_model(path_model_folder.name)
+
+    with open(str(path_onnx_model), 'wb') as f:
+        f.write(model_proto.SerializeToString())
+
+    write_frozen_model_metadata(path_model_folder, config_dict, ckpt_name, 'onnx', opset=opset)
+
+    if verbosity_level >= 1:
+        print("ONNX model of {0} written to {1}.".format(path_model_folder, path_onnx_model))
+
+    return path_onnx_model
+
+
+def main(argv=None):
+    '''
+    Exports the frozen inference graph of a model.
+    :return: Exit code.
+        0: Success
+        2: Invalid argument value
+        3: Missing value or file
+    '''
+
+    from AxonDeepSeg.segment import generate_default_parameters
+
+    ap = argparse.ArgumentParser(description='Exports the frozen inference graph of a model, loaded by axondeepseg '
+                                             'instead of the checkpoint, or its ONNX model for the onnxruntime backend.')
+    ap.add_argument('-t', '--type', required=False, default=None, choices=['SEM', 'TEM', 'OM'],
+                    help='Type of the default model to export.')
+    ap.add_argument('-m', '--model', required=False, default=None, help='Folder of the model to export.')
+    ap.add_argument('--format', required=False, default='tensorflow', choices=['tensorflow', 'onnx'],
+                    help='Format of the exported model: tensorflow (frozen graph) or onnx (frozen graph converted '
+                         'to ONNX).')
+    ap.add_argument('-v', '--verbose', required=False, type=int, choices=list(range(0, 2)), default=1,
+                    help='Verbosity level.')
+
+    args = vars(ap.parse_args(argv))
+
+    if args['model'] is None and args['type'] is None:
+        print("ERROR: Give the folder of the model to export (-m) or the type of the default model (-t).")
+        sys.exit(3)
+
+    new_path = Path(args['model']) if args['model'] else None
+    if new_path is not None and not new_path.is_dir():
+        print("ERROR: The model folder does not exist: {0}".format(new_path))
+        sys.exit(3)
+
+    try:
+        path_model, config = generate_default_parameters(args['type'] or 'SEM', new_path)
+    except ValueError as e:
+        print("ERROR: {0}".format(e))
+        sys.exit(3)
+
+    try:
+        if args['format'] == 'onnx':
+            export_onnx_model(path_model, config, verbosity_level=args['verbose'])
+        else:
+            export_frozen_model(path_model, config, verbosity_level=args['verbose'])
+    except ValueError as e:
+        print("ERROR: {0}".format(e))
+        sys.exit(2)
+
+    sys.exit(0)
@@ -10,10 +10,6 @@ import numpy as np
 from scipy import ndimage as ndi
 from skimage import measure, morphology, feature
 
-# Graphs and plots imports
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-
 # AxonDeepSeg imports
 from AxonDeepSeg.testing.segmentation_scoring import *
 from AxonDeepSeg.ads_utils import convert_path
@@ -294,6 +290,10 @@ def draw_axon_diameter(img, path_prediction, pred_axon, pred_myelin):
                     labels[pix_x, pix_y] - 1
                 ]
 
+    # Matplotlib is only imported when the figure is drawn
+    from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+    from matplotlib.figure import Figure
+
     # Axon overlay on original image + myelin display (same color for every
     # myelin sheath)
     fig = Figure(figsize=(12, 9))
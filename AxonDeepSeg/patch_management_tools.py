@@ -7,106 +7,122 @@ def im2patches_overlap(img, overlap_value=25, scw=512):
 
     '''
     Convert an image into patches.
+    The patches are gathered at once from a strided view of all the windows of the image, into a single array that
+    can be sliced into batches without copying the patches again.
     :param img: the image to convert.
     :param overlap_value: Int, the number of pixels to use when overlapping the predictions.
     :param scw: Int, input size.
-    :return: the original image, a list of patches, and their positions.
+    :return: the original image, an array of shape (n_patches, scw, scw) containing the patches, and their positions
+    (array of shape (n_patches, 2)).
     '''
 
-    # First we crop the image to get the context
-    cropped = img[overlap_value:-overlap_value, overlap_value:-overlap_value]
-
-    # Then we create patches using the prediction window
+    # We create patches using the prediction windows on the image cropped of the context
     spw = scw - 2 * overlap_value  # size prediction windows
 
-    qh, rh = divmod(cropped.shape[0], spw)
-    qw, rw = divmod(cropped.shape[1], spw)
-
-    # Creating positions of prediction windows
-    L_h = [spw * e for e in range(qh)]
-    L_w = [spw * e for e in range(qw)]
+    def windows_positions(length):
+        # Positions of the prediction windows along one axis. If there is a remainder we take the last position
+        # (overlap on the last predictions)
+        q, r = divmod(length - 2 * overlap_value, spw)
+        positions = spw * np.arange(q)
+        if r != 0:
+            positions = np.append(positions, length - 2 * overlap_value - spw)
+        return positions
 
-    # Then if there is a remainder we take the last positions (overlap on the last predictions)
-    if rh != 0:
-        L_h.append(cropped.shape[0] - spw)
-    if rw != 0:
-        L_w.append(cropped.shape[1] - spw)
-
-    xx, yy = np.meshgrid(L_h, L_w)
-    P = [np.ravel(xx), np.ravel(yy)]
-    L_pos = [[P[0][i], P[1][i]] for i in range(len(P[0]))]
+    L_h = windows_positions(img.shape[0])
+    L_w = windows_positions(img.shape[1])
 
     # These positions are also the positions of the context windows in the base image coordinates !
-    L_patches = []
-    for e in L_pos:
-        patch = img[e[0]:e[0] + scw, e[1]:e[1] + scw]
-        L_patches.append(patch)
+    L_pos = np.stack(np.meshgrid(L_h, L_w), axis=-1).reshape(-1, 2)
+
+    # View of every scw x scw window of the image, from which the patches are extracted with a single copy
+    windows = np.lib.stride_tricks.as_strided(img,
+                                              shape=(img.shape[0] - scw + 1, img.shape[1] - scw + 1, scw, scw)
+                                              + img.shape[2:],
+                                              strides=img.strides[:2] * 2 + img.strides[2:],
+                                              writeable=False)
+    L_patches = windows[L_pos[:, 0], L_pos[:, 1]]
 
     return [img, L_patches, L_pos]
 
 
-def patches2im_overlap(L_patches, L_pos, overlap_value=25, scw=512):
+def patches2im_overlap(L_patches, L_pos, overlap_value=25, scw=512, out=None):
 
     '''
     Stitches patches together to form an image.
-    :param L_patches: List of segmented patches.
+    Each patch contributes its central part, extended to the border of the image for the patches located on a border.
+    The part of each patch to keep is computed once, so each patch is copied with a single assignment.
+    :param L_patches: List (or array) of segmented patches, of shape (scw, scw) or (scw, scw, n_channels).
     :param L_pos: List of positions of the patches in the image to form.
     :param overlap_value: Int, number of pixels to overlap.
     :param scw: Int, patch size.
+    :param out: Array where to write the stitched image, of shape (height, width) or (height, width, n_channels).
+    If None, an array of the dtype of the patches is allocated.
     :return: Stitched segmented image.
     '''
 
-    spw = scw - 2 * overlap_value
-    # L_pred = [e[cropped_value:-cropped_value,cropped_value:-cropped_value] for e in L_patches]
-    # First : extraction of the predictions
-    h_l, w_l = np.max(np.stack(L_pos), axis=0)
-    L_pred = []
-    new_img = np.zeros((h_l + scw, w_l + scw))
-
-    for i, e in enumerate(L_patches):
-        if L_pos[i][0] == 0:
-            if L_pos[i][1] == 0:
-                new_img[0:overlap_value, 0:overlap_value] = e[0:overlap_value, 0:overlap_value]
-                new_img[overlap_value:scw - overlap_value, 0:overlap_value] = e[overlap_value:-overlap_value,
-                                                                              0:overlap_value]
-                new_img[0:overlap_value, overlap_value:scw - overlap_value] = e[0:overlap_value,
-                                                                              overlap_value:-overlap_value]
-            else:
-                if L_pos[i][1] == w_l:
-                    new_img[0:overlap_value, -overlap_value:] = e[0:overlap_value, -overlap_value:]
-                new_img[0:overlap_value, L_pos[i][1] + overlap_value:L_pos[i][1] + scw - overlap_value] = e[
-                                                                                                          0:overlap_value,
-                                                                                                          overlap_value:-overlap_value]
-
-        if L_pos[i][1] == 0:
-            if L_pos[i][0] != 0:
-                new_img[L_pos[i][0] + overlap_value:L_pos[i][0] + scw - overlap_value, 0:overlap_value] = e[
-                                                                                                          overlap_value:-overlap_value,
-                                                                                                          0:overlap_value]
-
-        if L_pos[i][0] == h_l:
-            if L_pos[i][1] == w_l:
-                new_img[-overlap_value:, -overlap_value:] = e[-overlap_value:, -overlap_value:]
-                new_img[h_l + overlap_value:-overlap_value, -overlap_value:] = e[overlap_value:-overlap_value,
-                                                                               -overlap_value:]
-                new_img[-overlap_value:, w_l + overlap_value:-overlap_value] = e[-overlap_value:,
-                                                                               overlap_value:-overlap_value]
-            else:
-                if L_pos[i][1] == 0:
-                    new_img[-overlap_value:, 0:overlap_value] = e[-overlap_value:, 0:overlap_value]
-
-                new_img[-overlap_value:, L_pos[i][1] + overlap_value:L_pos[i][1] + scw - overlap_value] = e[
-                                                                                                          -overlap_value:,
-                                                                                                          overlap_value:-overlap_value]
-        if L_pos[i][1] == w_l:
-            if L_pos[i][1] != h_l:
-                new_img[L_pos[i][0] + overlap_value:L_pos[i][0] + scw - overlap_value, -overlap_value:] = e[
-                                                                                                          overlap_value:-overlap_value,
-                                                                                                          -overlap_value:]
-
-    L_pred = [e[overlap_value:-overlap_value, overlap_value:-overlap_value] for e in L_patches]
-    L_pos_corr = [[e[0] + overlap_value, e[1] + overlap_value] for e in L_pos]
-    for i, e in enumerate(L_pos_corr):
-        new_img[e[0]:e[0] + spw, e[1]:e[1] + spw] = L_pred[i]
-
-    return new_img
+    L_pos = np.asarray(L_pos)
+    h_l, w_l = np.max(L_pos, axis=0)
+
+    if out is None:
+        out = np.zeros((h_l + scw, w_l + scw) + np.shape(L_patches[0])[2:], dtype=np.asarray(L_patches[0]).dtype)
+
+    for (y, x), patch in zip(L_pos, L_patches):
+        # The overlap is only removed on the sides of the patch that are not on a border of the image.
+        top = 0 if y == 0 else overlap_value
+        left = 0 if x == 0 else overlap_value
+        bottom = scw if y == h_l else scw - overlap_value
+        right = scw if x == w_l else scw - overlap_value
+
+        out[y + top:y + bottom, x + left:x + right] = patch[top:bottom, left:right]
+
+    return out
+
+
+def blending_window(scw=512, window='hann'):
+
+    '''
+    Computes the 2D weights used to blend overlapping patches: maximal at the centre of the patch and decreasing
+    smoothly towards its borders, but never null so that the pixels only covered by the border of a patch are defined.
+    :param scw: Int, patch size.
+    :param window: String, shape of the window: 'hann' or 'gaussian'.
+    :return: Array of shape (scw, scw) of float32 weights.
+    '''
+
+    if window == 'hann':
+        # The Hann window is computed on scw + 2 points to drop its two null end points.
+        w = np.hanning(scw + 2)[1:-1]
+    elif window == 'gaussian':
+        w = np.exp(-0.5 * ((np.arange(scw) - (scw - 1) / 2.) / (scw / 8.)) ** 2)
+    else:
+        raise ValueError("Unknown blending window: {0}. Expected 'hann' or 'gaussian'.".format(window))
+
+    return np.outer(w, w).astype(np.float32)
+
+
+def patches2im_blend(L_patches, L_pos, scw=512, window='hann'):
+
+    '''
+    Stitches patches of probabilities together by weighted blending: the probabilities of all the patches covering a
+    pixel are averaged, weighted by a smooth window, so that there is no seam between the patches even with a small
+    overlap.
+    :param L_patches: List (or array) of patches of probabilities, of shape (scw, scw, n_classes).
+    :param L_pos: List of positions of the patches in the image to form.
+    :param scw: Int, patch size.
+    :param window: String, shape of the blending window: 'hann' or 'gaussian'.
+    :return: Stitched probability map, of shape (height, width, n_classes) and of dtype float32.
+    '''
+
+    L_pos = np.asarray(L_pos)
+    h_l, w_l = np.max(L_pos, axis=0)
+
+    weights = blending_window(scw, window)
+    out = np.zeros((h_l + scw, w_l + scw) + np.shape(L_patches[0])[2:], dtype=np.float32)
+    weights_sum = np.zeros((h_l + scw, w_l + scw), dtype=np.float32)
+
+    for (y, x), patch in zip(L_pos, L_patches):
+        out[y:y + scw, x:x + scw] += weights[..., None] * patch
+        weights_sum[y:y + scw, x:x + scw] += weights
+
+    out /= weights_sum[..., None]
+
+    return out
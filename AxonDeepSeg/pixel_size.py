@@ -0,0 +1,130 @@
+# Resolution of the pixel size of each image to segment, from the files stored with the images: a sidecar file next
+# to each image, a CSV map of the pixel sizes, the resolution tags of TIFF files, or the pixel_size_in_micrometer.txt
+# file of the image folder.
+
+import re
+
+from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.sharding import read_image_list
+
+pixel_size_filename = 'pixel_size_in_micrometer.txt'
+sidecar_suffix = '_' + pixel_size_filename
+
+# Length of the TIFF resolution units, in micrometers (1: no unit, 2: inch, 3: centimeter)
+tiff_resolution_units = {2: 25400., 3: 10000.}
+# Length of the units written by ImageJ in the description of its TIFF files, in micrometers
+imagej_units = {'nm': 1e-3, 'nanometer': 1e-3, 'um': 1., 'micron': 1., 'micrometer': 1., '\\u00B5m': 1., 'µm': 1.,
+                'mm': 1e3, 'millimeter': 1e3}
+
+
+def read_pixel_size_file(path_file):
+    '''
+    Reads a pixel size file, containing the pixel size in micrometers.
+    :param path_file: Path of the file.
+    :return: Float, the pixel size.
+    '''
+
+    with open(str(path_file), 'r') as f:
+        return float(f.read())
+
+
+def read_tiff_pixel_size(path_image):
+    '''
+    Reads the pixel size of a TIFF file from its resolution tags, without decoding the image. The resolutions in
+    centimeters and the ImageJ resolutions (unit in the image description) are used. The resolutions in inches are
+    ignored: most of the time they are the default resolution of the software (72 or 96 dpi), not the pixel size of
+    the acquisition.
+    :param path_image: Path of the TIFF file.
+    :return: Float, the pixel size in micrometers, or None if the file has no usable resolution tags.
+    '''
+
+    from PIL import Image
+
+    try:
+        with Image.open(str(path_image)) as image:
+            tags = image.tag_v2
+            x_resolution = tags.get(282)
+            resolution_unit = tags.get(296, 2)
+            description = tags.get(270, '')
+    except (IOError, OSError, AttributeError):
+        return None
+
+    if not x_resolution or float(x_resolution) <= 0:
+        return None
+
+    if resolution_unit == 3:
+        unit_length = tiff_resolution_units[3]
+    elif resolution_unit == 1:
+        unit = re.search(r'unit=(\S+)', str(description))
+        if (unit is None) or (unit.group(1) not in imagej_units):
+            return None
+        unit_length = imagej_units[unit.group(1)]
+    else:
+        return None
+
+    return unit_length / float(x_resolution)
+
+
+class PixelSizeResolver(object):
+    """
+    Finds the pixel size of each image, from the first of these sources that has it:
+    - the CSV (or JSON lines) map of the pixel sizes, if one is given (see AxonDeepSeg.sharding.read_image_list);
+    - the sidecar file of the image, <image name without extension>_pixel_size_in_micrometer.txt;
+    - the resolution tags of the image, for TIFF files;
+    - the pixel_size_in_micrometer.txt file of the folder of the image.
+    Each file is read once: the map when the resolver is created, and the other sources the first time they are
+    needed. The pixel sizes found are cached.
+    """
+
+    def __init__(self, path_pixel_size_map=None):
+        """
+        :param path_pixel_size_map: Path of the CSV or JSON lines file mapping the images to their pixel size, or None.
+        """
+
+        self.pixel_size_map = {}
+        if path_pixel_size_map is not None:
+            self.pixel_size_map = {path_image.resolve(): pixel_size
+                                   for path_image, pixel_size in read_image_list(path_pixel_size_map)
+                                   if pixel_size is not None}
+
+        self._pixel_sizes = {}
+        self._folder_pixel_sizes = {}
+
+    def folder_pixel_size(self, path_folder):
+        """
+        :param path_folder: Path of a folder of images.
+        :return: the pixel size of the pixel_size_in_micrometer.txt file of the folder, or None if there is none.
+        """
+
+        if path_folder not in self._folder_pixel_sizes:
+            path_file = path_folder / pixel_size_filename
+            self._folder_pixel_sizes[path_folder] = read_pixel_size_file(path_file) if path_file.exists() else None
+
+        return self._folder_pixel_sizes[path_folder]
+
+    def resolve(self, path_image):
+        """
+        Finds the pixel size of an image.
+        :param path_image: Path of the image.
+        :return: Float, the pixel size in micrometers, or None if no source gives the pixel size of the image.
+        """
+
+        path_image = convert_path(path_image).resolve()
+
+        if path_image not in self._pixel_sizes:
+            pixel_size = self.pixel_size_map.get(path_image)
+
+            if pixel_size is None:
+                path_sidecar = path_image.parent / (path_image.stem + sidecar_suffix)
+                if path_sidecar.exists():
+                    pixel_size = read_pixel_size_file(path_sidecar)
+
+            if (pixel_size is None) and (path_image.suffix.lower() in ('.tif', '.tiff')):
+                pixel_size = read_tiff_pixel_size(path_image)
+
+            if pixel_size is None:
+                pixel_size = self.folder_pixel_size(path_image.parent)
+
+            self._pixel_sizes[path_image] = pixel_size
+
+        return self._pixel_sizes[path_image]
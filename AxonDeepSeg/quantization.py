@@ -0,0 +1,284 @@
+# Post-training int8 quantisation of a model, for the onnxruntime_int8 inference backend (see
+# AxonDeepSeg.inference_backends). The ONNX model exported from the frozen graph (see AxonDeepSeg.model_export) is
+# quantised statically by ONNX Runtime: the weights of the convolutions are stored as int8 values, and the ranges of
+# the activations are calibrated on patches of the images of a dataset folder. The Dice of the int8 model is then
+# compared with the one of the float model on the images of the dataset that have a ground truth mask.
+#
+# Usage example:
+#   axondeepseg_quantize_model -t SEM -d path/to/dataset --n-patches 32
+
+import sys
+import argparse
+
+import numpy as np
+
+import AxonDeepSeg.ads_utils as ads
+from AxonDeepSeg.ads_utils import convert_path
+from AxonDeepSeg.config_tools import update_config, default_configuration
+from AxonDeepSeg.model_export import export_onnx_model, frozen_model_paths, read_frozen_model_metadata, \
+    write_frozen_model_metadata
+
+default_n_calibration_patches = 32
+
+
+class PatchCalibrationReader(object):
+    """
+    Feeds the calibration patches to the ONNX Runtime quantisation, one patch at a time (interface of
+    onnxruntime.quantization.CalibrationDataReader).
+    """
+
+    def __init__(self, patches, input_name):
+        """
+        :param patches: Array of shape (number of patches, patch size, patch size) and of dtype uint8.
+        :param input_name: String, name of the input of the ONNX model.
+        """
+        self.patches = patches
+        self.input_name = input_name
+        self.index = 0
+
+    def get_next(self):
+        if self.index >= len(self.patches):
+            return None
+
+        patch = self.patches[self.index]
+        self.index += 1
+
+        return {self.input_name: patch.reshape((1,) + patch.shape + (1,))}
+
+    def rewind(self):
+        self.index = 0
+
+
+def dataset_samples(path_dataset):
+    """
+    Lists the samples of a dataset folder: the folder itself or its subfolders that contain an image.png file and a
+    pixel_size_in_micrometer.txt file, as in the data_test folder of the models.
+    :param path_dataset: Path of the dataset folder.
+    :return: List of tuples (path of the image, path of the mask or None, pixel size in micrometers).
+    """
+
+    path_dataset = convert_path(path_dataset)
+    folders = [path_dataset] + sorted(path for path in path_dataset.iterdir() if path.is_dir())
+
+    samples = []
+    for folder in folders:
+        path_image, path_pixel_size = folder / 'image.png', folder / 'pixel_size_in_micrometer.txt'
+        if not (path_image.exists() and path_pixel_size.exists()):
+            continue
+
+        with open(str(path_pixel_size), 'r') as f:
+            pixel_size = float(f.read())
+
+        path_mask = folder / 'mask.png'
+        samples.append((path_image, path_mask if path_mask.exists() else None, pixel_size))
+
+    return samples
+
+
+def calibration_patches(samples, patch_size, resolution_model, n_patches=default_n_calibration_patches,
+                        overlap_value=25, resampling_backend='skimage', random_seed=0):
+    """
+    Extracts the calibration patches from the images of a dataset, resampled to the resolution of the model as in
+    the segmentation.
+    :param samples: List of tuples (path of the image, path of the mask or None, pixel size), see dataset_samples.
+    :param patch_size: Int, input size of the network.
+    :param resolution_model: Float, the resolution the model was trained on.
+    :param n_patches: Int, number of patches to draw among the patches of all the images.
+    :param overlap_value: Int, number of pixels of overlap between the patches of an image.
+    :param resampling_backend: String, implementation of the resampling (see AxonDeepSeg.resampling.rescale_image).
+    :param random_seed: Int, seed of the draw of the patches.
+    :return: Array of shape (number of patches, patch size, patch size) and of dtype uint8.
+    """
+    from AxonDeepSeg.apply_model import load_acquisitions, prepare_patches
+
+    path_images = [path_image for path_image, _, _ in samples]
+    pixel_sizes = [pixel_size for _, _, pixel_size in samples]
+
+    resampled_acquisitions, _, _ = load_acquisitions(path_images, pixel_sizes, [resolution_model] * len(samples),
+                                                     resampling_backend=resampling_backend)
+    patches, _, _ = prepare_patches(resampled_acquisitions, patch_size, overlap_value)
+
+    if len(patches) > n_patches:
+        rng = np.random.RandomState(random_seed)
+        patches = patches[np.sort(rng.choice(len(patches), n_patches, replace=False))]
+
+    return patches.astype(np.uint8)
+
+
+def quantize_model(path_model_folder, config_dict, patches, ckpt_name='model', per_channel=True, verbosity_level=0):
+    """
+    Quantises the ONNX model of a model to int8, with the ranges of the activations calibrated on some patches. The
+    ONNX model is exported first if it is missing or out of date.
+    :param path_model_folder: Path of the model folder.
+    :param config_dict: Dictionary containing the model's parameters.
+    :param patches: Array of shape (number of patches, patch size, patch size) and of dtype uint8, the calibration
+    patches.
+    :param ckpt_name: String, the name of the checkpoint.
+    :param per_channel: Boolean, whether the weights are quantised with a scale per output channel or per layer.
+    :param verbosity_level: Int, how much information to display.
+    :return: Path of the int8 ONNX model.
+    """
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+
+    path_model_folder = convert_path(path_model_folder)
+    config_dict = update_config(default_configuration(), config_dict)
+
+    metadata = read_frozen_model_metadata(path_model_folder, config_dict, ckpt_name, 'onnx')
+    if metadata is None:
+        export_onnx_model(path_model_folder, config_dict, ckpt_name, verbosity_level=verbosity_level)
+        metadata = read_frozen_model_metadata(path_model_folder, config_dict, ckpt_name, 'onnx')
+
+    path_onnx_model, _ = frozen_model_paths(path_model_folder, ckpt_name, 'onnx')
+    path_int8_model, _ = frozen_model_paths(path_model_folder, ckpt_name, 'onnx_int8')
+
+    # The activations are unsigned (they follow a ReLU or are the input image), the weights are signed. The ranges of
+    # the activations are the min-max ranges over the calibration patches (default calibration of quantize_static).
+    quantize_static(str(path_onnx_model), str(path_int8_model), PatchCalibrationReader(patches, metadata['input']),
+                    quant_format=QuantFormat.QOperator, per_channel=per_channel,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+    write_frozen_model_metadata(path_model_folder, config_dict, ckpt_name, 'onnx_int8', opset=metadata['opset'],
+                                calibration_patches=len(patches), per_channel=per_channel)
+
+    if verbosity_level >= 1:
+        print("int8 model of {0} written to {1}.".format(path_model_folder, path_int8_model))
+
+    return path_int8_model
+
+
+def dice_report(path_model_folder, config_dict, samples, resolution_model,
+                backends=('onnxruntime', 'onnxruntime_int8'), inference_batch_size=8, overlap_value=25,
+                verbosity_level=0):
+    """
+    Compares the Dice of the axons and of the myelin of two inference backends, on the samples that have a ground
+    truth mask (myelin=127, axon=255).
+    :param path_model_folder: Path of the model folder.
+    :param config_dict: Dictionary containing the model's parameters.
+    :param samples: List of tuples (path of the image, path of the mask or None, pixel size), see dataset_samples.
+    :param resolution_model: Float, the resolution the model was trained on.
+    :param backends: Tuple of two inference backends, the reference one and the evaluated one.
+    :param inference_batch_size: Int, batch size to use when doing inference.
+    :param overlap_value: Int, number of pixels to use when overlapping the predictions of the network.
+    :param verbosity_level: Int, how much information to display.
+    :return: List of [sample, reference axon dice, axon dice, change, reference myelin dice, myelin dice, change]
+    rows, the last one being the mean over the samples.
+    """
+    from prettytable import PrettyTable
+    from AxonDeepSeg.apply_model import Segmenter, paint_segmentation
+    from AxonDeepSeg.testing.segmentation_scoring import pw_dice
+
+    samples = [sample for sample in samples if sample[1] is not None]
+    path_images = [path_image for path_image, _, _ in samples]
+    pixel_sizes = [pixel_size for _, _, pixel_size in samples]
+
+    # Dice of the axons and of the myelin of each sample, for each backend
+    dices = []
+    for backend in backends:
+        with Segmenter(path_model_folder, config_dict, verbosity_level=verbosity_level,
+                       inference_backend=backend) as segmenter:
+            predictions = segmenter.segment(path_images, pixel_sizes, inference_batch_size=inference_batch_size,
+                                            overlap_value=overlap_value,
+                                            resampled_resolutions=[resolution_model] * len(samples))
+            n_classes = segmenter.n_classes
+
+        backend_dices = []
+        for (_, path_mask, _), prediction in zip(samples, predictions):
+            mask = ads.imread(path_mask)
+            pred = paint_segmentation(prediction, n_classes)
+            backend_dices.append([pw_dice(pred > 200, mask > 200),
+                                  pw_dice(np.logical_and(pred >= 50, pred <= 200),
+                                          np.logical_and(mask >= 50, mask <= 200))])
+        dices.append(np.array(backend_dices).reshape(-1, 2))
+
+    reference, evaluated = dices
+    names = [path_image.parent.name for path_image in path_images]
+    if samples:
+        names.append('mean')
+        reference = np.vstack([reference, reference.mean(axis=0)])
+        evaluated = np.vstack([evaluated, evaluated.mean(axis=0)])
+
+    results = []
+    for name, (ref_axon, ref_myelin), (axon, myelin) in zip(names, reference, evaluated):
+        results.append([name, round(ref_axon, 4), round(axon, 4), round(axon - ref_axon, 4),
+                        round(ref_myelin, 4), round(myelin, 4), round(myelin - ref_myelin, 4)])
+
+    t = PrettyTable(["Sample", "Axon Dice ({0})".format(backends[0]), "Axon Dice ({0})".format(backends[1]), "Change",
+                     "Myelin Dice ({0})".format(backends[0]), "Myelin Dice ({0})".format(backends[1]), "Change"])
+    for row in results:
+        t.add_row(row)
+    print(t)
+
+    return results
+
+
+def main(argv=None):
+    """
+    Quantises a model to int8 and reports the change of Dice against the float model.
+    :return: Exit code.
+        0: Success
+        2: Invalid argument value
+        3: Missing value or file
+    """
+    from AxonDeepSeg.segment import generate_default_parameters, generate_resolution
+
+    ap = argparse.ArgumentParser(description='Quantises the ONNX model of a model to int8 for the onnxruntime_int8 '
+                                             'inference backend, and reports the change of Dice against the float '
+                                             'model on the images of the dataset that have a mask.')
+    ap.add_argument('-t', '--type', required=False, default='SEM', choices=['SEM', 'TEM'],
+                    help='Type of the model, which sets its resolution.')
+    ap.add_argument('-m', '--model', required=False, default=None,
+                    help='Folder of the model to quantise. Default: the default model of the type.')
+    ap.add_argument('-d', '--dataset', required=True,
+                    help='Dataset folder: a folder, or folders of folders, with an image.png file, a \n'
+                         'pixel_size_in_micrometer.txt file and optionally a mask.png file.')
+    ap.add_argument('--n-patches', required=False, type=int, default=default_n_calibration_patches,
+                    help='Number of calibration patches. Default: {0}.'.format(default_n_calibration_patches))
+    ap.add_argument('--per-layer', required=False, action='store_true',
+                    help='Quantise the weights with one scale per layer instead of one per output channel.')
+    ap.add_argument('--no-report', required=False, action='store_true',
+                    help='Do not compare the Dice of the int8 model with the one of the float model.')
+    ap.add_argument('-v', '--verbose', required=False, type=int, choices=list(range(0, 2)), default=1,
+                    help='Verbosity level.')
+
+    args = vars(ap.parse_args(argv))
+
+    path_dataset = convert_path(args['dataset'])
+    if not path_dataset.is_dir():
+        print("ERROR: The dataset folder does not exist: {0}".format(path_dataset))
+        sys.exit(3)
+
+    samples = dataset_samples(path_dataset)
+    if not samples:
+        print("ERROR: No image.png with a pixel_size_in_micrometer.txt file found in {0}".format(path_dataset))
+        sys.exit(3)
+
+    if args['n_patches'] < 1:
+        print("ERROR: The number of calibration patches must be a positive integer.")
+        sys.exit(2)
+
+    new_path = convert_path(args['model']) if args['model'] else None
+    if new_path is not None and not new_path.is_dir():
+        print("ERROR: The model folder does not exist: {0}".format(new_path))
+        sys.exit(3)
+
+    try:
+        path_model, config = generate_default_parameters(args['type'], new_path)
+    except ValueError as e:
+        print("ERROR: {0}".format(e))
+        sys.exit(3)
+
+    patch_size = config["trainingset_patchsize"]
+    resolution_model = generate_resolution(args['type'], patch_size)
+
+    patches = calibration_patches(samples, patch_size, resolution_model, n_patches=args['n_patches'])
+    quantize_model(path_model, config, patches, per_channel=not args['per_layer'], verbosity_level=args['verbose'])
+
+    if not args['no_report']:
+        dice_report(path_model, config, samples, resolution_model)
+
+    sys.exit(0)
+
+
+# Calling the script
+if __name__ == '__main__':
+    main()
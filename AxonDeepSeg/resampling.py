@@ -0,0 +1,230 @@
+# Resampling of the acquisitions to the resolution of the model, and of the label maps and probability maps back to
+# the size of the original acquisitions.
+import numpy as np
+
+# Backends of rescale_image: 'skimage' is the reference implementation, 'area' and 'opencv' are faster and keep the
+# images in uint8.
+resampling_backends = ['skimage', 'area', 'opencv']
+
+
+def nearest_indices(size_in, size_out):
+    '''
+    Computes, for each pixel of an axis of size size_out, the index of the nearest pixel of an axis of size size_in
+    covering the same extent (the pixel centres are aligned as in skimage.transform.resize).
+    :param size_in: Int, size of the input axis.
+    :param size_out: Int, size of the output axis.
+    :return: Array of size_out indices.
+    '''
+
+    return np.minimum(((np.arange(size_out) + 0.5) * (size_in / size_out)).astype(np.intp), size_in - 1)
+
+
+def resize_labels(labels, output_shape, chunk_size=1024, out=None):
+    '''
+    Resizes a label map with nearest neighbour interpolation: each output pixel takes the label of the nearest input
+    pixel, so no label can appear at the boundary between two other classes and the labels keep their dtype. The
+    output is filled by chunks of rows, without any floating point intermediate.
+    :param labels: Array of shape (height, width), the label map to resize.
+    :param output_shape: Tuple (height, width), the shape of the resized label map.
+    :param chunk_size: Int, number of output rows computed at once.
+    :param out: Array of shape output_shape where to write the resized label map. If None, an array of the dtype of
+    labels is allocated.
+    :return: the resized label map.
+    '''
+
+    output_shape = tuple(output_shape[:2])
+
+    if out is None:
+        out = np.empty(output_shape, dtype=labels.dtype)
+
+    if labels.shape[:2] == output_shape:
+        out[...] = labels
+        return out
+
+    rows = nearest_indices(labels.shape[0], output_shape[0])
+    cols = nearest_indices(labels.shape[1], output_shape[1])
+
+    for start in range(0, output_shape[0], chunk_size):
+        stop = min(start + chunk_size, output_shape[0])
+        out[start:stop] = labels[rows[start:stop, None], cols]
+
+    return out
+
+
+def linear_weights(size_in, size_out):
+    '''
+    Computes, for each pixel of an axis of size size_out, the two neighbouring pixels of an axis of size size_in and
+    the weight of the second one for linear interpolation (the pixel centres are aligned as in
+    skimage.transform.resize, and the coordinates are clipped to the border pixels).
+    :param size_in: Int, size of the input axis.
+    :param size_out: Int, size of the output axis.
+    :return: the arrays of the indices of the first and second neighbours, and the float32 array of the weights.
+    '''
+
+    coordinates = np.clip((np.arange(size_out) + 0.5) * (size_in / size_out) - 0.5, 0, size_in - 1)
+    first = np.floor(coordinates).astype(np.intp)
+    second = np.minimum(first + 1, size_in - 1)
+
+    return first, second, (coordinates - first).astype(np.float32)
+
+
+def resize_probabilities(probabilities, output_shape, dtype=np.float32, chunk_size=256, out=None):
+    '''
+    Resizes a probability map with bilinear interpolation, computed in float32 by chunks of rows so that no full size
+    floating point intermediate is allocated. The result can be quantised to uint8 (probabilities scaled to 0-255).
+    :param probabilities: Array of shape (height, width, n_classes), the probability map to resize.
+    :param output_shape: Tuple (height, width), the shape of the resized probability map.
+    :param dtype: Type of the resized probability map: np.float32, or np.uint8 for quantised probabilities.
+    :param chunk_size: Int, number of output rows computed at once.
+    :param out: Array of shape output_shape + (n_classes,) where to write the resized probability map, for instance a
+    memory-mapped array. If None, an array of the given dtype is allocated.
+    :return: the resized probability map.
+    '''
+
+    output_shape = tuple(output_shape[:2])
+
+    if out is None:
+        out = np.empty(output_shape + probabilities.shape[2:], dtype=dtype)
+
+    rows_first, rows_second, rows_weights = linear_weights(probabilities.shape[0], output_shape[0])
+    cols_first, cols_second, cols_weights = linear_weights(probabilities.shape[1], output_shape[1])
+    rows_weights = rows_weights[:, None, None]
+    cols_weights = cols_weights[None, :, None]
+
+    for start in range(0, output_shape[0], chunk_size):
+        stop = min(start + chunk_size, output_shape[0])
+
+        # Interpolation along the rows, then along the columns.
+        top = probabilities[rows_first[start:stop]].astype(np.float32)
+        bottom = probabilities[rows_second[start:stop]].astype(np.float32)
+        rows = top + rows_weights[start:stop] * (bottom - top)
+        chunk = rows[:, cols_first] + cols_weights * (rows[:, cols_second] - rows[:, cols_first])
+
+        if np.dtype(out.dtype) == np.uint8:
+            out[start:stop] = np.rint(np.clip(chunk, 0, 1) * 255)
+        else:
+            out[start:stop] = chunk
+
+    return out
+
+
+def rescaled_shape(shape, coefficient):
+    '''
+    Computes the shape of an image rescaled by a coefficient, rounded as in skimage.transform.rescale.
+    :param shape: Tuple, the shape of the image.
+    :param coefficient: Float, the rescaling coefficient.
+    :return: Tuple (height, width) of the rescaled image.
+    '''
+
+    return tuple(int(e) for e in np.round(np.array(shape[:2]) * coefficient))
+
+
+
+def input_range(size_in, size_out, start, stop):
+    '''
+    Computes the range of input pixels of an axis needed to compute the output pixels start to stop with
+    resample_axis.
+    :param size_in: Int, size of the input axis.
+    :param size_out: Int, size of the output axis.
+    :param start: Int, index of the first output pixel.
+    :param stop: Int, index after the last output pixel.
+    :return: Tuple, the index of the first input pixel needed and the index after the last one.
+    '''
+
+    if size_out == size_in:
+        return start, stop
+
+    if size_out < size_in:
+        scale = size_in / size_out
+        return int(np.floor(start * scale)), min(size_in, int(np.ceil(stop * scale)))
+
+    first, second, _ = linear_weights(size_in, size_out)
+    return int(first[start]), int(second[stop - 1]) + 1
+
+
+def resample_axis(block, offset, size_in, size_out, start, stop, axis):
+    '''
+    Resamples a block of an image along one axis: area averaging when the axis is reduced, linear interpolation when it
+    is enlarged.
+    :param block: Float array, the input pixels needed to compute the output pixels (see input_range), starting at the
+    input index offset along the axis.
+    :param offset: Int, index along the axis of the first input pixel of the block.
+    :param size_in: Int, size of the input axis.
+    :param size_out: Int, size of the output axis.
+    :param start: Int, index of the first output pixel to compute.
+    :param stop: Int, index after the last output pixel to compute.
+    :param axis: Int, the axis to resample.
+    :return: the output pixels start to stop along the axis.
+    '''
+
+    n = block.shape[axis]
+    shape = [1] * block.ndim
+    shape[axis] = -1
+
+    if size_out < size_in:
+        # Mean of the input over the interval covered by each output pixel, from the cumulative sum of the input: the
+        # sum up to a fractional position t is the sum up to floor(t) plus the covered fraction of the pixel floor(t).
+        scale = size_in / size_out
+        cumulative = np.cumsum(block, axis=axis)
+        cumulative = np.concatenate([np.zeros_like(np.take(cumulative, [0], axis=axis)), cumulative], axis=axis)
+
+        def integral(t):
+            t = np.clip(t - offset, 0, n)
+            k = np.minimum(np.floor(t).astype(np.intp), n - 1)
+            return np.take(cumulative, k, axis=axis) + (t - k).reshape(shape) * np.take(block, k, axis=axis)
+
+        starts = np.arange(start, stop) * scale
+        ends = np.minimum(starts + scale, size_in)
+        return (integral(ends) - integral(starts)) / scale
+
+    first, second, weights = linear_weights(size_in, size_out)
+    a = np.take(block, first[start:stop] - offset, axis=axis)
+    b = np.take(block, second[start:stop] - offset, axis=axis)
+
+    return a + weights[start:stop].reshape(shape) * (b - a)
+
+
+def rescale_image(image, coefficient, backend='skimage', chunk_size=512):
+    '''
+    Rescales a uint8 image to another resolution.
+    :param image: Array of shape (height, width), of dtype uint8.
+    :param coefficient: Float, the rescaling coefficient (ratio of the pixel sizes of the image and of the output).
+    :param backend: String, the implementation to use.
+    'skimage': skimage.transform.rescale (bilinear interpolation, in float64), the reference.
+    'area': area averaging when reducing the image and bilinear interpolation when enlarging it, computed by chunks of
+    output rows so that the intermediate floating point arrays stay small.
+    'opencv': cv2.resize, with INTER_AREA when reducing the image and INTER_LINEAR when enlarging it.
+    :param chunk_size: Int, number of output rows computed at once by the 'area' backend.
+    :return: the rescaled image, of dtype uint8.
+    '''
+
+    if backend not in resampling_backends:
+        raise ValueError("Unknown resampling backend: {0}. Expected one of {1}.".format(backend, resampling_backends))
+
+    if backend == 'skimage':
+        from skimage.transform import rescale
+        return rescale(image, coefficient, preserve_range=True).astype(np.uint8)
+
+    height, width = image.shape[:2]
+    output_height, output_width = rescaled_shape(image.shape, coefficient)
+
+    if backend == 'opencv':
+        import cv2
+        interpolation = cv2.INTER_AREA if coefficient < 1 else cv2.INTER_LINEAR
+        return cv2.resize(np.ascontiguousarray(image), (output_width, output_height), interpolation=interpolation)
+
+    out = np.empty((output_height, output_width), dtype=np.uint8)
+
+    for start in range(0, output_height, chunk_size):
+        stop = min(start + chunk_size, output_height)
+        row_start, row_stop = input_range(height, output_height, start, stop)
+
+        chunk = image[row_start:row_stop].astype(np.float32)
+        if output_width != width:
+            chunk = resample_axis(chunk, 0, width, output_width, 0, output_width, axis=1)
+        if output_height != height:
+            chunk = resample_axis(chunk, row_start, height, output_height, start, stop, axis=0)
+
+        out[start:stop] = np.rint(np.clip(chunk, 0, 255))
+
+    return out
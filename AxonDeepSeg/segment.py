@@ -7,18 +7,28 @@
 
 # Imports
 
+import os
 import sys
+import queue
+import collections
+import multiprocessing
 from pathlib import Path
 
 import json
 import argparse
 from argparse import RawTextHelpFormatter
 from tqdm import tqdm
-import pkg_resources
 
 import AxonDeepSeg
 import AxonDeepSeg.ads_utils as ads
-from AxonDeepSeg.apply_model import axon_segmentation
+from AxonDeepSeg.apply_model import axon_segmentation, save_segmentation, Segmenter, stitching_modes, \
+    skipped_patches_summary
+from AxonDeepSeg.resampling import resampling_backends
+from AxonDeepSeg.inference_backends import inference_backends
+from AxonDeepSeg.cache import ResamplingCache
+from AxonDeepSeg.incremental import SegmentationManifest, model_checksum, manifest_name
+from AxonDeepSeg.sharding import read_image_list, parse_shard, select_shard, shard_log_path, ShardLog
+from AxonDeepSeg.pixel_size import PixelSizeResolver, sidecar_suffix
 from AxonDeepSeg.ads_utils import convert_path
 from config import axonmyelin_suffix, axon_suffix, myelin_suffix
 
@@ -27,19 +37,35 @@ SEM_DEFAULT_MODEL_NAME = "default_SEM_model"
 TEM_DEFAULT_MODEL_NAME = "default_TEM_model"
 OM_MODEL_NAME = "model_seg_pns_bf"
 
-MODELS_PATH = pkg_resources.resource_filename('AxonDeepSeg', 'models')
-MODELS_PATH = Path(MODELS_PATH)
+# The models are installed with the package (see package_data in setup.py). Their folder is found from the package
+# itself rather than with pkg_resources, whose import alone takes a noticeable part of the startup of the command.
+MODELS_PATH = Path(AxonDeepSeg.__file__).resolve().parent / 'models'
 
 default_SEM_path = MODELS_PATH / SEM_DEFAULT_MODEL_NAME
 default_TEM_path = MODELS_PATH / TEM_DEFAULT_MODEL_NAME
 model_seg_pns_bf_path = MODELS_PATH / OM_MODEL_NAME
 default_overlap = 25
+default_batch_size = 1
+default_n_threads = 2
+default_n_jobs = 1
+default_compress_level = None
+default_tile_size = 2048
+default_stitching_mode = 'crop'
+# Stitching mode and overlap recommended for a model by the stitching_mode benchmark (see
+# AxonDeepSeg.testing.benchmarks), used as the defaults of the command line for this model when present.
+stitching_defaults_name = 'stitching_defaults.json'
+default_skip_threshold = 2.0
+default_resampling_backend = 'skimage'
+default_inference_backend = 'auto'
 
 # Definition of the functions
 
 def segment_image(path_testing_image, path_model,
                   overlap_value, config, resolution_model,
-                  acquired_resolution = None, verbosity_level=0):
+                  acquired_resolution = None, verbosity_level=0,
+                  inference_batch_size=default_batch_size, tile_size=None, segmenter=None,
+                  stitching_mode=default_stitching_mode, skip_threshold=None,
+                  resampling_backend=default_resampling_backend, compress_level=None):
 
     '''
     Segment the image located at the path_testing_image location.
@@ -51,6 +77,19 @@ def segment_image(path_testing_image, path_model,
     :param resolution_model: the resolution the model was trained on.
     :param verbosity_level: Level of verbosity. The higher, the more information is given about the segmentation
     process.
+    :param inference_batch_size: the number of patches fed to the network at once.
+    :param tile_size: if not None, the image is segmented tile by tile, with tiles of this size (in pixels, at the
+    resolution of the model), and the segmentation is written to a memory-mapped TIFF file. For images too large to
+    fit in memory.
+    :param segmenter: Segmenter object with the model already loaded. If None, the model is loaded for this image only.
+    :param stitching_mode: how the segmented patches are stitched: 'crop' keeps the central part of each patch, 'blend'
+    averages the probabilities of the overlapping patches with a smooth window, which allows a smaller overlap.
+    :param skip_threshold: if not None, the patches whose standard deviation of intensity is lower or equal to this
+    value (empty background, resin) are labelled as background without running the network.
+    :param resampling_backend: implementation of the resampling of the image to the resolution of the model: 'skimage',
+    'area' or 'opencv'.
+    :param compress_level: zlib compression level of the PNG segmentation images, from 0 (fastest) to 9 (smallest
+    files), or None for the default level.
     :return: Nothing.
     '''
 
@@ -74,12 +113,23 @@ def segment_image(path_testing_image, path_model,
 
         # Performing the segmentation
 
-        axon_segmentation(path_acquisitions_folders=path_acquisition, acquisitions_filenames=[acquisition_name],
-                          path_model_folder=path_model, config_dict=config, ckpt_name='model',
-                          inference_batch_size=1, overlap_value=overlap_value,
-                          resampled_resolutions=resolution_model, verbosity_level=verbosity_level,
-                          acquired_resolution=acquired_resolution,
-                          prediction_proba_activate=False, write_mode=True)
+        if tile_size is not None:
+            segment_tiled(path_testing_image, path_model, overlap_value, config, resolution_model,
+                          acquired_resolution=acquired_resolution, verbosity_level=verbosity_level,
+                          inference_batch_size=inference_batch_size, tile_size=tile_size, segmenter=segmenter,
+                          stitching_mode=stitching_mode, skip_threshold=skip_threshold,
+                          resampling_backend=resampling_backend)
+
+        else:
+            axon_segmentation(path_acquisitions_folders=path_acquisition, acquisitions_filenames=[acquisition_name],
+                              path_model_folder=path_model, config_dict=config, ckpt_name='model',
+                              inference_batch_size=inference_batch_size, overlap_value=overlap_value,
+                              resampled_resolutions=resolution_model, verbosity_level=verbosity_level,
+                              acquired_resolution=acquired_resolution,
+                              prediction_proba_activate=False, write_mode=True,
+                              segmenter=segmenter, stitching_mode=stitching_mode,
+                              skip_threshold=skip_threshold, resampling_backend=resampling_backend,
+                              compress_level=compress_level)
 
         if verbosity_level >= 1:
             print(("Image {0} segmented.".format(path_testing_image)))
@@ -90,10 +140,76 @@ def segment_image(path_testing_image, path_model,
 
     return None
 
+def segment_tiled(path_testing_image, path_model,
+                  overlap_value, config, resolution_model,
+                  acquired_resolution, verbosity_level=0,
+                  inference_batch_size=default_batch_size, tile_size=default_tile_size,
+                  n_threads=0, segmenter=None, stitching_mode=default_stitching_mode, skip_threshold=None,
+                  resampling_backend=default_resampling_backend):
+    '''
+    Segment a large image tile by tile. The segmentation is written to a memory-mapped TIFF file named after the image,
+    with the axonmyelin suffix and a .tif extension.
+    :param path_testing_image: the path of the image to segment.
+    :param path_model: where to access the model
+    :param overlap_value: the number of pixels to be used for overlap when doing prediction.
+    :param config: dict containing the configuration of the network
+    :param resolution_model: the resolution the model was trained on.
+    :param acquired_resolution: the pixel size of the image, in micrometers.
+    :param verbosity_level: Level of verbosity.
+    :param inference_batch_size: the number of patches fed to the network at once.
+    :param tile_size: the size of the tiles, in pixels at the resolution of the model.
+    :param n_threads: the number of threads resampling and reconstructing the tiles while the network runs.
+    :param segmenter: Segmenter object with the model already loaded. If None, the model is loaded for this image only.
+    :param stitching_mode: how the segmented patches are stitched: 'crop' or 'blend'.
+    :param skip_threshold: if not None, the patches whose standard deviation of intensity is lower or equal to this
+    value are labelled as background without running the network.
+    :param resampling_backend: implementation of the resampling of the image to the resolution of the model: 'skimage',
+    'area' or 'opencv'.
+    :return: the path of the segmentation file.
+    '''
+
+    # If string, convert to Path objects
+    path_testing_image = convert_path(path_testing_image)
+    path_model = convert_path(path_model)
+
+    path_segmentation = path_testing_image.parent / (path_testing_image.stem + axonmyelin_suffix.stem + '.tif')
+
+    close_segmenter = segmenter is None
+    if segmenter is None:
+        segmenter = Segmenter(path_model, config, ckpt_name='model', verbosity_level=verbosity_level)
+
+    segmenter.segment_tiled(path_testing_image, acquired_resolution, path_segmentation,
+                            resampled_resolution=resolution_model, tile_size=tile_size,
+                            inference_batch_size=inference_batch_size, overlap_value=overlap_value,
+                            n_workers=n_threads, stitching_mode=stitching_mode, skip_threshold=skip_threshold,
+                            resampling_backend=resampling_backend)
+
+    if close_segmenter:
+        segmenter.close()
+
+    return path_segmentation
+
 def segment_folders(path_testing_images_folder, path_model,
                     overlap_value, config, resolution_model,
                     acquired_resolution = None,
-                    verbosity_level=0):
+                    verbosity_level=0,
+                    inference_batch_size=default_batch_size,
+                    n_threads=default_n_threads,
+                    tile_size=None,
+                    segmenter=None,
+                    stitching_mode=default_stitching_mode,
+                    skip_threshold=None,
+                    resampling_backend=default_resampling_backend,
+                    use_cache=True,
+                    force=False,
+                    n_jobs=1,
+                    pixel_size_resolver=None,
+                    compress_level=None,
+                    inference_backend=default_inference_backend,
+                    intra_op_threads=0,
+                    cache=None,
+                    keep_segmenter=False,
+                    patch_counts=None):
     '''
     Segments the images contained in the image folders located in the path_testing_images_folder.
     :param path_testing_images_folder: the folder where all image folders are located (the images to segment are located
@@ -103,29 +219,106 @@ def segment_folders(path_testing_images_folder, path_model,
     border effects but more time to perform the segmentation.
     :param config: dict containing the configuration of the network
     :param resolution_model: the resolution the model was trained on.
+    :param acquired_resolution: the pixel size of the images, in micrometers. If None, the pixel size of each image is
+    found by pixel_size_resolver.
     :param verbosity_level: Level of verbosity. The higher, the more information is given about the segmentation
     process.
-    :return: Nothing.
+    :param inference_batch_size: the number of patches fed to the network at once.
+    :param n_threads: the number of threads loading the images and the number of threads writing the segmentations
+    while the network runs. 0 processes the images sequentially.
+    :param tile_size: if not None, each image is segmented tile by tile, with tiles of this size (in pixels, at the
+    resolution of the model), and its segmentation is written to a memory-mapped TIFF file.
+    :param segmenter: Segmenter object with the model already loaded. If None, the model is loaded once for the whole
+    folder (once per process if n_jobs is above 1).
+    :param stitching_mode: how the segmented patches are stitched: 'crop' or 'blend'.
+    :param skip_threshold: if not None, the patches whose standard deviation of intensity is lower or equal to this
+    value are labelled as background without running the network.
+    :param resampling_backend: implementation of the resampling of the image to the resolution of the model: 'skimage',
+    'area' or 'opencv'.
+    :param use_cache: if True, the resampled images are stored in the resampling cache, and the images already resampled
+    to the resolution of the model are read from it.
+    :param force: if False, the images whose segmentation already exists and was done from the same image with the
+    same model and parameters (as recorded in the segmentation manifest of the folder) are not segmented again. If
+    True, all the images are segmented.
+    :param n_jobs: the number of processes segmenting the images. Above 1, each process loads its own copy of the
+    model and the segmenter argument is not used.
+    :param pixel_size_resolver: PixelSizeResolver object finding the pixel size of each image when acquired_resolution
+    is None. If None, the sidecar files, TIFF tags and pixel_size_in_micrometer.txt file of the folder are used.
+    :param compress_level: zlib compression level of the PNG segmentation images, from 0 (fastest) to 9 (smallest
+    files), or None for the default level.
+    :param inference_backend: the backend running the network: 'auto', 'keras', 'tensorflow', 'onnxruntime' or
+    'onnxruntime_int8' (see AxonDeepSeg.inference_backends).
+    :param intra_op_threads: the number of threads the backend uses inside an operation. 0 lets the backend choose, or
+    shares the cores equally between the processes if n_jobs is above 1.
+    :param cache: ResamplingCache object used when use_cache is True, created once by the caller to be shared by
+    several folders. If None, a cache is created for the folder. With several processes, each process creates its own.
+    :param keep_segmenter: if True, the segmenter created by this function is returned without being closed, to be
+    passed to the next calls.
+    :param patch_counts: collections.Counter to which the numbers of patches segmented ('n_patches') and skipped as
+    background ('n_skipped_patches') by the worker processes and by the segmenter closed by this function are added.
+    :return: the segmenter, given or created, or None if none was needed. The model is only loaded once the images
+    whose segmentation is up to date are filtered out, and not at all if no image is left to segment.
     '''
 
     # If string, convert to Path objects
     path_testing_images_folder = convert_path(path_testing_images_folder)
     path_model = convert_path(path_model)
 
+    # The model is loaded once and reused for every image of the folder.
+    close_segmenter = (segmenter is None) and not keep_segmenter
+
     # Update list of images to segment by selecting only image files (not already segmented or not masks)
     img_files = [file for file in path_testing_images_folder.iterdir() if (file.suffix.lower() in ('.png','.jpg','.jpeg','.tif','.tiff'))
-                 and (not str(file).endswith((str(axonmyelin_suffix), str(axon_suffix), str(myelin_suffix),'mask.png')))]
-
-    # Pre-processing: convert to png if not already done and adapt to model contrast
-    for file_ in tqdm(img_files, desc="Segmentation..."):
-        print(path_testing_images_folder / file_)
-        try:
-            height, width, _ = ads.imread(str(path_testing_images_folder / file_)).shape
-        except:
-            try:
-                height, width = ads.imread(str(path_testing_images_folder / file_)).shape
-            except Exception as e:
-                raise e
+                 and (not str(file).endswith((str(axonmyelin_suffix), str(axon_suffix), str(myelin_suffix),'mask.png', axonmyelin_suffix.stem + '.tif')))]
+
+    def segmentation_path(file_):
+        if tile_size is not None:
+            return path_testing_images_folder / (file_.stem + axonmyelin_suffix.stem + '.tif')
+        return path_testing_images_folder / (file_.stem + str(axonmyelin_suffix))
+
+    # Without a pixel size for the whole folder, the pixel size of each image is found by the resolver
+    if acquired_resolution is None:
+        if pixel_size_resolver is None:
+            pixel_size_resolver = PixelSizeResolver()
+        pixel_sizes = {file_: pixel_size_resolver.resolve(file_) for file_ in img_files}
+
+        missing_pixel_sizes = [str(file_) for file_ in img_files if pixel_sizes[file_] is None]
+        if missing_pixel_sizes:
+            print("ERROR: No pixel size is provided, and no pixel size was found for the image(s): {0}. ".format(", ".join(missing_pixel_sizes)),
+                  "Please provide a pixel size (using argument -s), or add a pixel_size_in_micrometer.txt file ",
+                  "containing the pixel size value to the image folder, or a <image name>"+sidecar_suffix+" file next to each image."
+            )
+            sys.exit(3)
+    else:
+        pixel_sizes = {file_: acquired_resolution for file_ in img_files}
+
+    # The segmentations are recorded in the manifest of the folder with everything they depend on, and the images
+    # whose segmentation is up to date are skipped.
+    manifest = SegmentationManifest(path_testing_images_folder, {
+        'model_checksum': model_checksum(path_model, config),
+        'overlap_value': overlap_value,
+        'resolution_model': resolution_model,
+        'tile_size': tile_size,
+        'stitching_mode': stitching_mode,
+        'skip_threshold': skip_threshold,
+        'resampling_backend': resampling_backend,
+        'inference_backend': inference_backend
+    })
+
+    if not force:
+        n_files = len(img_files)
+        img_files = [file_ for file_ in img_files
+                     if not manifest.is_up_to_date(file_, segmentation_path(file_), acquired_resolution=pixel_sizes[file_])]
+
+        if verbosity_level >= 1 and len(img_files) < n_files:
+            print("{0} image(s) already segmented with the same parameters are skipped (use --force to segment them "
+                  "again).".format(n_files - len(img_files)))
+
+    # Check that every image is large enough for the given resolution before segmenting the folder
+    for file_ in img_files:
+        acquired_resolution = pixel_sizes[file_]
+        # Only the header is read: the image is decoded once, when it is segmented
+        height, width = ads.imread_shape(path_testing_images_folder / file_)
 
         image_size = [height, width]
         minimum_resolution = config["trainingset_patchsize"] * resolution_model / min(image_size)
@@ -139,29 +332,333 @@ def segment_folders(path_testing_images_folder, path_model,
 
             sys.exit(2)
 
-        selected_model = path_model.name
+    if not img_files:
+        return segmenter
 
-        # Read image for conversion
-        img = ads.imread(str(path_testing_images_folder / file_))
+    parameters = dict(overlap_value=overlap_value, config=config, resolution_model=resolution_model,
+                      acquired_resolution=[pixel_sizes[file_] for file_ in img_files], verbosity_level=verbosity_level,
+                      inference_batch_size=inference_batch_size, n_threads=n_threads, tile_size=tile_size,
+                      stitching_mode=stitching_mode, skip_threshold=skip_threshold,
+                      resampling_backend=resampling_backend, use_cache=use_cache, compress_level=compress_level)
 
-        img_name_original = file_.stem
+    n_jobs = min(n_jobs, len(img_files))
 
-        acquisition_name = file_.name
+    if n_jobs > 1:
+        # The images are shared between several processes, each with its own copy of the model.
+        segmentations = segment_files_in_processes(img_files, path_model, n_jobs, inference_backend=inference_backend,
+                                                   intra_op_threads=intra_op_threads, patch_counts=patch_counts,
+                                                   **parameters)
+    else:
+        if segmenter is None:
+            segmenter = Segmenter(path_model, config, ckpt_name='model', verbosity_level=verbosity_level,
+                                  intra_op_threads=intra_op_threads, inference_backend=inference_backend)
+        segmentations = segment_files(img_files, path_model, segmenter, cache=cache, **parameters)
 
-        axon_segmentation(path_acquisitions_folders=path_testing_images_folder, acquisitions_filenames=[acquisition_name],
-                              path_model_folder=path_model, config_dict=config, ckpt_name='model',
-                              inference_batch_size=1, overlap_value=overlap_value,
-                              acquired_resolution=acquired_resolution,
-                              verbosity_level=verbosity_level,
-                              resampled_resolutions=resolution_model, prediction_proba_activate=False,
-                              write_mode=True)
+    for file_ in tqdm(segmentations, total=len(img_files), desc="Segmentation..."):
+        manifest.record(file_, acquired_resolution=pixel_sizes[file_])
 
         if verbosity_level >= 1:
-            tqdm.write("Image {0} segmented.".format(str(path_testing_images_folder / file_)))
+            tqdm.write("Image {0} segmented.".format(str(file_)))
 
+    if close_segmenter and segmenter is not None:
+        add_patch_counts(patch_counts, segmenter)
+        segmenter.close()
+        segmenter = None
 
+    return segmenter
 
-    return None
+def add_patch_counts(patch_counts, segmenter):
+    '''
+    Adds the numbers of patches segmented and skipped as background by a segmenter to a counter.
+    :param patch_counts: collections.Counter, or None.
+    :param segmenter: Segmenter object.
+    :return: Nothing.
+    '''
+
+    if patch_counts is not None:
+        patch_counts.update({'n_patches': segmenter.n_patches, 'n_skipped_patches': segmenter.n_skipped_patches})
+
+def segment_files(img_files, path_model, segmenter, overlap_value, config, resolution_model, acquired_resolution,
+                  verbosity_level=0, inference_batch_size=default_batch_size, n_threads=default_n_threads,
+                  tile_size=None, stitching_mode=default_stitching_mode, skip_threshold=None,
+                  resampling_backend=default_resampling_backend, use_cache=True, compress_level=None, cache=None):
+    '''
+    Segments a list of images with a loaded model, and writes the segmentation of each image next to it. The
+    parameters are the ones of segment_folders.
+    :param img_files: list of the paths of the images to segment.
+    :param segmenter: Segmenter object with the model loaded.
+    :param acquired_resolution: the pixel size of the images, or the list of the pixel sizes of each image.
+    :param cache: ResamplingCache object used when use_cache is True. If None, a cache is created.
+    :return: generator of the paths of the images, each yielded once its segmentation is written.
+    '''
+
+    if not use_cache:
+        cache = None
+    elif cache is None:
+        cache = ResamplingCache()
+
+    if isinstance(acquired_resolution, (list, tuple)):
+        acquired_resolutions = list(acquired_resolution)
+    else:
+        acquired_resolutions = [acquired_resolution] * len(img_files)
+
+    # Large images are segmented one after the other, tile by tile
+    if tile_size is not None:
+        for file_, resolution in zip(img_files, acquired_resolutions):
+            segment_tiled(file_, path_model, overlap_value, config, resolution_model,
+                          acquired_resolution=resolution, verbosity_level=verbosity_level,
+                          inference_batch_size=inference_batch_size, tile_size=tile_size, n_threads=n_threads,
+                          segmenter=segmenter, stitching_mode=stitching_mode, skip_threshold=skip_threshold,
+                          resampling_backend=resampling_backend)
+            yield file_
+
+        return
+
+    # The segmentations are written by the writing threads of segment_stream, in the background of the inference.
+    def save(i, prediction):
+        save_segmentation(prediction, img_files[i].parent / (img_files[i].stem + str(axonmyelin_suffix)),
+                          segmenter.n_classes, compress_level=compress_level)
+
+    # The patches of all the images are streamed through shared inference batches, and each segmentation is written as
+    # soon as all of its patches are predicted.
+    segmentations = segmenter.segment_stream(img_files,
+                                             acquired_resolutions,
+                                             inference_batch_size=inference_batch_size,
+                                             overlap_value=overlap_value,
+                                             resampled_resolutions=[resolution_model] * len(img_files),
+                                             n_workers=n_threads, postprocessing=save,
+                                             stitching_mode=stitching_mode, skip_threshold=skip_threshold,
+                                             resampling_backend=resampling_backend,
+                                             cache=cache)
+
+    for i, prediction in segmentations:
+        yield img_files[i]
+
+def segment_shard(img_files, path_model, n_tf_threads, progress_queue, inference_backend=default_inference_backend,
+                  **parameters):
+    '''
+    Segments a share of the images of a folder in a worker process, with a model loaded for this process.
+    :param img_files: list of the paths of the images to segment.
+    :param path_model: where to access the model.
+    :param n_tf_threads: the number of threads the inference backend uses inside an operation.
+    :param progress_queue: queue where the path of each image is put once its segmentation is written.
+    :param inference_backend: the backend running the network.
+    :param parameters: the parameters of segment_files.
+    :return: dict, the numbers of patches segmented ('n_patches') and skipped as background ('n_skipped_patches').
+    '''
+
+    with Segmenter(path_model, parameters['config'], ckpt_name='model', verbosity_level=parameters['verbosity_level'],
+                   intra_op_threads=n_tf_threads, inter_op_threads=1,
+                   inference_backend=inference_backend) as segmenter:
+        for file_ in segment_files(img_files, path_model, segmenter, **parameters):
+            progress_queue.put(str(file_))
+
+        return {'n_patches': segmenter.n_patches, 'n_skipped_patches': segmenter.n_skipped_patches}
+
+def segment_files_in_processes(img_files, path_model, n_jobs, inference_backend=default_inference_backend,
+                               intra_op_threads=0, patch_counts=None, **parameters):
+    '''
+    Segments a list of images with n_jobs worker processes. The images are dealt to the processes in turn, each process
+    restores its own copy of the model, and the cores are shared equally between the sessions of the backend.
+    :param img_files: list of the paths of the images to segment.
+    :param path_model: where to access the model.
+    :param n_jobs: the number of worker processes.
+    :param inference_backend: the backend running the network.
+    :param intra_op_threads: the number of threads each process uses inside an operation, or 0 to share the cores
+    equally between the processes.
+    :param patch_counts: collections.Counter to which the numbers of patches segmented and skipped as background by
+    the processes are added, or None.
+    :param parameters: the parameters of segment_files.
+    :return: generator of the paths of the images, each yielded once its segmentation is written. If a worker fails,
+    the other workers are terminated and its exception is raised.
+    '''
+
+    # Tensorflow does not support being forked once initialized, so the workers are started from scratch.
+    context = multiprocessing.get_context('spawn')
+    n_tf_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // n_jobs)
+    acquired_resolution = parameters.pop('acquired_resolution')
+    if not isinstance(acquired_resolution, (list, tuple)):
+        acquired_resolution = [acquired_resolution] * len(img_files)
+
+    with context.Manager() as manager:
+        progress_queue = manager.Queue()
+        pool = context.Pool(processes=n_jobs)
+
+        try:
+            results = [pool.apply_async(segment_shard, (img_files[k::n_jobs], path_model, n_tf_threads, progress_queue),
+                                        dict(parameters, inference_backend=inference_backend,
+                                             acquired_resolution=acquired_resolution[k::n_jobs]))
+                       for k in range(n_jobs)]
+
+            n_segmented = 0
+            while n_segmented < len(img_files):
+                # A worker that failed stops the segmentation: get() raises its exception.
+                for result in results:
+                    if result.ready() and not result.successful():
+                        result.get()
+
+                try:
+                    path_segmented = progress_queue.get(timeout=1)
+                except queue.Empty:
+                    if all(result.ready() for result in results) and progress_queue.empty():
+                        break
+                    continue
+
+                n_segmented += 1
+                yield Path(path_segmented)
+
+            for result in results:
+                counts = result.get()
+                if patch_counts is not None:
+                    patch_counts.update(counts)
+        except BaseException:
+            # The other workers are stopped without waiting for the end of their images, also when the consumer of
+            # the generator stops early.
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+def segment_image_list(image_list, path_model, overlap_value, config, resolution_model, path_log_folder,
+                       shard=(0, 1),
+                       verbosity_level=0,
+                       inference_batch_size=default_batch_size,
+                       n_threads=default_n_threads,
+                       tile_size=None,
+                       segmenter=None,
+                       stitching_mode=default_stitching_mode,
+                       skip_threshold=None,
+                       resampling_backend=default_resampling_backend,
+                       use_cache=True,
+                       force=False,
+                       pixel_size_resolver=None,
+                       compress_level=None,
+                       inference_backend=default_inference_backend,
+                       intra_op_threads=0,
+                       cache=None,
+                       patch_counts=None):
+    '''
+    Segments a shard of a list of images, each with its own pixel size, and writes the segmentation of each image next
+    to it. Each image segmented, or that cannot be segmented, is appended to the completion log of the shard, and the
+    images already segmented according to the log are skipped, so an interrupted shard can be run again.
+    :param image_list: list of tuples (path of the image, pixel size in micrometers), see
+    AxonDeepSeg.sharding.read_image_list.
+    :param path_model: where to access the model.
+    :param overlap_value: the number of pixels to be used for overlap when doing prediction.
+    :param config: dict containing the configuration of the network
+    :param resolution_model: the resolution the model was trained on.
+    :param path_log_folder: the folder where the completion logs of the shards are written.
+    :param shard: tuple (i, N), the shard i (counted from 0) of N shards to segment.
+    :param force: if True, the images already segmented according to the log are segmented again.
+    :param pixel_size_resolver: PixelSizeResolver object finding the pixel size of the images listed without one. If
+    None, these images are logged as failed.
+    The other parameters are the ones of segment_folders.
+    :return: the number of images segmented and the number of images that could not be segmented.
+    '''
+
+    path_model = convert_path(path_model)
+    index, count = shard
+    shard_log = ShardLog(shard_log_path(path_log_folder, index, count), index, count)
+
+    # The images are logged under their resolved path, whatever the working directory or the path of the list.
+    image_list = [(convert_path(path_image).resolve(), pixel_size)
+                  for path_image, pixel_size in select_shard(image_list, index, count)]
+    if not force:
+        completed = shard_log.completed_images()
+        image_list = [(path_image, pixel_size) for path_image, pixel_size in image_list
+                      if str(path_image) not in completed]
+
+    # The images that cannot be segmented are logged as failed instead of stopping the whole shard
+    img_files, acquired_resolutions = [], []
+    n_failed = 0
+
+    for path_image, pixel_size in image_list:
+        if (pixel_size is None) and (pixel_size_resolver is not None) and path_image.exists():
+            pixel_size = pixel_size_resolver.resolve(path_image)
+
+        if not path_image.exists():
+            error = "The image does not exist."
+        elif pixel_size is None:
+            error = "No pixel size is provided for the image."
+        else:
+            try:
+                height, width = ads.imread_shape(path_image)
+            except Exception as e:
+                error = "The image cannot be read: {0}".format(e)
+            else:
+                minimum_resolution = config["trainingset_patchsize"] * resolution_model / min(height, width)
+                error = None
+                if pixel_size < minimum_resolution:
+                    error = "The size of the image ({0}x{1}) is too small for its pixel size ({2}).".format(
+                        height, width, pixel_size)
+
+        if error is not None:
+            shard_log.write(path_image, 'failed', pixel_size=pixel_size, error=error)
+            n_failed += 1
+            if verbosity_level >= 1:
+                print("Image {0} not segmented: {1}".format(path_image, error))
+        else:
+            img_files.append(path_image)
+            acquired_resolutions.append(pixel_size)
+
+    if not img_files:
+        return 0, n_failed
+
+    close_segmenter = segmenter is None
+    if segmenter is None:
+        segmenter = Segmenter(path_model, config, ckpt_name='model', verbosity_level=verbosity_level,
+                              intra_op_threads=intra_op_threads, inference_backend=inference_backend)
+
+    pixel_sizes = dict(zip(img_files, acquired_resolutions))
+
+    def segment(files):
+        return segment_files(files, path_model, segmenter, overlap_value, config, resolution_model,
+                             [pixel_sizes[file_] for file_ in files], verbosity_level=verbosity_level,
+                             inference_batch_size=inference_batch_size, n_threads=n_threads,
+                             tile_size=tile_size, stitching_mode=stitching_mode,
+                             skip_threshold=skip_threshold, resampling_backend=resampling_backend,
+                             use_cache=use_cache, compress_level=compress_level, cache=cache)
+
+    segmented = set()
+    try:
+        with tqdm(total=len(img_files), desc="Segmentation...") as progress:
+            def record_segmented(file_):
+                shard_log.write(file_, 'segmented', pixel_size=pixel_sizes[file_])
+                segmented.add(file_)
+                progress.update()
+
+                if verbosity_level >= 1:
+                    tqdm.write("Image {0} segmented.".format(str(file_)))
+
+            try:
+                for file_ in segment(img_files):
+                    record_segmented(file_)
+            except Exception as e:
+                # The images are streamed together, so the image that failed is not known: the images left are
+                # segmented one by one, and only the ones that cannot be segmented are logged as failed.
+                if verbosity_level >= 1:
+                    tqdm.write("The segmentation failed ({0}), the images left are segmented one by one.".format(e))
+
+                for file_ in [file_ for file_ in img_files if file_ not in segmented]:
+                    try:
+                        for _ in segment([file_]):
+                            pass
+                    except Exception as e:
+                        shard_log.write(file_, 'failed', pixel_size=pixel_sizes[file_], error=str(e))
+                        n_failed += 1
+                        progress.update()
+                        if verbosity_level >= 1:
+                            tqdm.write("Image {0} not segmented: {1}".format(file_, e))
+                    else:
+                        record_segmented(file_)
+    finally:
+        if close_segmenter:
+            add_patch_counts(patch_counts, segmenter)
+            segmenter.close()
+
+    return len(segmented), n_failed
 
 def generate_default_parameters(type_acquisition, new_path):
     '''
@@ -217,6 +714,28 @@ def generate_config_dict(path_to_config_file):
 
     return config_network
 
+def read_stitching_defaults(path_model):
+    '''
+    Reads the stitching mode and overlap recommended for a model by the stitching_mode benchmark.
+    :param path_model: Path to the model folder.
+    :return: tuple (stitching mode, overlap value), the default ones if the benchmark was not saved for this model.
+    '''
+
+    path_defaults = convert_path(path_model) / stitching_defaults_name
+
+    try:
+        with open(str(path_defaults), 'r') as f:
+            defaults = json.load(f)
+        stitching_mode, overlap_value = defaults['stitching_mode'], int(defaults['overlap_value'])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return default_stitching_mode, default_overlap
+
+    if stitching_mode not in stitching_modes:
+        return default_stitching_mode, default_overlap
+
+    return stitching_mode, overlap_value
+
+
 def generate_resolution(type_acquisition, model_input_size):
     '''
     Generates the resolution to use related to the trained modeL.
@@ -261,8 +780,9 @@ def main(argv=None):
                                                                                         'SEM: scanning electron microscopy samples. \n'+
                                                                                         'TEM: transmission electron microscopy samples. \n'+
                                                                                         'OM: optical microscopy samples')
-    requiredName.add_argument('-i', '--imgpath', required=True, nargs='+', help='Path to the image to segment or path to the folder \n'+
-                                                                                'where the image(s) to segment is/are located.')
+    requiredName.add_argument('-i', '--imgpath', required=False, nargs='+', help='Path to the image to segment or path to the folder \n'+
+                                                                                'where the image(s) to segment is/are located. \n'+
+                                                                                'Required unless a list of images is given with --manifest.')
 
     ap.add_argument("-m", "--model", required=False, help='Folder where the model is located. \n'+
                                                           'The default SEM model path is: \n'+str(default_SEM_path)+'\n'+
@@ -273,6 +793,14 @@ def main(argv=None):
                                                               'file needs to be added to the image folder path. The pixel size \n'+
                                                               'in that file will be used for the segmentation.',
                                                               default=None)
+    ap.add_argument('--pixel-size-map', required=False, help='CSV file with the columns image and pixel_size (or JSON lines file \n'+
+                                                              'with the keys image and pixel_size) giving the pixel size of each \n'+
+                                                              'image, in micrometers. Relative paths are relative to the file. \n'+
+                                                              'Without -s, the pixel size of each image is taken from this map, \n'+
+                                                              'then from a <image name>'+sidecar_suffix+' \n'+
+                                                              'file next to the image, then from the resolution tags of TIFF \n'+
+                                                              'images, then from the pixel_size_in_micrometer.txt file of the folder.',
+                                                              default=None)
     ap.add_argument('-v', '--verbose', required=False, type=int, choices=list(range(0,4)), help='Verbosity level. \n'+
                                                             '0 (default) : Displays the progress bar for the segmentation. \n'+
                                                             '1: Also displays the path of the image(s) being segmented. \n'+
@@ -283,27 +811,169 @@ def main(argv=None):
     ap.add_argument('--overlap', required=False, type=int, help='Overlap value (in pixels) of the patches when doing the segmentation. \n'+
                                                             'Higher values of overlap can improve the segmentation at patch borders, \n'+
                                                             'but also increase the segmentation time. \n'+
-                                                            'Default value: '+str(default_overlap)+'\n'+
+                                                            'Default value: the overlap saved by the stitching benchmark of \n'+
+                                                            'the model ('+stitching_defaults_name+'), else '+str(default_overlap)+'\n'+
                                                             'Recommended range of values: [10-100]. \n',
-                                                            default=25)
+                                                            default=None)
+    ap.add_argument('--batch-size', required=False, type=int, help='Number of patches fed to the network at once. \n'+
+                                                            'Larger batches use more memory but process the patches faster. \n'+
+                                                            'Default value: '+str(default_batch_size)+'\n',
+                                                            default=default_batch_size)
+    ap.add_argument('--threads', required=False, type=int, help='Number of threads loading the images and number of threads \n'+
+                                                            'writing the segmentations while the network runs, when \n'+
+                                                            'segmenting a folder. 0 processes the images one after the other. \n'+
+                                                            'Default value: '+str(default_n_threads)+'\n',
+                                                            default=default_n_threads)
+    ap.add_argument('--jobs', required=False, type=int, help='Number of processes segmenting the images, when segmenting a folder. \n'+
+                                                            'Each process loads its own copy of the model and uses an equal \n'+
+                                                            'share of the CPU cores. \n'+
+                                                            'Default value: '+str(default_n_jobs)+'\n',
+                                                            default=default_n_jobs)
+    ap.add_argument('--tile-size', required=False, type=int, nargs='?', const=default_tile_size,
+                                                            help='Segment the image(s) tile by tile, for images too large to fit in memory. \n'+
+                                                            'The image is read region by region and the segmentation is written \n'+
+                                                            'to a memory-mapped TIFF file (suffix '+axonmyelin_suffix.stem+'.tif). \n'+
+                                                            'The optional value is the size of the tiles, in pixels at the \n'+
+                                                            'resolution of the model. Default tile size: '+str(default_tile_size)+'\n',
+                                                            default=None)
+    ap.add_argument('--stitching', required=False, choices=stitching_modes,
+                                                            help='How the segmented patches are stitched together. \n'+
+                                                            'crop: keeps the central part of each patch. \n'+
+                                                            'blend: averages the probabilities of the overlapping patches, \n'+
+                                                            '   weighted by a smooth window. Avoids seams at the patch borders \n'+
+                                                            '   with a smaller overlap. \n'+
+                                                            'Default value: the mode saved by the stitching benchmark of \n'+
+                                                            'the model ('+stitching_defaults_name+'), else '+default_stitching_mode+'\n',
+                                                            default=None)
+    ap.add_argument('--skip-background', required=False, type=float, nargs='?', const=default_skip_threshold,
+                                                            help='Do not run the network on the patches of background (empty areas, \n'+
+                                                            'resin), which are labelled as background. A patch is background if \n'+
+                                                            'the standard deviation of its intensity is lower or equal to the \n'+
+                                                            'optional value. Default threshold: '+str(default_skip_threshold)+'\n',
+                                                            default=None)
+    ap.add_argument('--no-cache', required=False, action='store_true',
+                                                            help='When segmenting a folder, do not read the resampled images from the \n'+
+                                                            'resampling cache (~/.axondeepseg/resampling_cache) nor store them in it.\n')
+    ap.add_argument('--force', required=False, action='store_true',
+                                                            help='When segmenting a folder, also segment the images whose segmentation \n'+
+                                                            'is up to date. By default, the images already segmented from the \n'+
+                                                            'same image file with the same model and parameters (as recorded in \n'+
+                                                            'the '+manifest_name+' file of the folder) are skipped. With --manifest, \n'+
+                                                            'also segment the images already in the completion log.\n')
+    ap.add_argument('--manifest', required=False, help='List of images to segment with their pixel size: a CSV file with the \n'+
+                                                            'columns image and pixel_size, or a JSON lines file with the keys \n'+
+                                                            'image and pixel_size. Relative paths are relative to the list. \n'+
+                                                            'The images without pixel size use the pixel size given with -s. \n'+
+                                                            'The segmented images are appended to a completion log, and the \n'+
+                                                            'images already in the log are skipped (unless --force is used).\n',
+                                                            default=None)
+    ap.add_argument('--shard', required=False, help='With --manifest, segment only the shard i/N of the list (i counted \n'+
+                                                            'from 0), for instance 3/16. Each shard always gets the same images. \n'+
+                                                            'The logs of the shards are merged with axondeepseg_merge_shards.\n',
+                                                            default=None)
+    ap.add_argument('--shard-logs', required=False, help='Folder of the completion logs of the shards. Default: the folder \n'+
+                                                            '<manifest name>_shard_logs next to the manifest.\n',
+                                                            default=None)
+    ap.add_argument('--compression', required=False, type=int, choices=list(range(0, 10)),
+                                                            help='Compression level of the PNG segmentation images, from 0 (fastest, \n'+
+                                                            'largest files) to 9 (slowest, smallest files). \n'+
+                                                            'Default: the default level of the image writer.\n',
+                                                            default=default_compress_level)
+    ap.add_argument('--backend', required=False, choices=inference_backends,
+                                                            help='Backend running the network. \n'+
+                                                            'keras: the network built from the checkpoint of the model. \n'+
+                                                            'tensorflow: the frozen graph of the model. \n'+
+                                                            'onnxruntime: the ONNX model, run by ONNX Runtime (CPU). \n'+
+                                                            'onnxruntime_int8: the int8 ONNX model written by \n'+
+                                                            'axondeepseg_quantize_model (CPU). \n'+
+                                                            'auto: the frozen graph if it is up to date, else keras. \n'+
+                                                            'The frozen graph and the ONNX model are exported with \n'+
+                                                            'axondeepseg_export_model. \n'+
+                                                            'Default value: '+default_inference_backend+'\n',
+                                                            default=default_inference_backend)
+    ap.add_argument('--intra-op-threads', required=False, type=int,
+                                                            help='Number of threads the backend uses inside an operation. \n'+
+                                                            '0 lets the backend choose (with --jobs, the cores are shared \n'+
+                                                            'equally between the processes). \n'+
+                                                            'Default value: 0\n',
+                                                            default=0)
+    ap.add_argument('--resampling', required=False, choices=resampling_backends,
+                                                            help='Implementation of the resampling of the image(s) to the resolution \n'+
+                                                            'of the model. \n'+
+                                                            'skimage: bilinear interpolation with scikit-image. \n'+
+                                                            'area: area averaging to reduce the image, bilinear interpolation to \n'+
+                                                            '   enlarge it. Faster, and uses less memory on large images. \n'+
+                                                            'opencv: the same with OpenCV. \n'+
+                                                            'Default value: '+default_resampling_backend+'\n',
+                                                            default=default_resampling_backend)
     ap._action_groups.reverse()
 
     # Processing the arguments
     args = vars(ap.parse_args(argv))
     type_ = str(args["type"])
     verbosity_level = int(args["verbose"])
-    overlap_value = int(args["overlap"])
+    inference_batch_size = int(args["batch_size"])
+    if inference_batch_size < 1:
+        print("ERROR: The batch size must be a positive integer.")
+        sys.exit(2)
+    n_threads = int(args["threads"])
+    if n_threads < 0:
+        print("ERROR: The number of threads must be a positive integer or 0.")
+        sys.exit(2)
+    n_jobs = int(args["jobs"])
+    if n_jobs < 1:
+        print("ERROR: The number of jobs must be a positive integer.")
+        sys.exit(2)
+    tile_size = args["tile_size"]
+    if (tile_size is not None) and (tile_size < 1):
+        print("ERROR: The tile size must be a positive integer.")
+        sys.exit(2)
+    skip_threshold = args["skip_background"]
+    resampling_backend = args["resampling"]
+    inference_backend = args["backend"]
+    intra_op_threads = int(args["intra_op_threads"])
+    if intra_op_threads < 0:
+        print("ERROR: The number of intra-op threads must be a positive integer or 0.")
+        sys.exit(2)
+    use_cache = not args["no_cache"]
+    force = args["force"]
+    compress_level = args["compression"]
+    if (skip_threshold is not None) and (skip_threshold < 0):
+        print("ERROR: The background threshold must be a positive number or 0.")
+        sys.exit(2)
     if args["sizepixel"] is not None:
         psm = float(args["sizepixel"])
     else:
         psm = None
-    path_target_list = [Path(p) for p in args["imgpath"]]
+    path_target_list = [Path(p) for p in args["imgpath"]] if args["imgpath"] else []
+    path_image_list = Path(args["manifest"]) if args["manifest"] else None
+    if (not path_target_list) and (path_image_list is None):
+        print("ERROR: No image to segment. Please provide the path(s) of the images (using argument -i) or a list of ",
+              "images (using argument --manifest).")
+        sys.exit(3)
+    shard = (0, 1)
+    if args["shard"] is not None:
+        if path_image_list is None:
+            print("ERROR: A shard can only be segmented from a list of images (using argument --manifest).")
+            sys.exit(2)
+        try:
+            shard = parse_shard(args["shard"])
+        except ValueError as e:
+            print("ERROR: {0}".format(e))
+            sys.exit(2)
     new_path = Path(args["model"]) if args["model"] else None 
 
     # Preparing the arguments to axon_segmentation function
     path_model, config = generate_default_parameters(type_, new_path)
     resolution_model = generate_resolution(type_, config["trainingset_patchsize"])
 
+    # The stitching settings not given are the ones recommended for the model by the stitching benchmark
+    stitching_mode, overlap_value = read_stitching_defaults(path_model)
+    if args["stitching"] is not None:
+        stitching_mode = args["stitching"]
+    if args["overlap"] is not None:
+        overlap_value = int(args["overlap"])
+
     # Tuple of valid file extensions
     validExtensions = (
                         ".jpeg",
@@ -313,6 +983,64 @@ def main(argv=None):
                         ".png"
                         )
 
+    # The pixel sizes of the images are found (when not given with -s) by a resolver shared by all the paths, so each
+    # pixel size file is read once.
+    try:
+        pixel_size_resolver = PixelSizeResolver(args["pixel_size_map"])
+    except (IOError, OSError) as e:
+        print("ERROR: The pixel size map cannot be read: {0}".format(e))
+        sys.exit(3)
+    except (ValueError, KeyError) as e:
+        print("ERROR: Invalid pixel size map: {0}".format(e))
+        sys.exit(2)
+
+    # The model and the resampling cache are created the first time they are needed, and then shared by all the paths
+    # passed into arguments
+    segmenter = None
+    cache = None
+    # Numbers of patches segmented and skipped as background by the segmenters that are already closed (the ones of
+    # the worker processes and of the lists of images)
+    patch_counts = collections.Counter()
+
+    if path_image_list is not None:
+        try:
+            image_list = read_image_list(path_image_list)
+        except (IOError, OSError) as e:
+            print("ERROR: The list of images cannot be read: {0}".format(e))
+            sys.exit(3)
+        except (ValueError, KeyError) as e:
+            print("ERROR: Invalid list of images: {0}".format(e))
+            sys.exit(2)
+
+        # The pixel size given on the CLI is used for the images listed without pixel size, or else the resolver
+        image_list = [(path_image, psm if pixel_size is None else pixel_size) for path_image, pixel_size in image_list]
+
+        if args["shard_logs"] is not None:
+            path_log_folder = Path(args["shard_logs"])
+        else:
+            path_log_folder = path_image_list.parent / (path_image_list.stem + '_shard_logs')
+
+        n_segmented, n_failed = segment_image_list(image_list, path_model, overlap_value, config, resolution_model,
+                                                   path_log_folder, shard=shard,
+                                                   verbosity_level=verbosity_level,
+                                                   inference_batch_size=inference_batch_size,
+                                                   n_threads=n_threads,
+                                                   tile_size=tile_size,
+                                                   stitching_mode=stitching_mode,
+                                                   skip_threshold=skip_threshold,
+                                                   resampling_backend=resampling_backend,
+                                                   use_cache=use_cache,
+                                                   force=force,
+                                                   pixel_size_resolver=pixel_size_resolver,
+                                                   compress_level=compress_level,
+                                                   inference_backend=inference_backend,
+                                                   intra_op_threads=intra_op_threads,
+                                                   cache=ResamplingCache() if use_cache else None,
+                                                   patch_counts=patch_counts)
+
+        print("Shard {0}/{1}: {2} image(s) segmented, {3} image(s) failed. Completion log: {4}".format(
+            shard[0], shard[1], n_segmented, n_failed, shard_log_path(path_log_folder, *shard)))
+
     # Going through all paths passed into arguments
     for current_path_target in path_target_list:
 
@@ -320,18 +1048,14 @@ def main(argv=None):
 
             if current_path_target.suffix.lower() in validExtensions:
 
-                # Handle cases if no resolution is provided on the CLI
-                if psm == None:
-
-                    # Check if a pixel size file exists, if so read it.
-                    if (current_path_target.parent / 'pixel_size_in_micrometer.txt').exists():
+                # Handle cases if no resolution is provided on the CLI: the pixel size of the image is found in the
+                # pixel size map, its sidecar file, its TIFF tags or the pixel size file of its folder.
+                acquired_resolution = psm
+                if acquired_resolution == None:
 
-                        resolution_file = open(current_path_target.parent / 'pixel_size_in_micrometer.txt', 'r')
+                    acquired_resolution = pixel_size_resolver.resolve(current_path_target)
 
-                        psm = float(resolution_file.read())
-
-
-                    else:
+                    if acquired_resolution == None:
 
                         print("ERROR: No pixel size is provided, and there is no pixel_size_in_micrometer.txt file in image folder. ",
                                       "Please provide a pixel size (using argument -s), or add a pixel_size_in_micrometer.txt file ",
@@ -341,31 +1065,37 @@ def main(argv=None):
 
                 # Check that image size is large enough for given resolution to reach minimum patch size after resizing.
 
-                try:
-                    height, width, _ = ads.imread(str(current_path_target)).shape
-                except:
-                    try:
-                        height, width = ads.imread(str(current_path_target)).shape
-                    except Exception as e:
-                        raise e
+                # Only the header is read: the image is decoded once, when it is segmented
+                height, width = ads.imread_shape(current_path_target)
 
                 image_size = [height, width]
                 minimum_resolution = config["trainingset_patchsize"] * resolution_model / min(image_size)
 
-                if psm < minimum_resolution:
-                    print("EXCEPTION: The size of one of the images ({0}x{1}) is too small for the provided pixel size ({2}).\n".format(height, width, psm),
+                if acquired_resolution < minimum_resolution:
+                    print("EXCEPTION: The size of one of the images ({0}x{1}) is too small for the provided pixel size ({2}).\n".format(height, width, acquired_resolution),
                           "The image size must be at least {0}x{0} after resampling to a resolution of {1} to create standard sized patches.\n".format(config["trainingset_patchsize"], resolution_model),
-                          "One of the dimensions of the image has a size of {0} after resampling to that resolution.\n".format(round(psm * min(image_size) / resolution_model)),
+                          "One of the dimensions of the image has a size of {0} after resampling to that resolution.\n".format(round(acquired_resolution * min(image_size) / resolution_model)),
                           "Image file location: {0}".format(current_path_target)
                     )
 
                     sys.exit(2)
 
+                if segmenter is None:
+                    segmenter = Segmenter(path_model, config, ckpt_name='model', verbosity_level=verbosity_level,
+                                          intra_op_threads=intra_op_threads, inference_backend=inference_backend)
+
                 # Performing the segmentation over the image
                 segment_image(current_path_target, path_model, overlap_value, config,
                             resolution_model,
-                            acquired_resolution=psm,
-                            verbosity_level=verbosity_level)
+                            acquired_resolution=acquired_resolution,
+                            verbosity_level=verbosity_level,
+                            inference_batch_size=inference_batch_size,
+                            tile_size=tile_size,
+                            segmenter=segmenter,
+                            stitching_mode=stitching_mode,
+                            skip_threshold=skip_threshold,
+                            resampling_backend=resampling_backend,
+                            compress_level=compress_level)
 
                 print("Segmentation finished.")
 
@@ -375,32 +1105,47 @@ def main(argv=None):
 
         else:
 
-            # Handle cases if no resolution is provided on the CLI
-            if psm == None:
+            # If no resolution is provided on the CLI, the pixel size of each image of the folder is found by the
+            # resolver (segment_folders exits if one of them has none).
 
-                # Check if a pixel size file exists, if so read it.
-                if (current_path_target / 'pixel_size_in_micrometer.txt').exists():
-
-                    resolution_file = open(current_path_target / 'pixel_size_in_micrometer.txt', 'r')
-
-                    psm = float(resolution_file.read())
-
-                else:
-
-                    print("ERROR: No pixel size is provided, and there is no pixel_size_in_micrometer.txt file in image folder. ",
-                                  "Please provide a pixel size (using argument -s), or add a pixel_size_in_micrometer.txt file ",
-                                  "containing the pixel size value."
-                    )
-                    sys.exit(3)
+            # The resampling cache is shared by all the folders segmented
+            if use_cache and (cache is None):
+                cache = ResamplingCache()
 
             # Performing the segmentation over all folders in the specified folder containing acquisitions to segment.
-            segment_folders(current_path_target, path_model, overlap_value, config,
+            # The model is loaded by segment_folders once it knows that some images need to be segmented (with several
+            # jobs, each process loads its own copy of the model), and is kept for the next paths.
+            segmenter = segment_folders(current_path_target, path_model, overlap_value, config,
                         resolution_model,
                             acquired_resolution=psm,
-                            verbosity_level=verbosity_level)
+                            verbosity_level=verbosity_level,
+                            inference_batch_size=inference_batch_size,
+                            n_threads=n_threads,
+                            tile_size=tile_size,
+                            segmenter=segmenter,
+                            stitching_mode=stitching_mode,
+                            skip_threshold=skip_threshold,
+                            resampling_backend=resampling_backend,
+                            use_cache=use_cache,
+                            force=force,
+                            n_jobs=n_jobs,
+                            pixel_size_resolver=pixel_size_resolver,
+                            compress_level=compress_level,
+                            inference_backend=inference_backend,
+                            intra_op_threads=intra_op_threads,
+                            cache=cache,
+                            keep_segmenter=True,
+                            patch_counts=patch_counts)
 
             print("Segmentation finished.")
 
+    if segmenter is not None:
+        add_patch_counts(patch_counts, segmenter)
+        segmenter.close()
+
+    if (skip_threshold is not None) and patch_counts['n_patches']:
+        print(skipped_patches_summary(patch_counts['n_skipped_patches'], patch_counts['n_patches']))
+
     sys.exit(0)
 
 # Calling the script
@@ -0,0 +1,259 @@
+# Segmentation of large datasets split between several nodes: each node segments a deterministic share (shard) of a
+# list of images and logs the images it completes, and the logs of all the shards are merged into a run report.
+
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+
+from AxonDeepSeg.ads_utils import convert_path
+
+# Names accepted for the columns (CSV) or keys (JSON lines) of the image list
+image_keys = ('image', 'path')
+pixel_size_keys = ('pixel_size', 'pixel_size_in_micrometer')
+
+shard_log_pattern = 'shard-{0:05d}-of-{1:05d}.jsonl'
+
+
+def read_image_list(path_image_list):
+    '''
+    Reads a list of images to segment with their pixel size, either a CSV file with a header (columns image and
+    pixel_size) or a JSON lines file (one object per line, with the keys image and pixel_size). Relative image paths
+    are relative to the folder of the list. The pixel size can be left empty, in which case it is None.
+    :param path_image_list: Path of the list, .csv, .jsonl or .json.
+    :return: list of tuples (path of the image, pixel size in micrometers or None), in the order of the file. The
+    paths are absolute and resolved, so that an image is logged under the same path whatever the path of the list.
+    '''
+
+    path_image_list = convert_path(path_image_list)
+
+    with open(str(path_image_list), 'r', newline='') as f:
+        if path_image_list.suffix.lower() == '.csv':
+            rows = list(csv.DictReader(f))
+        elif path_image_list.suffix.lower() in ('.jsonl', '.json'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            raise ValueError("Unknown image list format: {0}. Expected a .csv or .jsonl file.".format(path_image_list))
+
+    entries = []
+    for line, row in enumerate(rows, 1):
+        image = next((row[key] for key in image_keys if row.get(key)), None)
+        if image is None:
+            raise ValueError("Line {0} of {1} has no image path.".format(line, path_image_list))
+
+        pixel_size = next((row[key] for key in pixel_size_keys if row.get(key) not in (None, '')), None)
+
+        path_image = Path(image)
+        if not path_image.is_absolute():
+            path_image = path_image_list.parent / path_image
+
+        entries.append((path_image.resolve(), None if pixel_size is None else float(pixel_size)))
+
+    return entries
+
+
+def parse_shard(shard):
+    '''
+    Parses a shard specification.
+    :param shard: String 'i/N', the shard i (counted from 0) of N shards.
+    :return: tuple (i, N).
+    '''
+
+    try:
+        index, count = (int(e) for e in shard.split('/'))
+    except (ValueError, AttributeError):
+        raise ValueError("Invalid shard: {0}. Expected i/N, for instance 0/4.".format(shard))
+
+    if not 0 <= index < count:
+        raise ValueError("Invalid shard: {0}. The shard index must be between 0 and {1}.".format(shard, count - 1))
+
+    return index, count
+
+
+def select_shard(entries, index, count):
+    '''
+    Selects the share of a list of images segmented by a shard. The images are dealt to the shards in turn, so each
+    shard gets the same images on every node and on every run, and the shards have the same size within one image.
+    :param entries: list of the images.
+    :param index: Int, index of the shard.
+    :param count: Int, number of shards.
+    :return: list of the images of the shard.
+    '''
+
+    return entries[index::count]
+
+
+def shard_log_path(path_log_folder, index, count):
+    '''
+    :param path_log_folder: Path of the folder of the shard logs.
+    :param index: Int, index of the shard.
+    :param count: Int, number of shards.
+    :return: the path of the completion log of the shard.
+    '''
+
+    return convert_path(path_log_folder) / shard_log_pattern.format(index, count)
+
+
+def read_shard_log(path_log):
+    '''
+    Reads a completion log. A line cut by an interrupted run is ignored.
+    :param path_log: Path of the log.
+    :return: list of the records of the log, in the order they were written.
+    '''
+
+    records = []
+
+    with open(str(path_log), 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+
+    return records
+
+
+class ShardLog(object):
+    """
+    Completion log of a shard: a JSON lines file where each image segmented (or failed) is appended as soon as it is
+    done, so that the log of an interrupted shard is up to date and the shard can be resumed.
+    """
+
+    def __init__(self, path_log, index, count):
+        """
+        :param path_log: Path of the log. Created if needed, appended to if it exists.
+        :param index: Int, index of the shard.
+        :param count: Int, number of shards.
+        """
+
+        self.path_log = convert_path(path_log)
+        self.path_log.parent.mkdir(parents=True, exist_ok=True)
+        self.index = index
+        self.count = count
+        self._lock = threading.Lock()
+
+    def completed_images(self):
+        """
+        :return: set of the paths (as strings) of the images already segmented according to the log.
+        """
+
+        if not self.path_log.exists():
+            return set()
+
+        status = {}
+        for record in read_shard_log(self.path_log):
+            status[record['image']] = record['status']
+
+        return {image for image, image_status in status.items() if image_status == 'segmented'}
+
+    def write(self, path_image, status, **fields):
+        """
+        Appends the record of an image to the log.
+        :param path_image: Path of the image.
+        :param status: String, 'segmented' or 'failed'.
+        :param fields: other fields of the record (path of the segmentation, error message, ...).
+        :return: Nothing.
+        """
+
+        record = {'image': str(path_image), 'status': status, 'shard': self.index, 'n_shards': self.count,
+                  'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        record.update(fields)
+
+        with self._lock, open(str(self.path_log), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+
+
+def merge_shard_logs(path_log_folder, path_image_list=None):
+    '''
+    Merges the completion logs of the shards of a run into a report. For each image, the last record is kept.
+    :param path_log_folder: Path of the folder of the shard logs.
+    :param path_image_list: Path of the list of images of the run. If given, the images of the list that are in no
+    log are reported as missing.
+    :return: dict, the report of the run.
+    '''
+
+    path_log_folder = convert_path(path_log_folder)
+
+    records = {}
+    shards = set()
+    n_shards = set()
+
+    for path_log in sorted(path_log_folder.glob('shard-*-of-*.jsonl')):
+        _, index, _, count = path_log.stem.split('-')
+        shards.add(int(index))
+        n_shards.add(int(count))
+
+        for record in read_shard_log(path_log):
+            records[record['image']] = record
+
+    if len(n_shards) > 1:
+        raise ValueError("The logs of {0} come from runs with different numbers of shards: {1}.".format(
+            path_log_folder, sorted(n_shards)))
+
+    count = n_shards.pop() if n_shards else 0
+    segmented = sorted(image for image, record in records.items() if record['status'] == 'segmented')
+    failed = [{'image': image, 'error': record.get('error')}
+              for image, record in sorted(records.items()) if record['status'] != 'segmented']
+
+    report = {
+        'n_shards': count,
+        'missing_shards': [index for index in range(count) if index not in shards],
+        'n_segmented': len(segmented),
+        'n_failed': len(failed),
+        'failed': failed
+    }
+
+    if path_image_list is not None:
+        images = [str(path_image) for path_image, _ in read_image_list(path_image_list)]
+        report['n_images'] = len(images)
+        report['missing_images'] = [image for image in images if image not in records]
+
+    return report
+
+
+def main(argv=None):
+    '''
+    Merges the completion logs of the shards of a run into a single report.
+    :return: Exit code.
+        0: Success
+        2: Invalid argument value
+        3: Missing value or file
+    '''
+
+    ap = argparse.ArgumentParser(description='Merges the completion logs of the shards of a segmentation run.')
+    ap.add_argument('logs', help='Folder of the shard logs.')
+    ap.add_argument('--manifest', required=False, default=None,
+                    help='List of images of the run (.csv or .jsonl). If given, the images that no shard '
+                         'completed are listed in the report.')
+    ap.add_argument('-o', '--output', required=False, default=None,
+                    help='Path of the JSON report. Default: run_report.json in the folder of the logs.')
+
+    args = vars(ap.parse_args(argv))
+    path_log_folder = Path(args['logs'])
+
+    if not path_log_folder.is_dir():
+        print("ERROR: The folder of the shard logs does not exist: {0}".format(path_log_folder))
+        sys.exit(3)
+
+    try:
+        report = merge_shard_logs(path_log_folder, args['manifest'])
+    except ValueError as e:
+        print("ERROR: {0}".format(e))
+        sys.exit(2)
+
+    path_report = Path(args['output']) if args['output'] else path_log_folder / 'run_report.json'
+    with open(str(path_report), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print("{0} image(s) segmented, {1} failed.".format(report['n_segmented'], report['n_failed']))
+    if report['missing_shards']:
+        print("Missing shard(s): {0}".format(report['missing_shards']))
+    if report.get('missing_images'):
+        print("{0} image(s) of the manifest were not processed.".format(len(report['missing_images'])))
+    print("Report written to {0}".format(path_report))
+
+    sys.exit(0)
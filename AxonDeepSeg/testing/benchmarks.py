@@ -0,0 +1,458 @@
+# Benchmarks of the segmentation pipeline.
+# Each benchmark prints its results as a table and returns them as a list of rows.
+#
+# Usage example:
+#   python -m AxonDeepSeg.testing.benchmarks batch_size -t SEM --batch-sizes 1 2 4 8 16
+#   python -m AxonDeepSeg.testing.benchmarks stitching_mode -t SEM --save
+#   python -m AxonDeepSeg.testing.benchmarks backends -t TEM --backends keras tensorflow onnxruntime
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+from prettytable import PrettyTable
+
+import AxonDeepSeg.ads_utils as ads
+from AxonDeepSeg.ads_utils import convert_path
+
+
+def benchmark_batch_size(path_model, config, batch_sizes=(1, 2, 4, 8, 16), n_patches=64, n_repeats=3,
+                         verbosity_level=0):
+    """
+    Measures the inference throughput of a model for several batch sizes.
+    :param path_model: Path to the model folder.
+    :param config: Dict containing the configuration of the network.
+    :param batch_sizes: List of batch sizes (ints) to benchmark.
+    :param n_patches: Int, number of patches segmented for each measure.
+    :param n_repeats: Int, number of measures for each batch size. The fastest one is kept.
+    :param verbosity_level: Int, how much information to display.
+    :return: List of [batch_size, seconds, patches_per_second] rows.
+    """
+    from AxonDeepSeg.apply_model import Segmenter
+
+    # If string, convert to Path objects
+    path_model = convert_path(path_model)
+
+    results = []
+
+    with Segmenter(path_model, config, verbosity_level=verbosity_level) as segmenter:
+
+        patch_size = segmenter.patch_size
+        rng = np.random.RandomState(0)
+        patches = list(rng.randint(0, 256, size=(n_patches, patch_size, patch_size)).astype(np.uint8))
+
+        for batch_size in batch_sizes:
+
+            # Warm-up run, so that the graph of the current batch shape is not timed.
+            segmenter.predict_patches(patches[:batch_size], inference_batch_size=batch_size)
+
+            timings = []
+            for _ in range(n_repeats):
+                start = time.perf_counter()
+                segmenter.predict_patches(patches, inference_batch_size=batch_size)
+                timings.append(time.perf_counter() - start)
+
+            best = min(timings)
+            results.append([batch_size, round(best, 3), round(n_patches / best, 2)])
+
+    t = PrettyTable(["Batch size", "Time (s)", "Patches/s"])
+    for row in results:
+        t.add_row(row)
+    print(t)
+
+    return results
+
+
+def benchmark_inference_backends(path_model, config, backends=('keras', 'tensorflow', 'onnxruntime'), batch_size=8,
+                                 n_patches=64, n_repeats=3, intra_op_threads=0, verbosity_level=0):
+    """
+    Measures the inference throughput of a model with several inference backends. The frozen graph and the ONNX model
+    must have been exported beforehand (see AxonDeepSeg.model_export).
+    :param path_model: Path to the model folder.
+    :param config: Dict containing the configuration of the network.
+    :param backends: List of inference backends to benchmark (see AxonDeepSeg.inference_backends).
+    :param batch_size: Int, batch size to use when doing inference.
+    :param n_patches: Int, number of patches segmented for each measure.
+    :param n_repeats: Int, number of measures for each backend. The fastest one is kept.
+    :param intra_op_threads: Int, number of threads used inside an operation (0: chosen by the backend).
+    :param verbosity_level: Int, how much information to display.
+    :return: List of [backend, seconds, patches_per_second, speedup] rows, the speedup being relative to the first
+    backend.
+    """
+    from AxonDeepSeg.apply_model import Segmenter
+
+    # If string, convert to Path objects
+    path_model = convert_path(path_model)
+
+    results = []
+
+    for backend in backends:
+        with Segmenter(path_model, config, verbosity_level=verbosity_level, intra_op_threads=intra_op_threads,
+                       inference_backend=backend) as segmenter:
+
+            patch_size = segmenter.patch_size
+            rng = np.random.RandomState(0)
+            patches = list(rng.randint(0, 256, size=(n_patches, patch_size, patch_size)).astype(np.uint8))
+
+            # Warm-up run, so that the initialization of the backend is not timed.
+            segmenter.predict_patches(patches[:batch_size], inference_batch_size=batch_size)
+
+            timings = []
+            for _ in range(n_repeats):
+                start = time.perf_counter()
+                segmenter.predict_patches(patches, inference_batch_size=batch_size)
+                timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        speedup = results[0][1] / best if results else 1.0
+        results.append([backend, round(best, 3), round(n_patches / best, 2), round(speedup, 2)])
+
+    t = PrettyTable(["Backend", "Time (s)", "Patches/s", "Speedup"])
+    for row in results:
+        t.add_row(row)
+    print(t)
+
+    return results
+
+
+def patches2im_overlap_legacy(L_patches, L_pos, overlap_value=25, scw=512):
+
+    '''
+    Previous implementation of patch_management_tools.patches2im_overlap, kept as the reference of the stitching
+    benchmark. Stitches patches together to form an image.
+    :param L_patches: List of segmented patches.
+    :param L_pos: List of positions of the patches in the image to form.
+    :param overlap_value: Int, number of pixels to overlap.
+    :param scw: Int, patch size.
+    :return: Stitched segmented image.
+    '''
+
+    spw = scw - 2 * overlap_value
+    # L_pred = [e[cropped_value:-cropped_value,cropped_value:-cropped_value] for e in L_patches]
+    # First : extraction of the predictions
+    h_l, w_l = np.max(np.stack(L_pos), axis=0)
+    L_pred = []
+    new_img = np.zeros((h_l + scw, w_l + scw))
+
+    for i, e in enumerate(L_patches):
+        if L_pos[i][0] == 0:
+            if L_pos[i][1] == 0:
+                new_img[0:overlap_value, 0:overlap_value] = e[0:overlap_value, 0:overlap_value]
+                new_img[overlap_value:scw - overlap_value, 0:overlap_value] = e[overlap_value:-overlap_value,
+                                                                              0:overlap_value]
+                new_img[0:overlap_value, overlap_value:scw - overlap_value] = e[0:overlap_value,
+                                                                              overlap_value:-overlap_value]
+            else:
+                if L_pos[i][1] == w_l:
+                    new_img[0:overlap_value, -overlap_value:] = e[0:overlap_value, -overlap_value:]
+                new_img[0:overlap_value, L_pos[i][1] + overlap_value:L_pos[i][1] + scw - overlap_value] = e[
+                                                                                                          0:overlap_value,
+                                                                                                          overlap_value:-overlap_value]
+
+        if L_pos[i][1] == 0:
+            if L_pos[i][0] != 0:
+                new_img[L_pos[i][0] + overlap_value:L_pos[i][0] + scw - overlap_value, 0:overlap_value] = e[
+                                                                                                          overlap_value:-overlap_value,
+                                                                                                          0:overlap_value]
+
+        if L_pos[i][0] == h_l:
+            if L_pos[i][1] == w_l:
+                new_img[-overlap_value:, -overlap_value:] = e[-overlap_value:, -overlap_value:]
+                new_img[h_l + overlap_value:-overlap_value, -overlap_value:] = e[overlap_value:-overlap_value,
+                                                                               -overlap_value:]
+                new_img[-overlap_value:, w_l + overlap_value:-overlap_value] = e[-overlap_value:,
+                                                                               overlap_value:-overlap_value]
+            else:
+                if L_pos[i][1] == 0:
+                    new_img[-overlap_value:, 0:overlap_value] = e[-overlap_value:, 0:overlap_value]
+
+                new_img[-overlap_value:, L_pos[i][1] + overlap_value:L_pos[i][1] + scw - overlap_value] = e[
+                                                                                                          -overlap_value:,
+                                                                                                          overlap_value:-overlap_value]
+        if L_pos[i][1] == w_l:
+            if L_pos[i][1] != h_l:
+                new_img[L_pos[i][0] + overlap_value:L_pos[i][0] + scw - overlap_value, -overlap_value:] = e[
+                                                                                                          overlap_value:-overlap_value,
+                                                                                                          -overlap_value:]
+
+    L_pred = [e[overlap_value:-overlap_value, overlap_value:-overlap_value] for e in L_patches]
+    L_pos_corr = [[e[0] + overlap_value, e[1] + overlap_value] for e in L_pos]
+    for i, e in enumerate(L_pos_corr):
+        new_img[e[0]:e[0] + spw, e[1]:e[1] + spw] = L_pred[i]
+
+    return new_img
+
+
+def benchmark_stitching(image_size=10000, patch_sizes=(512, 1024), overlap_value=25, n_repeats=3):
+    """
+    Compares the stitching of the segmented patches of an image with the previous implementation of
+    patches2im_overlap.
+    :param image_size: Int, height and width of the stitched image.
+    :param patch_sizes: List of patch sizes (ints) to benchmark.
+    :param overlap_value: Int, number of pixels to overlap.
+    :param n_repeats: Int, number of measures for each implementation. The fastest one is kept.
+    :return: List of [patch_size, number of patches, legacy seconds, seconds, speedup] rows.
+    """
+    from AxonDeepSeg.patch_management_tools import im2patches_overlap, patches2im_overlap
+
+    rng = np.random.RandomState(0)
+    image = rng.randint(0, 3, size=(image_size, image_size)).astype(np.uint8)
+
+    results = []
+
+    for patch_size in patch_sizes:
+        _, patches, positions = im2patches_overlap(image, overlap_value, patch_size)
+        out = np.empty(image.shape, dtype=np.uint8)
+
+        legacy_timings, timings = [], []
+        for _ in range(n_repeats):
+            start = time.perf_counter()
+            patches2im_overlap_legacy(patches, positions, overlap_value, patch_size)
+            legacy_timings.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            patches2im_overlap(patches, positions, overlap_value, patch_size, out=out)
+            timings.append(time.perf_counter() - start)
+
+        results.append([patch_size, len(patches), round(min(legacy_timings), 4), round(min(timings), 4),
+                        round(min(legacy_timings) / min(timings), 1)])
+
+    t = PrettyTable(["Patch size", "Patches", "Legacy (s)", "Current (s)", "Speedup"])
+    for row in results:
+        t.add_row(row)
+    print(t)
+
+    return results
+
+
+def benchmark_stitching_mode(path_model, config, path_image, path_mask, acquired_resolution, resolution_model,
+                             overlap_values=(5, 10, 25, 50), stitching_modes=('crop', 'blend'), inference_batch_size=1,
+                             verbosity_level=0):
+    """
+    Measures the quality of the segmentation (Dice of the axons and of the myelin against a ground truth mask) and the
+    segmentation time for each stitching mode and overlap value.
+    :param path_model: Path to the model folder.
+    :param config: Dict containing the configuration of the network.
+    :param path_image: Path to the image to segment.
+    :param path_mask: Path to the ground truth mask of the image (myelin=127, axon=255).
+    :param acquired_resolution: Float, the pixel size of the image, in micrometers.
+    :param resolution_model: Float, the resolution the model was trained on.
+    :param overlap_values: List of overlap values (ints) to benchmark.
+    :param stitching_modes: List of stitching modes to benchmark.
+    :param inference_batch_size: Int, batch size to use when doing inference.
+    :param verbosity_level: Int, how much information to display.
+    :return: List of [stitching_mode, overlap_value, seconds, axon dice, myelin dice] rows.
+    """
+    from AxonDeepSeg.apply_model import Segmenter, paint_segmentation
+    from AxonDeepSeg.testing.segmentation_scoring import pw_dice
+
+    # If string, convert to Path objects
+    path_model, path_image, path_mask = convert_path([path_model, path_image, path_mask])
+
+    mask = ads.imread(path_mask)
+    gt_axon = mask > 200
+    gt_myelin = np.logical_and(mask >= 50, mask <= 200)
+
+    results = []
+
+    with Segmenter(path_model, config, verbosity_level=verbosity_level) as segmenter:
+
+        image = ads.imread(path_image)
+
+        # Warm-up run, so that the building of the graph is not timed.
+        segmenter.segment([image], [acquired_resolution], inference_batch_size=inference_batch_size,
+                          resampled_resolutions=[resolution_model])
+
+        for stitching_mode in stitching_modes:
+            for overlap_value in overlap_values:
+                start = time.perf_counter()
+                prediction, = segmenter.segment([image], [acquired_resolution],
+                                                inference_batch_size=inference_batch_size,
+                                                overlap_value=overlap_value,
+                                                resampled_resolutions=[resolution_model],
+                                                stitching_mode=stitching_mode)
+                seconds = time.perf_counter() - start
+
+                pred = paint_segmentation(prediction, segmenter.n_classes)
+                dice_axon = pw_dice(pred > 200, gt_axon)
+                dice_myelin = pw_dice(np.logical_and(pred >= 50, pred <= 200), gt_myelin)
+
+                results.append([stitching_mode, overlap_value, round(seconds, 3), round(dice_axon, 4),
+                                round(dice_myelin, 4)])
+
+    t = PrettyTable(["Stitching", "Overlap", "Time (s)", "Axon Dice", "Myelin Dice"])
+    for row in results:
+        t.add_row(row)
+    print(t)
+
+    return results
+
+
+def recommend_stitching(results, max_dice_loss=0.005):
+    """
+    Chooses the fastest stitching setting whose Dice is close to the best one, from the results of
+    benchmark_stitching_mode.
+    :param results: List of [stitching_mode, overlap_value, seconds, axon dice, myelin dice] rows.
+    :param max_dice_loss: Float, the largest loss of axon Dice and of myelin Dice accepted against the best ones.
+    :return: The row of the setting.
+    """
+
+    best_axon = max(row[3] for row in results)
+    best_myelin = max(row[4] for row in results)
+
+    candidates = [row for row in results
+                  if row[3] >= best_axon - max_dice_loss and row[4] >= best_myelin - max_dice_loss]
+
+    return min(candidates, key=lambda row: row[2])
+
+
+def write_stitching_defaults(path_model, results, max_dice_loss=0.005):
+    """
+    Saves the stitching setting recommended by benchmark_stitching_mode in the model folder, where the command line
+    reads its default stitching mode and overlap (see AxonDeepSeg.segment.read_stitching_defaults). The results of the
+    benchmark are saved with it.
+    :param path_model: Path to the model folder.
+    :param results: List of [stitching_mode, overlap_value, seconds, axon dice, myelin dice] rows.
+    :param max_dice_loss: Float, the largest loss of Dice accepted against the best one (see recommend_stitching).
+    :return: The row of the recommended setting.
+    """
+    from AxonDeepSeg.segment import stitching_defaults_name
+
+    row = recommend_stitching(results, max_dice_loss)
+
+    defaults = {
+        'stitching_mode': row[0],
+        'overlap_value': int(row[1]),
+        'max_dice_loss': max_dice_loss,
+        'benchmark': [dict(zip(['stitching_mode', 'overlap_value', 'seconds', 'axon_dice', 'myelin_dice'], r))
+                      for r in results]
+    }
+
+    with open(str(convert_path(path_model) / stitching_defaults_name), 'w') as f:
+        json.dump(defaults, f, indent=2)
+
+    return row
+
+
+def main(argv=None):
+    """
+    Main loop.
+    :return: Exit code.
+        0: Success
+        3: The recommended stitching setting cannot be saved in the model folder
+    """
+    ap = argparse.ArgumentParser()
+    subparsers = ap.add_subparsers(dest='benchmark')
+
+    ap_batch = subparsers.add_parser('batch_size', help='Patches per second against the inference batch size.')
+    ap_batch.add_argument('-t', '--type', choices=['SEM', 'TEM', 'OM'], default='SEM', help='Type of model.')
+    ap_batch.add_argument('-m', '--model', required=False, help='Folder where the model is located.')
+    ap_batch.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                          help='Batch sizes to benchmark.')
+    ap_batch.add_argument('--n-patches', type=int, default=64, help='Number of patches segmented per measure.')
+    ap_batch.add_argument('--gpu', action='store_true', help='Run on the GPU. The benchmark uses the CPU by default.')
+
+    ap_backends = subparsers.add_parser('backends', help='Patches per second of each inference backend.')
+    ap_backends.add_argument('-t', '--type', choices=['SEM', 'TEM', 'OM'], default='SEM', help='Type of model.')
+    ap_backends.add_argument('-m', '--model', required=False, help='Folder where the model is located.')
+    ap_backends.add_argument('--backends', nargs='+', default=['keras', 'tensorflow', 'onnxruntime'],
+                             help='Inference backends to benchmark.')
+    ap_backends.add_argument('--batch-size', type=int, default=8, help='Inference batch size.')
+    ap_backends.add_argument('--n-patches', type=int, default=64, help='Number of patches segmented per measure.')
+    ap_backends.add_argument('--intra-op-threads', type=int, default=0,
+                             help='Number of threads used inside an operation. Default: chosen by the backend.')
+
+    ap_stitching = subparsers.add_parser('stitching', help='Stitching time of the segmented patches of an image.')
+    ap_stitching.add_argument('--image-size', type=int, default=10000, help='Height and width of the image.')
+    ap_stitching.add_argument('--patch-sizes', type=int, nargs='+', default=[512, 1024], help='Patch sizes.')
+    ap_stitching.add_argument('--overlap', type=int, default=25, help='Overlap value, in pixels.')
+
+    ap_stitching_mode = subparsers.add_parser('stitching_mode', help='Dice and segmentation time against the overlap, '
+                                                                     'for each stitching mode.')
+    ap_stitching_mode.add_argument('-t', '--type', choices=['SEM', 'TEM', 'OM'], default='SEM', help='Type of model.')
+    ap_stitching_mode.add_argument('-m', '--model', required=False, help='Folder where the model is located.')
+    ap_stitching_mode.add_argument('-i', '--imgpath', required=False,
+                                   help='Image to segment. Default: the image of the data_test folder of the model.')
+    ap_stitching_mode.add_argument('--mask', required=False,
+                                   help='Ground truth mask. Default: mask.png, next to the image.')
+    ap_stitching_mode.add_argument('-s', '--sizepixel', type=float, required=False,
+                                   help='Pixel size of the image, in micrometers. Default: read from the '
+                                        'pixel_size_in_micrometer.txt file next to the image.')
+    ap_stitching_mode.add_argument('--overlaps', type=int, nargs='+', default=[5, 10, 25, 50],
+                                   help='Overlap values to benchmark.')
+    ap_stitching_mode.add_argument('--batch-size', type=int, default=1, help='Inference batch size.')
+    ap_stitching_mode.add_argument('--max-dice-loss', type=float, default=0.005,
+                                   help='Largest loss of Dice, against the best setting, accepted for the recommended '
+                                        'setting (the fastest one).')
+    ap_stitching_mode.add_argument('--save', action='store_true',
+                                   help='Save the recommended setting in the model folder, as the default stitching '
+                                        'mode and overlap of axondeepseg for this model.')
+
+    args = ap.parse_args(argv)
+
+    if args.benchmark == 'batch_size':
+        from AxonDeepSeg.segment import generate_default_parameters
+
+        if not args.gpu:
+            # Hide the GPUs from Tensorflow, the session is created after this point.
+            os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+        path_model, config = generate_default_parameters(args.type, args.model)
+        benchmark_batch_size(path_model, config, batch_sizes=args.batch_sizes, n_patches=args.n_patches)
+
+    elif args.benchmark == 'backends':
+        from AxonDeepSeg.segment import generate_default_parameters
+
+        # The backends are compared on the CPU.
+        os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+        path_model, config = generate_default_parameters(args.type, args.model)
+        benchmark_inference_backends(path_model, config, backends=args.backends, batch_size=args.batch_size,
+                                     n_patches=args.n_patches, intra_op_threads=args.intra_op_threads)
+
+    elif args.benchmark == 'stitching_mode':
+        from AxonDeepSeg.segment import generate_default_parameters, generate_resolution
+
+        path_model, config = generate_default_parameters(args.type, args.model)
+        resolution_model = generate_resolution(args.type, config["trainingset_patchsize"])
+
+        path_image = convert_path(args.imgpath) if args.imgpath else path_model / 'data_test' / 'image.png'
+        path_mask = convert_path(args.mask) if args.mask else path_image.parent / 'mask.png'
+
+        if args.sizepixel is not None:
+            acquired_resolution = args.sizepixel
+        else:
+            with open(path_image.parent / 'pixel_size_in_micrometer.txt', 'r') as resolution_file:
+                acquired_resolution = float(resolution_file.read())
+
+        results = benchmark_stitching_mode(path_model, config, path_image, path_mask, acquired_resolution,
+                                           resolution_model, overlap_values=args.overlaps,
+                                           inference_batch_size=args.batch_size)
+
+        row = recommend_stitching(results, args.max_dice_loss)
+        print("Recommended setting: stitching {0}, overlap {1}.".format(row[0], row[1]))
+
+        if args.save:
+            # The model folder may be the one of the installed package, which is often read-only
+            try:
+                write_stitching_defaults(path_model, results, args.max_dice_loss)
+            except (IOError, OSError) as e:
+                print("ERROR: The recommended setting cannot be saved in the model folder {0}: {1}\n".format(
+                    path_model, e), "Copy the model to a writable folder and pass it with -m to save the setting.")
+                sys.exit(3)
+
+    elif args.benchmark == 'stitching':
+        benchmark_stitching(image_size=args.image_size, patch_sizes=args.patch_sizes, overlap_value=args.overlap)
+
+    else:
+        ap.print_help()
+
+    sys.exit(0)
+
+
+# Calling the script
+if __name__ == '__main__':
+    main()
@@ -4,16 +4,11 @@ import sys
 
 # Scientific modules imports
 import numpy as np
-import pandas as pd
 from skimage import measure
 from skimage.measure import regionprops
 from skimage.morphology import binary_erosion, disk, label
 from scipy.spatial.distance import directed_hausdorff
 
-# Graphs and plots imports
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-
 # AxonDeepSeg imports
 import AxonDeepSeg.ads_utils
 
@@ -32,6 +27,10 @@ def score_analysis(img, groundtruth, prediction, visualization=False, min_area=2
     :return: [sensitivity, precision, diffusion]
     """
     if visualization:
+        # Matplotlib is only imported when figures are drawn
+        from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+        from matplotlib.figure import Figure
+
         # Define helper functions for plotting
         def _create_figure(result_img, title):
             """
@@ -147,6 +146,7 @@ def dice(img, groundtruth, prediction, min_area=3):
     labels_pred = measure.label(prediction)
     regions_pred = regionprops(labels_pred)
     features = ["coords", "area", "dice"]
+    import pandas as pd
     df = pd.DataFrame(columns=features)
 
     i = 0
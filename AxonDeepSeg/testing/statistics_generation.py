@@ -6,6 +6,7 @@ import numpy as np
 from tqdm import tqdm
 import pickle
 from AxonDeepSeg.apply_model import axon_segmentation
+from AxonDeepSeg.cache import ResamplingCache
 from prettytable import PrettyTable
 from sklearn.metrics import accuracy_score, log_loss
 from AxonDeepSeg.testing.segmentation_scoring import pw_dice
@@ -133,7 +134,7 @@ def print_metrics(metrics_dict, filter_ckpt=None):
 
 
 def generate_statistics(path_model_folder, path_images_folder, resampled_resolution, overlap_value,
-                        verbosity_level=0):
+                        verbosity_level=0, use_cache=True):
     """
     Generates the implemented statistics for all the checkpoints of a given model, for each requested image.
     :param path_model_folder: Path to the model to use.
@@ -141,6 +142,8 @@ def generate_statistics(path_model_folder, path_images_folder, resampled_resolut
     :param resampled_resolution: Float, the resolution to resample to to make the predictions.
     :param overlap_value: Int, the number of pixels to use for overlap.
     :param verbosity_level: Int. The higher, the more displayed information.
+    :param use_cache: Boolean. If True, the images resampled for the first checkpoint are stored in the resampling
+    cache and reused for the next checkpoints and the next runs.
     :return:
     """
     print(path_images_folder)
@@ -156,6 +159,7 @@ def generate_statistics(path_model_folder, path_images_folder, resampled_resolut
         config_network = json.loads(fd.read())
 
     n_classes = config_network['n_classes']
+    cache = ResamplingCache() if use_cache else None
     model_name = path_model_folder.parts[-2] # Extraction of the name of the model.
 
     # We loop over all checkpoint files to compute statistics for each checkpoint.
@@ -211,7 +215,8 @@ def generate_statistics(path_model_folder, path_images_folder, resampled_resolut
                                                             prediction_proba_activate=True,
                                                             write_mode=False,
                                                             gpu_per=1.0,
-                                                            verbosity_level=verbosity_level
+                                                            verbosity_level=verbosity_level,
+                                                            cache=cache
                                                             )
             # These two variables are list, as long as the number of images that are tested.
 
@@ -278,9 +283,10 @@ def output_network_to_proba(output_network, n_classes):
     :param output_network: The pre-activation outputted by the network (function uconv_net), before applying softmax.
     :return: Tensor, same shape as output_network, but probabilities instead.
     """
-    a = np.exp(output_network)
-    b = np.sum(a, axis=-1)
-    return np.stack([np.divide(a[:, :, l], b) for l in range(n_classes)], axis=-1)
+    # The probability maps are float32; the division is done in place to avoid another copy of the map.
+    a = np.exp(output_network, dtype=np.float32)
+    a /= np.sum(a, axis=-1, keepdims=True)
+    return a
 
 
 def compute_metrics(prediction, proba, mask, n_classes):
@@ -2,8 +2,6 @@ from pathlib import Path
 
 # Scientific modules import
 import numpy as np
-import pandas as pd
-from skimage import io
 
 # AxonDeepSeg modules import
 import AxonDeepSeg.ads_utils as ads
@@ -15,27 +13,49 @@ def get_masks(path_prediction):
 
     prediction = ads.imread(path_prediction)
 
+    axon_prediction, myelin_prediction = split_segmentation(prediction)
+
+    # Save masks
+    path_axon, path_myelin = masks_paths(path_prediction)
+    ads.imwrite(path_axon, axon_prediction.astype(int))
+    ads.imwrite(path_myelin, myelin_prediction.astype(int))
+
+    return axon_prediction, myelin_prediction
+
+
+def split_segmentation(prediction):
+    """
+    Computes the axon and myelin masks of a segmentation image.
+    :param prediction: Array, the segmentation image with values in range 0-255 (0: background, 127: myelin, 255: axon).
+    :return: the boolean axon mask and the boolean myelin mask.
+    """
+
     # compute the axon mask
     axon_prediction = prediction > 200
 
     # compute the myelin mask
     myelin_prediction = prediction > 100
-    myelin_prediction = myelin_prediction ^ axon_prediction
+    myelin_prediction ^= axon_prediction
+
+    return axon_prediction, myelin_prediction
+
+
+def masks_paths(path_prediction):
+    """
+    Builds the paths of the axon and myelin masks of a segmentation image.
+    :param path_prediction: Path of the segmentation image (with the '_seg-axonmyelin' suffix).
+    :return: the path of the axon mask and the path of the myelin mask.
+    """
 
     # We want to keep the filename path up to the '_seg-axonmyelin' part
+    path_prediction = convert_path(path_prediction)
     folder_path = path_prediction.parent
     filename_part = path_prediction.name.split('_seg-axonmyelin')[0]
     # Extra check to ensure that the extension was removed
     if filename_part.endswith('.png'):
         filename_part = filename_part.split('.png')[0]
 
-    # Save masks
-    filename_axon   = filename_part + '_seg-axon.png'
-    filename_myelin = filename_part + '_seg-myelin.png'
-    ads.imwrite(folder_path / filename_axon, axon_prediction.astype(int))
-    ads.imwrite(folder_path / filename_myelin, myelin_prediction.astype(int))
-
-    return axon_prediction, myelin_prediction
+    return folder_path / (filename_part + '_seg-axon.png'), folder_path / (filename_part + '_seg-myelin.png')
 
 
 def rgb_rendering_of_mask(pred_img, writing_path=None):
@@ -44,16 +64,20 @@ def rgb_rendering_of_mask(pred_img, writing_path=None):
     :param pred_img: segmented image - 3-class mask
     :param save_mask: Boolean: whether or not to save the returned mask
     :param writing_path: string: path where to save the mask if save_mask=True
-    :return: rgb_mask: imageio.core.util.Image
+    :return: rgb_mask: array of dtype uint8
     """
 
-    pred_axon = pred_img == 255
-    pred_myelin = pred_img == 127
+    # Lookup table of the color of each value of the mask: blue for the axons (255), red for the myelin (127). The
+    # values above 255 are clipped to the last entry of the table, which is black.
+    lut = np.zeros((257, 3), dtype=np.uint8)
+    lut[255] = [0, 0, 255]
+    lut[127] = [255, 0, 0]
 
-    rgb_mask = np.zeros([np.shape(pred_img)[0], np.shape(pred_img)[1], 3])
+    pred_img = np.asarray(pred_img)
+    if not np.issubdtype(pred_img.dtype, np.integer):
+        pred_img = np.where(np.isin(pred_img, [127, 255]), pred_img, 0).astype(np.uint8)
 
-    rgb_mask[pred_axon] = [0, 0, 255]
-    rgb_mask[pred_myelin] = [255, 0, 0]
+    rgb_mask = np.take(lut, pred_img, axis=0, mode='clip')
 
     if writing_path is not None:
         # If string, convert to Path objects
@@ -52,6 +52,8 @@ setup(
         'docs': ['sphinx>=1.6',
                  'sphinx_rtd_theme>=0.2.4',
                  'recommonmark'],
+        'onnx': ['tf2onnx>=1.5',
+                 'onnxruntime>=1.8'],
     },
     include_package_data=True,
     entry_points={
@@ -59,6 +61,9 @@ setup(
            'download_models = AxonDeepSeg.download_model:main',
            'download_tests = AxonDeepSeg.download_tests:main',
            'axondeepseg = AxonDeepSeg.segment:main',
+           'axondeepseg_merge_shards = AxonDeepSeg.sharding:main',
+           'axondeepseg_export_model = AxonDeepSeg.model_export:main',
+           'axondeepseg_quantize_model = AxonDeepSeg.quantization:main',
            'axondeepseg_test = AxonDeepSeg.integrity_test:integrity_test'
         ],
     },
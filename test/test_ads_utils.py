@@ -89,3 +89,83 @@ class TestCore(object):
 
         for model in known_models:
             assert model in get_existing_models_list()
+
+    # --------------imread_lazy / imwrite_mmap tests-------------- #
+    @pytest.mark.unit
+    def test_imwrite_mmap_and_imread_lazy_round_trip_npy(self, tmp_path):
+        path_image = tmp_path / 'image.npy'
+
+        image = imwrite_mmap(path_image, (40, 30), np.uint8)
+        image[10:20, :] = 255
+        image.flush()
+        del image
+
+        image = imread_lazy(path_image)
+
+        assert image.shape == (40, 30)
+        assert np.all(image[10:20, :] == 255)
+        assert np.all(image[:10, :] == 0)
+
+    @pytest.mark.unit
+    def test_imread_lazy_reads_png_files(self, tmp_path):
+        path_image = tmp_path / 'image.png'
+        expected_image = np.arange(0, 256, dtype=np.uint8).reshape(16, 16)
+        imwrite(path_image, expected_image)
+
+        with pytest.warns(UserWarning):
+            assert np.array_equal(imread_lazy(path_image), expected_image)
+
+    @pytest.mark.unit
+    def test_imread_lazy_memory_maps_compressed_tiff_files(self, tmp_path):
+        tifffile = pytest.importorskip('tifffile')
+        path_image = tmp_path / 'image.tif'
+        expected_image = (np.arange(300 * 200) % 251).astype(np.uint8).reshape(300, 200)
+        tifffile.imwrite(str(path_image), expected_image, compression='zlib', rowsperstrip=16)
+
+        image = imread_lazy(path_image)
+
+        assert isinstance(image, np.memmap)
+        assert np.array_equal(image[100:150, 20:80], expected_image[100:150, 20:80])
+
+    @pytest.mark.unit
+    def test_imread_shape_returns_dimensions_of_gray_and_rgb_images(self, tmp_path):
+        imwrite(tmp_path / 'gray.png', np.zeros((16, 24), dtype=np.uint8))
+        imwrite(tmp_path / 'rgb.png', np.zeros((16, 24, 3), dtype=np.uint8))
+        imwrite(tmp_path / 'gray.tif', np.zeros((16, 24), dtype=np.uint8), format='tiff')
+
+        for filename in ['gray.png', 'rgb.png', 'gray.tif']:
+            assert imread_shape(tmp_path / filename) == (16, 24)
+
+    @pytest.mark.unit
+    def test_image_region_as_uint_converts_rgb_regions_to_grayscale(self):
+        region = np.full((4, 5, 3), 120, dtype=np.uint8)
+
+        gray_region = image_region_as_uint(region)
+
+        assert gray_region.shape == (4, 5)
+        assert gray_region.dtype == np.uint8
+
+    @pytest.mark.unit
+    def test_image_region_as_uint_scales_regions_as_the_full_image(self, tmp_path):
+        tifffile = pytest.importorskip('tifffile')
+        rng = np.random.RandomState(0)
+        images = {
+            'float.tif': (rng.rand(120, 90) * 1000 - 200).astype(np.float32),
+            'rgb.tif': rng.randint(0, 256, (120, 90, 3)).astype(np.uint8)
+        }
+
+        for filename, image in images.items():
+            tifffile.imwrite(str(tmp_path / filename), image)
+
+            expected_image = imread(tmp_path / filename)
+            lazy_image = imread_lazy(tmp_path / filename)
+            value_range = image_value_range(lazy_image, n_rows=7)
+
+            # Each tile is converted on its own
+            tiles_image = np.zeros_like(expected_image)
+            for y in range(0, 120, 40):
+                for x in range(0, 90, 30):
+                    tiles_image[y:y + 40, x:x + 30] = image_region_as_uint(lazy_image[y:y + 40, x:x + 30],
+                                                                           value_range=value_range)
+
+            assert np.array_equal(tiles_image, expected_image), filename
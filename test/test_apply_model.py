@@ -0,0 +1,50 @@
+# coding: utf-8
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import AxonDeepSeg.ads_utils as ads
+import AxonDeepSeg.apply_model
+from AxonDeepSeg.apply_model import Segmenter
+
+
+class StubBackend(object):
+    # Predicts the background class for every patch, without loading a model
+    def predict(self, batch_x, prediction_proba_activate=False):
+        return np.zeros(batch_x.shape[:3], dtype=np.uint8), None
+
+    def close(self):
+        pass
+
+
+class TestCore(object):
+    def setup(self):
+        self.config = {'trainingset_patchsize': 64, 'n_classes': 3}
+
+    # --------------segment_stream tests-------------- #
+    @pytest.mark.unit
+    def test_segment_stream_stops_loading_when_closed_early(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(AxonDeepSeg.apply_model, 'create_inference_backend', lambda *args, **kwargs: StubBackend())
+
+        path_images = []
+        for k in range(8):
+            path_images.append(tmp_path / 'image_{0}.png'.format(k))
+            ads.imwrite(path_images[-1], np.random.RandomState(k).randint(0, 256, (256, 256)).astype(np.uint8))
+
+        threads = set(threading.enumerate())
+
+        with Segmenter(tmp_path, self.config) as segmenter:
+            segmentations = segmenter.segment_stream(path_images, [0.1], resampled_resolutions=[0.1], n_workers=1,
+                                                     queue_size=1)
+            next(segmentations)
+            segmentations.close()
+
+            # The producer and loading threads end without going through the other images
+            deadline = time.time() + 5
+            while (set(threading.enumerate()) - threads) and time.time() < deadline:
+                time.sleep(0.05)
+
+            assert not (set(threading.enumerate()) - threads)
@@ -0,0 +1,99 @@
+# coding: utf-8
+
+import os
+import time
+
+import pytest
+import numpy as np
+
+from AxonDeepSeg.cache import ResamplingCache
+import AxonDeepSeg.cache
+from AxonDeepSeg.incremental import SegmentationManifest
+
+
+class TestCore(object):
+    def setup(self):
+        rng = np.random.RandomState(0)
+        self.resampled = rng.randint(0, 256, size=(100, 120)).astype(np.uint8)
+
+    def teardown(self):
+        pass
+
+    def write_file(self, path, content):
+        with open(str(path), 'wb') as f:
+            f.write(content)
+        return path
+
+    # --------------file_hash tests-------------- #
+    @pytest.mark.unit
+    def test_file_hash_reads_each_file_once_for_the_cache_and_the_manifest(self, tmp_path, monkeypatch):
+        path_image = self.write_file(tmp_path / 'image.png', b'image content')
+        hashed = []
+        file_sha256 = AxonDeepSeg.cache.file_sha256
+        monkeypatch.setattr(AxonDeepSeg.cache, 'file_sha256', lambda path: hashed.append(path) or file_sha256(path))
+
+        ResamplingCache(tmp_path / 'cache').key(path_image, 0.37, 0.1)
+        ResamplingCache(tmp_path / 'cache').key(path_image, 0.37, 0.2)
+        SegmentationManifest(tmp_path, {}).entry(path_image)
+
+        assert len(hashed) == 1
+
+        # A modified file is hashed again
+        self.write_file(path_image, b'new image content')
+        SegmentationManifest(tmp_path, {}).entry(path_image)
+
+        assert len(hashed) == 2
+
+    # --------------ResamplingCache tests-------------- #
+    @pytest.mark.unit
+    def test_get_returns_the_stored_acquisition(self, tmp_path):
+        cache = ResamplingCache(tmp_path / 'cache')
+        path_image = self.write_file(tmp_path / 'image.png', b'image content')
+        key = cache.key(path_image, 0.37, 0.1)
+
+        cache.put(key, self.resampled, (30, 36))
+        resampled, original_shape = cache.get(key)
+
+        assert np.array_equal(resampled, self.resampled)
+        assert original_shape == (30, 36)
+
+    @pytest.mark.unit
+    def test_get_returns_None_for_unknown_keys(self, tmp_path):
+        cache = ResamplingCache(tmp_path / 'cache')
+
+        assert cache.get('unknown') is None
+
+    @pytest.mark.unit
+    def test_key_depends_on_the_content_and_the_resolutions(self, tmp_path):
+        cache = ResamplingCache(tmp_path / 'cache')
+        path_image = self.write_file(tmp_path / 'image.png', b'image content')
+        path_copy = self.write_file(tmp_path / 'copy.png', b'image content')
+        path_other = self.write_file(tmp_path / 'other.png', b'other content')
+
+        key = cache.key(path_image, 0.37, 0.1)
+
+        assert cache.key(path_copy, 0.37, 0.1) == key
+        assert cache.key(path_other, 0.37, 0.1) != key
+        assert cache.key(path_image, 0.5, 0.1) != key
+        assert cache.key(path_image, 0.37, 0.2) != key
+        assert cache.key(path_image, 0.37, 0.1, resampling_backend='area') != key
+
+    @pytest.mark.unit
+    def test_put_evicts_the_least_recently_used_entries(self, tmp_path):
+        cache = ResamplingCache(tmp_path / 'cache')
+        cache.put('first', self.resampled, (30, 36))
+        cache.put('second', self.resampled, (30, 36))
+        entry_size = cache.path('first').stat().st_size
+
+        # 'first' is used after 'second', so 'second' is the least recently used entry
+        past = time.time() - 100
+        os.utime(str(cache.path('first')), (past, past))
+        os.utime(str(cache.path('second')), (past, past))
+        cache.get('first')
+
+        cache.max_size = 2 * entry_size
+        cache.put('third', self.resampled, (30, 36))
+
+        assert cache.get('first') is not None
+        assert cache.get('second') is None
+        assert cache.get('third') is not None
@@ -0,0 +1,79 @@
+# coding: utf-8
+
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+# Modules that must only be imported by the code paths that need them.
+heavy_modules = ('tensorflow', 'keras', 'matplotlib', 'pandas')
+
+# Import time budgets, in seconds. They are well above the time measured on a development machine so that the tests
+# do not fail on a slow runner, and well below the several seconds taken by the import of Tensorflow.
+cli_budget = 2.
+morphometrics_budget = 3.
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.testPath = Path(__file__).resolve().parent
+        self.projectPath = self.testPath.parent
+
+    def import_times(self, code):
+        """
+        Runs some code in a new interpreter with -X importtime.
+        :param code: String, the Python code to run.
+        :return: dict mapping the name of each module imported to its cumulative import time in seconds.
+        """
+
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=str(self.projectPath),
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        assert process.returncode == 0, process.stderr
+
+        times = {}
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, module = line.split('|')
+            times[module.strip()] = int(cumulative) * 1e-6
+
+        return times
+
+    def heavy_modules_imported(self, times):
+        return sorted({module.split('.')[0] for module in times} & set(heavy_modules))
+
+    # --------------cli tests-------------- #
+    @pytest.mark.unit
+    def test_cli_help_does_not_import_heavy_modules(self):
+        times = self.import_times(
+            "from AxonDeepSeg.segment import main\n"
+            "try:\n"
+            "    main(['--help'])\n"
+            "except SystemExit:\n"
+            "    pass"
+        )
+
+        assert 'AxonDeepSeg.segment' in times
+        assert self.heavy_modules_imported(times) == []
+
+    @pytest.mark.unit
+    def test_cli_import_time_is_within_budget(self):
+        times = self.import_times("import AxonDeepSeg.segment")
+
+        assert times['AxonDeepSeg.segment'] < cli_budget
+
+    # --------------morphometrics tests-------------- #
+    @pytest.mark.unit
+    def test_morphometrics_does_not_import_heavy_modules(self):
+        times = self.import_times("import AxonDeepSeg.morphometrics.launch_morphometrics_computation")
+
+        assert 'AxonDeepSeg.morphometrics.compute_morphometrics' in times
+        assert self.heavy_modules_imported(times) == []
+
+    @pytest.mark.unit
+    def test_morphometrics_import_time_is_within_budget(self):
+        times = self.import_times("import AxonDeepSeg.morphometrics.launch_morphometrics_computation")
+
+        assert times['AxonDeepSeg.morphometrics.launch_morphometrics_computation'] < morphometrics_budget
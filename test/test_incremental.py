@@ -0,0 +1,102 @@
+# coding: utf-8
+
+import pytest
+
+import AxonDeepSeg.cache
+from AxonDeepSeg.incremental import SegmentationManifest, model_checksum, manifest_name
+
+
+class TestCore(object):
+    def setup(self):
+        self.parameters = {
+            'model_checksum': 'abc',
+            'overlap_value': 25,
+            'acquired_resolution': 0.37,
+            'resolution_model': 0.1
+            }
+
+    def teardown(self):
+        pass
+
+    def write_file(self, path, content):
+        with open(str(path), 'wb') as f:
+            f.write(content)
+        return path
+
+    # --------------SegmentationManifest tests-------------- #
+    @pytest.mark.unit
+    def test_recorded_segmentation_is_up_to_date(self, tmp_path):
+        path_image = self.write_file(tmp_path / 'image.png', b'image content')
+        path_seg = self.write_file(tmp_path / 'image_seg-axonmyelin.png', b'segmentation')
+
+        manifest = SegmentationManifest(tmp_path, self.parameters)
+        assert not manifest.is_up_to_date(path_image, path_seg)
+
+        manifest.record(path_image)
+        assert (tmp_path / manifest_name).exists()
+
+        # The manifest is read again by the next run
+        assert SegmentationManifest(tmp_path, self.parameters).is_up_to_date(path_image, path_seg)
+
+    @pytest.mark.unit
+    def test_segmentation_is_not_up_to_date_when_inputs_change(self, tmp_path):
+        path_image = self.write_file(tmp_path / 'image.png', b'image content')
+        path_seg = self.write_file(tmp_path / 'image_seg-axonmyelin.png', b'segmentation')
+        SegmentationManifest(tmp_path, self.parameters).record(path_image)
+
+        other_parameters = dict(self.parameters, overlap_value=10)
+        assert not SegmentationManifest(tmp_path, other_parameters).is_up_to_date(path_image, path_seg)
+
+        self.write_file(path_image, b'modified image content')
+        assert not SegmentationManifest(tmp_path, self.parameters).is_up_to_date(path_image, path_seg)
+
+    @pytest.mark.unit
+    def test_segmentation_is_not_up_to_date_when_image_parameters_change(self, tmp_path):
+        path_image = self.write_file(tmp_path / 'image.png', b'image content')
+        path_seg = self.write_file(tmp_path / 'image_seg-axonmyelin.png', b'segmentation')
+        SegmentationManifest(tmp_path, self.parameters).record(path_image, acquired_resolution=0.1)
+
+        manifest = SegmentationManifest(tmp_path, self.parameters)
+        assert manifest.is_up_to_date(path_image, path_seg, acquired_resolution=0.1)
+        assert not manifest.is_up_to_date(path_image, path_seg, acquired_resolution=0.2)
+
+    @pytest.mark.unit
+    def test_segmentation_is_not_up_to_date_when_output_is_missing(self, tmp_path):
+        path_image = self.write_file(tmp_path / 'image.png', b'image content')
+        SegmentationManifest(tmp_path, self.parameters).record(path_image)
+
+        manifest = SegmentationManifest(tmp_path, self.parameters)
+        assert not manifest.is_up_to_date(path_image, tmp_path / 'image_seg-axonmyelin.png')
+
+    @pytest.mark.unit
+    def test_unreadable_manifest_is_ignored(self, tmp_path):
+        self.write_file(tmp_path / manifest_name, b'{not json')
+
+        assert SegmentationManifest(tmp_path, self.parameters).entries == {}
+
+    # --------------model_checksum tests-------------- #
+    @pytest.mark.unit
+    def test_model_checksum_depends_on_checkpoint_and_config(self, tmp_path):
+        self.write_file(tmp_path / 'model.ckpt.index', b'index')
+        self.write_file(tmp_path / 'model.ckpt.data-00000-of-00001', b'weights')
+        config = {'n_classes': 3}
+
+        checksum = model_checksum(tmp_path, config)
+
+        assert model_checksum(tmp_path, {'n_classes': 2}) != checksum
+
+        self.write_file(tmp_path / 'model.ckpt.data-00000-of-00001', b'other weights')
+        assert model_checksum(tmp_path, config) != checksum
+
+    @pytest.mark.unit
+    def test_model_checksum_hashes_the_checkpoint_once(self, tmp_path, monkeypatch):
+        self.write_file(tmp_path / 'model.ckpt.index', b'index')
+        hashed = []
+        file_sha256 = AxonDeepSeg.cache.file_sha256
+        monkeypatch.setattr(AxonDeepSeg.cache, 'file_sha256', lambda path: hashed.append(path) or file_sha256(path))
+
+        # Once per folder segmented, for instance
+        for _ in range(3):
+            model_checksum(tmp_path, {'n_classes': 3})
+
+        assert len(hashed) == 1
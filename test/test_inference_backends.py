@@ -0,0 +1,94 @@
+# coding: utf-8
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from AxonDeepSeg.inference_backends import *
+from AxonDeepSeg.model_export import export_formats, frozen_model_paths
+import AxonDeepSeg.ads_utils as ads
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.testPath = Path(__file__).resolve().parent
+        self.projectPath = self.testPath.parent
+
+        self.modelsPath = self.projectPath / 'AxonDeepSeg' / 'models'
+        self.modelPaths = [self.modelsPath / 'default_SEM_model', self.modelsPath / 'default_TEM_model']
+
+    def teardown(self):
+        for path_model in self.modelPaths:
+            for export_format in export_formats:
+                for path in frozen_model_paths(path_model, export_format=export_format):
+                    if path.exists():
+                        path.unlink()
+
+    # --------------create_inference_backend tests-------------- #
+    @pytest.mark.exceptionhandling
+    def test_create_inference_backend_raises_error_for_unknown_backend(self, tmp_path):
+        with pytest.raises(ValueError):
+            create_inference_backend('tflite', tmp_path, {})
+
+    @pytest.mark.exceptionhandling
+    def test_create_inference_backend_raises_error_for_missing_export(self, tmp_path):
+        with open(str(tmp_path / 'model.ckpt.index'), 'wb') as f:
+            f.write(b'index')
+
+        for inference_backend in ['tensorflow', 'onnxruntime', 'onnxruntime_int8']:
+            with pytest.raises(ValueError):
+                create_inference_backend(inference_backend, tmp_path, {'n_classes': 3, 'trainingset_patchsize': 256})
+
+    # --------------parity tests-------------- #
+    @pytest.mark.integration
+    def test_backends_give_the_labels_of_the_keras_model(self):
+        pytest.importorskip('tf2onnx')
+        pytest.importorskip('onnxruntime')
+
+        from AxonDeepSeg.apply_model import Segmenter
+        from AxonDeepSeg.model_export import export_onnx_model
+        from AxonDeepSeg.segment import generate_config_dict
+
+        for path_model in self.modelPaths:
+            config = generate_config_dict(path_model / 'config_network.json')
+            export_onnx_model(path_model, config)
+
+            patch_size = config['trainingset_patchsize']
+            image = ads.imread(path_model / 'data_test' / 'image.png')
+            patches = [image[:patch_size, :patch_size], image[-patch_size:, -patch_size:]]
+
+            with Segmenter(path_model, config, inference_backend='keras') as segmenter:
+                expected_labels, expected_proba = segmenter.predict_patches(patches, prediction_proba_activate=True)
+
+            for inference_backend in ['tensorflow', 'onnxruntime']:
+                with Segmenter(path_model, config, inference_backend=inference_backend) as segmenter:
+                    labels, proba = segmenter.predict_patches(patches, prediction_proba_activate=True)
+
+                assert labels.dtype == np.uint8
+                assert np.allclose(proba, expected_proba, atol=1e-4)
+                assert np.mean(labels == expected_labels) > 0.999
+
+    @pytest.mark.integration
+    def test_backends_compute_the_probabilities_only_when_requested(self):
+        from AxonDeepSeg.apply_model import Segmenter, perform_batch_inference
+        from AxonDeepSeg.model_export import export_frozen_model
+        from AxonDeepSeg.segment import generate_config_dict
+
+        path_model = self.modelPaths[0]
+        config = generate_config_dict(path_model / 'config_network.json')
+        export_frozen_model(path_model, config)
+
+        patch_size = config['trainingset_patchsize']
+        batch_x = np.random.RandomState(0).randint(0, 256, (2, patch_size, patch_size, 1)).astype(np.uint8)
+
+        for inference_backend in ['keras', 'tensorflow']:
+            with Segmenter(path_model, config, inference_backend=inference_backend) as segmenter:
+                labels, proba = perform_batch_inference(segmenter.backend, batch_x)
+                assert labels.shape == (2, patch_size, patch_size) and labels.dtype == np.uint8
+                assert proba is None
+
+                labels, proba = perform_batch_inference(segmenter.backend, batch_x, prediction_proba_activate=True)
+                assert proba.shape == (2, patch_size, patch_size, config['n_classes'])
+                assert np.array_equal(labels, np.argmax(proba, axis=-1))
@@ -0,0 +1,161 @@
+# coding: utf-8
+
+from pathlib import Path
+import os
+import json
+
+import numpy as np
+import pytest
+
+from AxonDeepSeg.model_export import *
+import AxonDeepSeg.model_export
+from AxonDeepSeg.config_tools import update_config, default_configuration
+from AxonDeepSeg.incremental import model_checksum
+from AxonDeepSeg.segment import generate_config_dict
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.testPath = Path(__file__).resolve().parent
+        self.projectPath = self.testPath.parent
+
+        self.modelPath = (
+            self.projectPath /
+            'AxonDeepSeg' /
+            'models' /
+            'default_SEM_model'
+            )
+
+        rng = np.random.RandomState(0)
+        self.x = rng.rand(8, 9, 4)
+        self.kernel = rng.randn(3, 3, 4, 5)
+        self.bias = rng.randn(5)
+        self.gamma = rng.rand(5) + 0.5
+        self.beta = rng.randn(5)
+        self.moving_mean = rng.randn(5)
+        self.moving_variance = rng.rand(5) + 0.1
+        self.epsilon = 1e-3
+
+    def teardown(self):
+        for export_format in export_formats:
+            for path in frozen_model_paths(self.modelPath, export_format=export_format):
+                if path.exists():
+                    path.unlink()
+
+    def conv(self, x, kernel, bias):
+        # 'valid' convolution of an image of shape (height, width, channels)
+        height, width = x.shape[0] - kernel.shape[0] + 1, x.shape[1] - kernel.shape[1] + 1
+        out = np.zeros((height, width, kernel.shape[3])) + bias
+        for i in range(kernel.shape[0]):
+            for j in range(kernel.shape[1]):
+                out += x[i:i + height, j:j + width].dot(kernel[i, j])
+        return out
+
+    def write_file(self, path, content):
+        with open(str(path), 'wb') as f:
+            f.write(content)
+        return path
+
+    # --------------fold_batch_norm tests-------------- #
+    @pytest.mark.unit
+    def test_fold_batch_norm_is_equal_to_conv_then_batch_norm(self):
+        expected = self.conv(self.x, self.kernel, self.bias)
+        expected = (expected - self.moving_mean) / np.sqrt(self.moving_variance + self.epsilon) * self.gamma + self.beta
+
+        kernel, bias = fold_batch_norm(self.kernel, self.bias, self.gamma, self.beta, self.moving_mean,
+                                       self.moving_variance, self.epsilon)
+
+        assert kernel.dtype == np.float32 and bias.dtype == np.float32
+        assert np.allclose(self.conv(self.x, kernel, bias), expected, atol=1e-4)
+
+    @pytest.mark.unit
+    def test_fold_batch_norm_without_bias_scale_and_offset(self):
+        expected = self.conv(self.x, self.kernel, 0)
+        expected = (expected - self.moving_mean) / np.sqrt(self.moving_variance + self.epsilon)
+
+        kernel, bias = fold_batch_norm(self.kernel, None, None, None, self.moving_mean, self.moving_variance,
+                                       self.epsilon)
+
+        assert np.allclose(self.conv(self.x, kernel, bias), expected, atol=1e-4)
+
+    # --------------read_frozen_model_metadata tests-------------- #
+    @pytest.mark.unit
+    def test_read_frozen_model_metadata_checks_the_checkpoint(self, tmp_path):
+        config = {'n_classes': 3, 'trainingset_patchsize': 256}
+        assert read_frozen_model_metadata(tmp_path, config) is None
+
+        self.write_file(tmp_path / 'model.ckpt.index', b'index')
+        path_graph, path_metadata = frozen_model_paths(tmp_path)
+        self.write_file(path_graph, b'graph')
+        metadata = {
+            'version': frozen_model_version,
+            'format': 'tensorflow',
+            'model_checksum': model_checksum(tmp_path, update_config(default_configuration(), config)),
+            'input': input_tensor_name
+            }
+        self.write_file(path_metadata, json.dumps(metadata).encode())
+
+        assert read_frozen_model_metadata(tmp_path, config)['model_checksum'] == metadata['model_checksum']
+        assert read_frozen_model_metadata(tmp_path, dict(config, n_classes=2)) is None
+
+        # A new checkpoint makes the frozen graph out of date
+        self.write_file(tmp_path / 'model.ckpt.index', b'new index')
+        assert read_frozen_model_metadata(tmp_path, config) is None
+
+    @pytest.mark.unit
+    def test_read_frozen_model_metadata_hashes_the_checkpoint_only_if_its_files_changed(self, tmp_path, monkeypatch):
+        config = update_config(default_configuration(), {'n_classes': 3, 'trainingset_patchsize': 256})
+        self.write_file(tmp_path / 'model.ckpt.index', b'index')
+        path_graph, _ = frozen_model_paths(tmp_path)
+        self.write_file(path_graph, b'graph')
+        write_frozen_model_metadata(tmp_path, config, 'model', 'tensorflow')
+
+        checksums = []
+        def counted_model_checksum(*args):
+            checksums.append(args)
+            return model_checksum(*args)
+        monkeypatch.setattr(AxonDeepSeg.model_export, 'model_checksum', counted_model_checksum)
+
+        assert read_frozen_model_metadata(tmp_path, config) is not None
+        assert read_frozen_model_metadata(tmp_path, dict(config, n_classes=2)) is None
+        assert len(checksums) == 1
+
+        # Same content with another modification time: hashed once, then the description is updated
+        self.write_file(tmp_path / 'model.ckpt.index', b'index')
+        os.utime(str(tmp_path / 'model.ckpt.index'), ns=(0, 0))
+        assert read_frozen_model_metadata(tmp_path, config) is not None
+        assert read_frozen_model_metadata(tmp_path, config) is not None
+        assert len(checksums) == 2
+
+    # --------------export_frozen_model tests-------------- #
+    @pytest.mark.integration
+    def test_frozen_model_gives_the_predictions_of_the_checkpoint(self):
+        from AxonDeepSeg.apply_model import Segmenter
+
+        config = generate_config_dict(self.modelPath / 'config_network.json')
+        path_graph = export_frozen_model(self.modelPath, config)
+        assert path_graph.exists()
+
+        patch_size = config['trainingset_patchsize']
+        patches = np.random.RandomState(0).randint(0, 256, (2, patch_size, patch_size)).astype(np.uint8)
+
+        with Segmenter(self.modelPath, config, inference_backend='keras') as segmenter:
+            expected_labels, expected_proba = segmenter.predict_patches(patches, prediction_proba_activate=True)
+
+        # The frozen graph is used by default once it is exported
+        with Segmenter(self.modelPath, config) as segmenter:
+            assert type(segmenter.backend).__name__ == 'FrozenGraphBackend'
+            labels, proba = segmenter.predict_patches(patches, prediction_proba_activate=True)
+
+        assert labels.dtype == np.uint8 and expected_labels.dtype == np.uint8
+        assert np.allclose(proba, expected_proba, atol=1e-4)
+        assert np.mean(labels == expected_labels) > 0.999
+
+    # --------------main (cli) tests-------------- #
+    @pytest.mark.exceptionhandling
+    def test_main_cli_handles_exception_missing_model(self):
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            main([])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 3)
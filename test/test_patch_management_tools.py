@@ -0,0 +1,90 @@
+# coding: utf-8
+
+import pytest
+import numpy as np
+
+from AxonDeepSeg.patch_management_tools import im2patches_overlap, patches2im_overlap, patches2im_blend, \
+    blending_window
+
+
+class TestCore(object):
+    def setup(self):
+        rng = np.random.RandomState(0)
+        self.image = rng.randint(0, 3, size=(700, 900)).astype(np.uint8)
+        self.squareImage = rng.randint(0, 3, size=(1000, 1000)).astype(np.uint8)
+
+    def teardown(self):
+        pass
+
+    # --------------patches2im_overlap tests-------------- #
+    @pytest.mark.unit
+    def test_patches2im_overlap_reconstructs_the_image(self):
+        for image in [self.image, self.squareImage]:
+            _, patches, positions = im2patches_overlap(image, overlap_value=25, scw=512)
+
+            stitched = patches2im_overlap(patches, positions, overlap_value=25, scw=512)
+
+            assert np.array_equal(stitched, image)
+
+    @pytest.mark.unit
+    def test_patches2im_overlap_writes_into_the_given_array(self):
+        _, patches, positions = im2patches_overlap(self.image, overlap_value=25, scw=256)
+        out = np.empty(self.image.shape, dtype=np.uint8)
+
+        stitched = patches2im_overlap(patches, positions, overlap_value=25, scw=256, out=out)
+
+        assert stitched is out
+        assert np.array_equal(out, self.image)
+
+    @pytest.mark.unit
+    def test_patches2im_overlap_stitches_multichannel_patches(self):
+        image = np.stack([self.image, 2 - self.image], axis=-1).astype(np.float32)
+        _, patches, positions = im2patches_overlap(image, overlap_value=25, scw=512)
+
+        stitched = patches2im_overlap(patches, positions, overlap_value=25, scw=512)
+
+        assert stitched.dtype == np.float32
+        assert np.array_equal(stitched, image)
+
+    # --------------im2patches_overlap tests-------------- #
+    @pytest.mark.unit
+    def test_im2patches_overlap_returns_an_array_of_patches(self):
+        _, patches, positions = im2patches_overlap(self.image, overlap_value=25, scw=512)
+
+        assert patches.shape == (len(positions), 512, 512)
+        assert patches.dtype == self.image.dtype
+        for patch, (h, w) in zip(patches, positions):
+            assert np.array_equal(patch, self.image[h:h + 512, w:w + 512])
+
+    @pytest.mark.unit
+    def test_im2patches_overlap_covers_the_last_rows_and_columns(self):
+        _, _, positions = im2patches_overlap(self.image, overlap_value=25, scw=512)
+
+        assert np.array_equal(np.unique(positions[:, 0]), [0, 700 - 512])
+        assert np.array_equal(np.unique(positions[:, 1]), [0, 900 - 512])
+
+    # --------------patches2im_blend tests-------------- #
+    @pytest.mark.unit
+    def test_blending_window_is_positive_and_maximal_at_the_centre(self):
+        for window in ['hann', 'gaussian']:
+            weights = blending_window(scw=64, window=window)
+
+            assert weights.shape == (64, 64)
+            assert np.all(weights > 0)
+            assert weights[31, 31] == weights.max()
+
+    @pytest.mark.unit
+    def test_patches2im_blend_reconstructs_consistent_probabilities(self):
+        one_hot = np.eye(3, dtype=np.float32)[self.image]
+        _, patches, positions = im2patches_overlap(one_hot, overlap_value=10, scw=256)
+
+        blended = patches2im_blend(patches, positions, scw=256)
+
+        assert blended.dtype == np.float32
+        assert np.allclose(blended, one_hot)
+        assert np.array_equal(np.argmax(blended, axis=-1), self.image)
+
+    @pytest.mark.exceptionhandling
+    def test_blending_window_unknown_window_raises_ValueError(self):
+        with pytest.raises(ValueError):
+            blending_window(scw=64, window='box')
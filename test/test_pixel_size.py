@@ -0,0 +1,75 @@
+# coding: utf-8
+
+import pytest
+import numpy as np
+from PIL import Image
+
+import AxonDeepSeg.ads_utils as ads
+from AxonDeepSeg.pixel_size import PixelSizeResolver, read_tiff_pixel_size
+
+
+class TestCore(object):
+    def setup(self):
+        self.image = np.zeros((20, 30), dtype=np.uint8)
+
+    def teardown(self):
+        pass
+
+    def write_tiff(self, path, tags):
+        Image.fromarray(self.image).save(str(path), tiffinfo=tags)
+        return path
+
+    # --------------read_tiff_pixel_size tests-------------- #
+    @pytest.mark.unit
+    def test_read_tiff_pixel_size_reads_resolution_in_centimeters(self, tmp_path):
+        path_image = self.write_tiff(tmp_path / 'image.tif', {282: 1e4 / 0.12, 283: 1e4 / 0.12, 296: 3})
+
+        assert read_tiff_pixel_size(path_image) == pytest.approx(0.12)
+
+    @pytest.mark.unit
+    def test_read_tiff_pixel_size_reads_imagej_resolution(self, tmp_path):
+        path_image = self.write_tiff(tmp_path / 'image.tif',
+                                     {282: 1 / 0.05, 283: 1 / 0.05, 296: 1, 270: 'ImageJ=1.52\nunit=micron\n'})
+
+        assert read_tiff_pixel_size(path_image) == pytest.approx(0.05)
+
+    @pytest.mark.unit
+    def test_read_tiff_pixel_size_ignores_resolution_in_inches(self, tmp_path):
+        path_image = self.write_tiff(tmp_path / 'image.tif', {282: 72.0, 283: 72.0, 296: 2})
+
+        assert read_tiff_pixel_size(path_image) is None
+
+    # --------------PixelSizeResolver tests-------------- #
+    @pytest.mark.unit
+    def test_resolver_uses_sources_in_order(self, tmp_path):
+        for name in ['a.png', 'b.png', 'c.png']:
+            ads.imwrite(tmp_path / name, self.image)
+        self.write_tiff(tmp_path / 'd.tif', {282: 1e4 / 0.12, 283: 1e4 / 0.12, 296: 3})
+        (tmp_path / 'pixel_size_in_micrometer.txt').write_text('0.1')
+        (tmp_path / 'a_pixel_size_in_micrometer.txt').write_text('0.2')
+        (tmp_path / 'b_pixel_size_in_micrometer.txt').write_text('0.2')
+        (tmp_path / 'map.csv').write_text('image,pixel_size\na.png,0.3\n')
+
+        resolver = PixelSizeResolver(tmp_path / 'map.csv')
+
+        assert resolver.resolve(tmp_path / 'a.png') == pytest.approx(0.3)
+        assert resolver.resolve(tmp_path / 'b.png') == pytest.approx(0.2)
+        assert resolver.resolve(tmp_path / 'c.png') == pytest.approx(0.1)
+        assert resolver.resolve(tmp_path / 'd.tif') == pytest.approx(0.12)
+
+    @pytest.mark.unit
+    def test_resolver_reads_each_file_once(self, tmp_path):
+        ads.imwrite(tmp_path / 'image.png', self.image)
+        (tmp_path / 'pixel_size_in_micrometer.txt').write_text('0.1')
+
+        resolver = PixelSizeResolver()
+        assert resolver.resolve(tmp_path / 'image.png') == pytest.approx(0.1)
+
+        (tmp_path / 'pixel_size_in_micrometer.txt').write_text('0.5')
+        assert resolver.resolve(tmp_path / 'image.png') == pytest.approx(0.1)
+
+    @pytest.mark.unit
+    def test_resolver_returns_None_without_pixel_size(self, tmp_path):
+        ads.imwrite(tmp_path / 'image.png', self.image)
+
+        assert PixelSizeResolver().resolve(tmp_path / 'image.png') is None
@@ -0,0 +1,121 @@
+# coding: utf-8
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from AxonDeepSeg.quantization import *
+from AxonDeepSeg.model_export import export_formats, frozen_model_paths
+import AxonDeepSeg.ads_utils as ads
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.testPath = Path(__file__).resolve().parent
+        self.projectPath = self.testPath.parent
+
+        self.modelPath = (
+            self.projectPath /
+            'AxonDeepSeg' /
+            'models' /
+            'default_SEM_model'
+            )
+
+        self.image = np.random.RandomState(0).randint(0, 256, (300, 400)).astype(np.uint8)
+
+    def teardown(self):
+        for export_format in export_formats:
+            for path in frozen_model_paths(self.modelPath, export_format=export_format):
+                if path.exists():
+                    path.unlink()
+
+    def write_sample(self, folder, pixel_size=0.1, mask=True):
+        folder.mkdir(parents=True)
+        ads.imwrite(folder / 'image.png', self.image)
+        if mask:
+            ads.imwrite(folder / 'mask.png', np.zeros_like(self.image))
+        with open(str(folder / 'pixel_size_in_micrometer.txt'), 'w') as f:
+            f.write(str(pixel_size))
+
+    # --------------dataset_samples tests-------------- #
+    @pytest.mark.unit
+    def test_dataset_samples_lists_the_sample_folders(self, tmp_path):
+        self.write_sample(tmp_path / 'sample_1')
+        self.write_sample(tmp_path / 'sample_2', pixel_size=0.05, mask=False)
+        (tmp_path / 'not_a_sample').mkdir()
+
+        samples = dataset_samples(tmp_path)
+
+        assert samples == [
+            (tmp_path / 'sample_1' / 'image.png', tmp_path / 'sample_1' / 'mask.png', 0.1),
+            (tmp_path / 'sample_2' / 'image.png', None, 0.05)
+            ]
+
+    @pytest.mark.unit
+    def test_dataset_samples_accepts_a_single_sample_folder(self, tmp_path):
+        self.write_sample(tmp_path / 'data_test')
+
+        assert len(dataset_samples(tmp_path / 'data_test')) == 1
+
+    # --------------calibration_patches tests-------------- #
+    @pytest.mark.unit
+    def test_calibration_patches_draws_patches_at_the_resolution_of_the_model(self, tmp_path):
+        self.write_sample(tmp_path / 'sample_1')
+        samples = dataset_samples(tmp_path)
+
+        patches = calibration_patches(samples, 128, 0.1, n_patches=4)
+
+        assert patches.shape == (4, 128, 128) and patches.dtype == np.uint8
+        assert np.array_equal(patches, calibration_patches(samples, 128, 0.1, n_patches=4))
+
+        # Resampled to half its size, the image has fewer patches than requested
+        assert len(calibration_patches(samples, 128, 0.2, n_patches=100)) < 100
+
+    # --------------PatchCalibrationReader tests-------------- #
+    @pytest.mark.unit
+    def test_calibration_reader_feeds_each_patch_once(self):
+        patches = np.zeros((3, 8, 8), dtype=np.uint8)
+        reader = PatchCalibrationReader(patches, 'input:0')
+
+        inputs = [reader.get_next() for _ in range(4)]
+
+        assert [x['input:0'].shape for x in inputs[:3]] == [(1, 8, 8, 1)] * 3
+        assert inputs[3] is None
+
+    # --------------quantize_model tests-------------- #
+    @pytest.mark.integration
+    def test_int8_model_keeps_the_dice_of_the_float_model(self):
+        pytest.importorskip('tf2onnx')
+        pytest.importorskip('onnxruntime')
+
+        from AxonDeepSeg.segment import generate_config_dict
+
+        config = generate_config_dict(self.modelPath / 'config_network.json')
+        samples = dataset_samples(self.modelPath / 'data_test')
+
+        patches = calibration_patches(samples, config['trainingset_patchsize'], 0.1, n_patches=8)
+        path_int8_model = quantize_model(self.modelPath, config, patches)
+        assert path_int8_model.exists()
+
+        results = dice_report(self.modelPath, config, samples, 0.1)
+        mean = results[-1]
+
+        assert mean[0] == 'mean'
+        assert mean[3] > -0.05 and mean[6] > -0.05
+
+    # --------------main (cli) tests-------------- #
+    @pytest.mark.exceptionhandling
+    def test_main_cli_handles_exception_missing_dataset(self, tmp_path):
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            main(['-d', str(tmp_path / 'missing')])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 3)
+
+    @pytest.mark.exceptionhandling
+    def test_main_cli_handles_exception_dataset_without_samples(self, tmp_path):
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            main(['-d', str(tmp_path)])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 3)
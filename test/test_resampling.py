@@ -0,0 +1,134 @@
+# coding: utf-8
+
+from pathlib import Path
+
+import pytest
+import numpy as np
+from scipy import ndimage
+from skimage.transform import resize
+
+from AxonDeepSeg.resampling import resize_labels, resize_probabilities, rescale_image
+import AxonDeepSeg.ads_utils as ads
+
+
+class TestCore(object):
+    def setup(self):
+        # Get the directory where this current file is saved
+        self.testPath = Path(__file__).resolve().parent
+
+        self.imagePath = (
+            self.testPath /
+            '__test_files__' /
+            '__test_segment_files__' /
+            'image.png'
+            )
+
+        rng = np.random.RandomState(0)
+        self.labels = rng.randint(0, 3, size=(60, 80)).astype(np.uint8)
+        self.probabilities = rng.dirichlet(np.ones(3), size=(60, 80)).astype(np.float32)
+        self.image = (ndimage.gaussian_filter(rng.rand(300, 400), 4) * 2550 - 1150).clip(0, 255).astype(np.uint8)
+
+    def teardown(self):
+        pass
+
+    # --------------resize_labels tests-------------- #
+    @pytest.mark.unit
+    def test_resize_labels_matches_nearest_neighbour_resize(self):
+        for output_shape in [(120, 160), (45, 100), (61, 79)]:
+            expected = resize(self.labels, output_shape, order=0, mode='reflect', preserve_range=True,
+                              anti_aliasing=False).astype(np.uint8)
+
+            assert np.array_equal(resize_labels(self.labels, output_shape), expected)
+
+    @pytest.mark.unit
+    def test_resize_labels_keeps_the_dtype_and_the_labels(self):
+        resized = resize_labels(self.labels, (97, 131))
+
+        assert resized.dtype == np.uint8
+        assert set(np.unique(resized)) <= set(np.unique(self.labels))
+
+    @pytest.mark.unit
+    def test_resize_labels_result_does_not_depend_on_the_chunk_size(self):
+        expected = resize_labels(self.labels, (150, 170))
+
+        for chunk_size in [1, 7, 1000]:
+            assert np.array_equal(resize_labels(self.labels, (150, 170), chunk_size=chunk_size), expected)
+
+    @pytest.mark.unit
+    def test_resize_labels_writes_into_the_given_array(self):
+        out = np.empty((30, 40), dtype=np.uint8)
+
+        resized = resize_labels(self.labels, (30, 40), out=out)
+
+        assert resized is out
+        assert np.array_equal(out, self.labels[1::2, 1::2])
+
+    # --------------resize_probabilities tests-------------- #
+    @pytest.mark.unit
+    def test_resize_probabilities_matches_bilinear_resize(self):
+        for output_shape in [(120, 160), (45, 100), (60, 80)]:
+            expected = resize(self.probabilities.astype(np.float64), output_shape, order=1, mode='edge',
+                              anti_aliasing=False)
+
+            resized = resize_probabilities(self.probabilities, output_shape, chunk_size=7)
+
+            assert resized.dtype == np.float32
+            assert np.allclose(resized, expected, atol=1e-6)
+
+    @pytest.mark.unit
+    def test_resize_probabilities_quantises_to_uint8(self):
+        resized = resize_probabilities(self.probabilities, (90, 120))
+
+        quantised = resize_probabilities(self.probabilities, (90, 120), dtype=np.uint8)
+
+        assert quantised.dtype == np.uint8
+        assert np.abs(quantised / 255. - resized).max() <= 0.5 / 255 + 1e-6
+
+    # --------------rescale_image tests-------------- #
+    @pytest.mark.unit
+    def test_rescale_image_area_backend_matches_skimage_backend(self):
+        for coefficient in [3.7, 1.5, 0.5, 0.37]:
+            expected = rescale_image(self.image, coefficient, backend='skimage')
+
+            rescaled = rescale_image(self.image, coefficient, backend='area', chunk_size=50)
+
+            assert rescaled.dtype == np.uint8
+            assert rescaled.shape == expected.shape
+            assert np.abs(rescaled.astype(int) - expected).mean() < 1
+
+    @pytest.mark.unit
+    def test_rescale_image_area_backend_averages_blocks_when_reducing(self):
+        expected = self.image[:, :399].reshape(100, 3, 133, 3).mean(axis=(1, 3))
+
+        rescaled = rescale_image(self.image[:, :399], 1 / 3., backend='area')
+
+        assert np.array_equal(rescaled, np.rint(expected))
+
+    @pytest.mark.unit
+    def test_rescale_image_opencv_backend_matches_skimage_backend(self):
+        pytest.importorskip('cv2')
+
+        for coefficient in [3.7, 0.5]:
+            expected = rescale_image(self.image, coefficient, backend='skimage')
+
+            rescaled = rescale_image(self.image, coefficient, backend='opencv')
+
+            assert rescaled.shape == expected.shape
+            assert np.abs(rescaled.astype(int) - expected).mean() < 1
+
+    @pytest.mark.integration
+    def test_rescale_image_backends_match_skimage_on_the_test_image(self):
+        image = ads.imread(self.imagePath)
+
+        # Resampling of the test image (pixel size 0.37) to the resolution of the SEM model (0.1)
+        expected = rescale_image(image, 3.7, backend='skimage')
+
+        rescaled = rescale_image(image, 3.7, backend='area')
+
+        assert rescaled.shape == expected.shape
+        assert np.abs(rescaled.astype(int) - expected).mean() < 1
+
+    @pytest.mark.exceptionhandling
+    def test_rescale_image_unknown_backend_raises_ValueError(self):
+        with pytest.raises(ValueError):
+            rescale_image(self.image, 2, backend='lanczos')
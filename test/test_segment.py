@@ -2,10 +2,13 @@
 
 from pathlib import Path
 
+import numpy as np
 import pytest
 
 from AxonDeepSeg.segment import *
 import AxonDeepSeg.segment
+from AxonDeepSeg.sharding import read_shard_log, merge_shard_logs
+from AxonDeepSeg.incremental import manifest_name
 from config import axonmyelin_suffix, axon_suffix, myelin_suffix
 
 class TestCore(object):
@@ -60,7 +63,9 @@ class TestCore(object):
             'image' + str(axonmyelin_suffix),
             'image2' + str(axon_suffix),
             'image2' + str(myelin_suffix),
-            'image2' + str(axonmyelin_suffix)
+            'image2' + str(axonmyelin_suffix),
+            'image' + axonmyelin_suffix.stem + '.tif',
+            manifest_name
             ]
 
         for fileName in outputFiles:
@@ -84,6 +89,23 @@ class TestCore(object):
         with pytest.raises(ValueError):
             config = generate_config_dict(str(self.modelPath / 'n0n_3xist1ng_f1l3.json'))
 
+    # --------------read_stitching_defaults tests-------------- #
+    @pytest.mark.unit
+    def test_read_stitching_defaults_falls_back_to_the_default_settings(self, tmp_path):
+        assert read_stitching_defaults(tmp_path) == (default_stitching_mode, default_overlap)
+
+        with open(str(tmp_path / stitching_defaults_name), 'w') as f:
+            f.write('{"stitching_mode": "unknown", "overlap_value": 10}')
+
+        assert read_stitching_defaults(tmp_path) == (default_stitching_mode, default_overlap)
+
+    @pytest.mark.unit
+    def test_read_stitching_defaults_reads_the_saved_settings(self, tmp_path):
+        with open(str(tmp_path / stitching_defaults_name), 'w') as f:
+            f.write('{"stitching_mode": "blend", "overlap_value": 10}')
+
+        assert read_stitching_defaults(tmp_path) == ('blend', 10)
+
     # --------------generate_resolution tests-------------- #
     @pytest.mark.unit
     def test_generate_resolution_returns_expected_known_project_cases(self):
@@ -144,9 +166,78 @@ class TestCore(object):
             config=config,
             resolution_model=resolution_model,
             acquired_resolution=0.37,
-            verbosity_level=2
+            verbosity_level=2,
+            force=True
+            )
+
+    @pytest.mark.integration
+    def test_segment_folders_skips_images_already_segmented(self):
+
+        path_model, config = generate_default_parameters('SEM', str(self.modelPath))
+
+        overlap_value = 25
+        resolution_model = generate_resolution('SEM', 512)
+
+        segment_folders(
+            path_testing_images_folder=str(self.imageFolderPath),
+            path_model=str(path_model),
+            overlap_value=overlap_value,
+            config=config,
+            resolution_model=resolution_model,
+            acquired_resolution=0.37
+            )
+        outputPath = self.imageFolderPath / ('image' + str(axonmyelin_suffix))
+        mtime = outputPath.stat().st_mtime_ns
+
+        # Same image, model and parameters: the segmentation is not written again, and the model is not loaded
+        segmenter = segment_folders(
+            path_testing_images_folder=str(self.imageFolderPath),
+            path_model=str(path_model),
+            overlap_value=overlap_value,
+            config=config,
+            resolution_model=resolution_model,
+            acquired_resolution=0.37,
+            keep_segmenter=True
             )
 
+        assert segmenter is None
+
+        assert (self.imageFolderPath / manifest_name).exists()
+        assert outputPath.stat().st_mtime_ns == mtime
+
+    @pytest.mark.integration
+    def test_segment_folders_runs_with_loaded_segmenter(self):
+
+        path_model, config = generate_default_parameters('SEM', str(self.modelPath))
+
+        overlap_value = 25
+        resolution_model = generate_resolution('SEM', 512)
+
+        outputFiles = [
+            'image' + str(axon_suffix),
+            'image' + str(myelin_suffix),
+            'image' + str(axonmyelin_suffix)
+            ]
+
+        with Segmenter(path_model, config) as segmenter:
+            segment_folders(
+                path_testing_images_folder=str(self.imageFolderPath),
+                path_model=str(path_model),
+                overlap_value=overlap_value,
+                config=config,
+                resolution_model=resolution_model,
+                acquired_resolution=0.37,
+                verbosity_level=2,
+                segmenter=segmenter,
+                force=True
+                )
+
+            # The session is still open and can be used for another call
+            assert segmenter.session is not None
+
+        for fileName in outputFiles:
+            assert (self.imageFolderPath / fileName).exists()
+
     # --------------segment_image tests-------------- #
     @pytest.mark.integration
     def test_segment_image_creates_runs_successfully(self):
@@ -197,6 +288,55 @@ class TestCore(object):
 
         assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
 
+    @pytest.mark.integration
+    def test_main_cli_runs_succesfully_with_valid_inputs_with_batch_size(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imagePath), "-v", "2", "-s", "0.37", '--batch-size', '3'])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+
+    @pytest.mark.integration
+    def test_main_cli_runs_succesfully_with_valid_inputs_with_tile_size(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imagePath), "-v", "2", "-s", "0.37", '--tile-size', '1024'])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+        assert (self.imageFolderPath / ('image' + axonmyelin_suffix.stem + '.tif')).exists()
+
+    @pytest.mark.integration
+    def test_main_cli_runs_succesfully_with_valid_inputs_with_blend_stitching(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imagePath), "-v", "2", "-s", "0.37", '--overlap', '10', '--stitching', 'blend'])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+
+    @pytest.mark.integration
+    def test_main_cli_runs_succesfully_with_valid_inputs_with_skip_background(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imagePath), "-v", "2", "-s", "0.37", '--skip-background'])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+
+    @pytest.mark.exceptionhandling
+    def test_main_cli_handles_exception_for_invalid_skip_background_threshold(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imagePath), "-v", "2", "-s", "0.37", '--skip-background', '-1'])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 2)
+
+    @pytest.mark.exceptionhandling
+    def test_main_cli_handles_exception_for_invalid_batch_size(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imagePath), "-v", "2", "-s", "0.37", '--batch-size', '0'])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 2)
+
     @pytest.mark.integration
     def test_main_cli_runs_succesfully_with_valid_inputs_with_pixel_size_file(self):
 
@@ -238,6 +378,40 @@ class TestCore(object):
 
         assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
 
+    @pytest.mark.integration
+    def test_main_cli_runs_succesfully_with_valid_inputs_for_folder_input_without_threads(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imageFolderPath), "-v", "2", "-s", "0.37", "--threads", "0", "--force"])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+
+    @pytest.mark.integration
+    def test_main_cli_runs_succesfully_with_valid_inputs_for_folder_input_with_jobs(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imageFolderPath), "-v", "2", "-s", "0.37", "--jobs", "2", "--force"])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+
+    @pytest.mark.integration
+    def test_main_cli_prints_skipped_patches_summary_with_jobs(self, capsys):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imageFolderPath), "-v", "2", "-s", "0.37", "--jobs", "2",
+                                      "--force", "--skip-background"])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+        assert "patches skipped as background." in capsys.readouterr().out
+
+    @pytest.mark.exceptionhandling
+    def test_main_cli_handles_exception_for_invalid_number_of_jobs(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imageFolderPath), "-v", "2", "-s", "0.37", "--jobs", "0"])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 2)
+
     @pytest.mark.integration
     def test_main_cli_runs_succesfully_with_valid_inputs_for_folder_input_with_pixel_size_file(self):
 
@@ -246,6 +420,16 @@ class TestCore(object):
 
         assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
 
+    @pytest.mark.integration
+    def test_main_cli_runs_succesfully_with_valid_inputs_for_folder_input_with_pixel_size_map(self, tmp_path):
+        path_pixel_size_map = tmp_path / 'pixel_sizes.csv'
+        path_pixel_size_map.write_text('image,pixel_size\n{0},0.37\n'.format(self.imagePath))
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imagePath), "-v", "2", "--pixel-size-map", str(path_pixel_size_map)])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+
     @pytest.mark.exceptionhandling
     def test_main_cli_handles_exception_for_too_small_resolution_due_to_min_resampled_patch_size_for_folder_input(self):
 
@@ -270,3 +454,100 @@ class TestCore(object):
             AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imageFolderPath), "-v", "2"])
 
         assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 3)
+
+    @pytest.mark.integration
+    def test_main_cli_runs_succesfully_with_valid_inputs_for_image_list_shard(self, tmp_path):
+        path_image_list = tmp_path / 'list.csv'
+        path_image_list.write_text('image,pixel_size\n{0},0.37\n'.format(self.imagePath))
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "--manifest", str(path_image_list), "--shard", "0/1", "--force"])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+        assert (tmp_path / 'list_shard_logs' / 'shard-00000-of-00001.jsonl').exists()
+
+    @pytest.mark.exceptionhandling
+    def test_segment_image_list_logs_unreadable_images_as_failed(self, tmp_path):
+        path_corrupt = tmp_path / 'corrupt.png'
+        path_corrupt.write_bytes(b'not an image')
+        image_list = [(path_corrupt, 0.1), (tmp_path / 'missing.png', 0.1)]
+
+        n_segmented, n_failed = segment_image_list(image_list, tmp_path, 0, {'trainingset_patchsize': 256}, 0.1,
+                                                   tmp_path / 'logs', force=True)
+
+        assert (n_segmented, n_failed) == (0, 2)
+        records = read_shard_log(shard_log_path(tmp_path / 'logs', 0, 1))
+        assert [record['status'] for record in records] == ['failed', 'failed']
+        assert all(record['error'] for record in records)
+
+    @pytest.mark.exceptionhandling
+    def test_segment_image_list_continues_after_an_image_fails(self, tmp_path):
+        image_list = []
+        for name in ['a.png', 'bad.png', 'c.png']:
+            ads.imwrite(tmp_path / name, np.zeros((300, 300), dtype=np.uint8))
+            image_list.append((tmp_path / name, 0.1))
+
+        class FailingSegmenter(object):
+            # Fails on every stream containing the image bad.png, without predicting anything
+            n_classes = 3
+
+            def segment_stream(self, img_files, *args, **kwargs):
+                for i, file_ in enumerate(img_files):
+                    if file_.name == 'bad.png':
+                        raise ValueError('cannot decode the image')
+                    yield i, None
+
+        n_segmented, n_failed = segment_image_list(image_list, tmp_path, 0, {'trainingset_patchsize': 256}, 0.1,
+                                                   tmp_path / 'logs', segmenter=FailingSegmenter(), n_threads=0,
+                                                   use_cache=False, force=True)
+
+        assert (n_segmented, n_failed) == (2, 1)
+        statuses = {Path(record['image']).name: record['status']
+                    for record in read_shard_log(shard_log_path(tmp_path / 'logs', 0, 1))}
+        assert statuses == {'a.png': 'segmented', 'bad.png': 'failed', 'c.png': 'segmented'}
+
+    @pytest.mark.unit
+    def test_segment_image_list_resumes_with_another_path_of_the_list(self, tmp_path, monkeypatch):
+        (tmp_path / 'data').mkdir()
+        with open(str(tmp_path / 'data' / 'list.csv'), 'w') as f:
+            f.write('image,pixel_size\n')
+            for name in ['a.png', 'b.png']:
+                ads.imwrite(tmp_path / 'data' / name, np.zeros((300, 300), dtype=np.uint8))
+                f.write('{0},0.1\n'.format(name))
+
+        class CountingSegmenter(object):
+            # Segments nothing, but records the images of each stream
+            n_classes = 3
+            streams = []
+
+            def segment_stream(self, img_files, *args, **kwargs):
+                self.streams.append(list(img_files))
+                for i in range(len(img_files)):
+                    yield i, None
+
+        parameters = dict(segmenter=CountingSegmenter(), n_threads=0, use_cache=False)
+        assert segment_image_list(read_image_list(tmp_path / 'data' / 'list.csv'), tmp_path, 0,
+                                  {'trainingset_patchsize': 256}, 0.1, tmp_path / 'logs', **parameters) == (2, 0)
+
+        # Same list, given relatively to another working directory
+        monkeypatch.chdir(str(tmp_path / 'data'))
+        assert segment_image_list(read_image_list(Path('list.csv')), tmp_path, 0,
+                                  {'trainingset_patchsize': 256}, 0.1, tmp_path / 'logs', **parameters) == (0, 0)
+        assert len(CountingSegmenter.streams) == 1
+        assert merge_shard_logs(tmp_path / 'logs', Path('../data/list.csv'))['missing_images'] == []
+
+    @pytest.mark.exceptionhandling
+    def test_main_cli_handles_exception_for_shard_without_image_list(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-i", str(self.imagePath), "-s", "0.37", "--shard", "0/2"])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 2)
+
+    @pytest.mark.exceptionhandling
+    def test_main_cli_handles_exception_missing_images(self):
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.segment.main(["-t", "SEM", "-s", "0.37"])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 3)
@@ -0,0 +1,120 @@
+# coding: utf-8
+
+import json
+from pathlib import Path
+
+import pytest
+
+from AxonDeepSeg.sharding import *
+import AxonDeepSeg.sharding
+
+
+class TestCore(object):
+    def setup(self):
+        self.images = ['image{0}.png'.format(i) for i in range(7)]
+
+    def teardown(self):
+        pass
+
+    def write_csv(self, path_list):
+        with open(str(path_list), 'w') as f:
+            f.write('image,pixel_size\n')
+            for i, image in enumerate(self.images):
+                f.write('{0},{1}\n'.format(image, '' if i == 0 else 0.1 * i))
+        return path_list
+
+    # --------------read_image_list tests-------------- #
+    @pytest.mark.unit
+    def test_read_image_list_reads_csv_files(self, tmp_path):
+        image_list = read_image_list(self.write_csv(tmp_path / 'list.csv'))
+
+        assert [path_image for path_image, _ in image_list] == [tmp_path.resolve() / image for image in self.images]
+        assert image_list[0][1] is None
+        assert image_list[3][1] == pytest.approx(0.3)
+
+    @pytest.mark.unit
+    def test_read_image_list_reads_json_lines_files(self, tmp_path):
+        path_list = tmp_path / 'list.jsonl'
+        with open(str(path_list), 'w') as f:
+            f.write(json.dumps({'image': '/data/image.png', 'pixel_size': 0.05}) + '\n')
+            f.write(json.dumps({'path': 'relative/image.tif'}) + '\n')
+
+        image_list = read_image_list(path_list)
+
+        assert image_list == [(Path('/data/image.png'), 0.05), (tmp_path.resolve() / 'relative' / 'image.tif', None)]
+
+    @pytest.mark.exceptionhandling
+    def test_read_image_list_throws_exception_for_unknown_format(self, tmp_path):
+        path_list = tmp_path / 'list.txt'
+        path_list.write_text('image.png')
+
+        with pytest.raises(ValueError):
+            read_image_list(path_list)
+
+    # --------------shard tests-------------- #
+    @pytest.mark.unit
+    def test_parse_shard_returns_index_and_count(self):
+        assert parse_shard('3/16') == (3, 16)
+
+    @pytest.mark.exceptionhandling
+    def test_parse_shard_throws_exception_for_invalid_shards(self):
+        for shard in ['3', '4/4', '-1/4', 'a/b']:
+            with pytest.raises(ValueError):
+                parse_shard(shard)
+
+    @pytest.mark.unit
+    def test_shards_partition_the_image_list(self):
+        shards = [select_shard(self.images, index, 3) for index in range(3)]
+
+        assert sorted(sum(shards, [])) == sorted(self.images)
+        assert max(len(s) for s in shards) - min(len(s) for s in shards) <= 1
+        assert select_shard(self.images, 1, 3) == shards[1]
+
+    # --------------shard log tests-------------- #
+    @pytest.mark.unit
+    def test_shard_log_keeps_last_status_of_each_image(self, tmp_path):
+        shard_log = ShardLog(shard_log_path(tmp_path / 'logs', 0, 2), 0, 2)
+        shard_log.write('image0.png', 'failed', error='Error')
+        shard_log.write('image0.png', 'segmented')
+        shard_log.write('image2.png', 'failed', error='Error')
+
+        # A line cut by an interrupted run is ignored
+        with open(str(shard_log.path_log), 'a') as f:
+            f.write('{"image": "image4.p')
+
+        assert shard_log.completed_images() == {'image0.png'}
+
+    @pytest.mark.unit
+    def test_merge_shard_logs_reports_failed_and_missing_images(self, tmp_path):
+        path_list = self.write_csv(tmp_path / 'list.csv')
+        path_logs = tmp_path / 'logs'
+
+        shard_log = ShardLog(shard_log_path(path_logs, 0, 3), 0, 3)
+        for i, (path_image, _) in enumerate(select_shard(read_image_list(path_list), 0, 3)):
+            shard_log.write(path_image, 'failed' if i == 0 else 'segmented', error='Error')
+        ShardLog(shard_log_path(path_logs, 2, 3), 2, 3).write(tmp_path.resolve() / self.images[2], 'segmented')
+
+        report = merge_shard_logs(path_logs, path_list)
+
+        assert report['n_shards'] == 3
+        assert report['missing_shards'] == [1]
+        assert report['n_segmented'] == 3
+        assert report['failed'] == [{'image': str(tmp_path.resolve() / self.images[0]), 'error': 'Error'}]
+        assert report['missing_images'] == [str(tmp_path.resolve() / self.images[i]) for i in (1, 4, 5)]
+
+    @pytest.mark.unit
+    def test_main_writes_run_report(self, tmp_path):
+        ShardLog(shard_log_path(tmp_path, 0, 1), 0, 1).write('image0.png', 'segmented')
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.sharding.main([str(tmp_path)])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 0)
+        assert json.loads((tmp_path / 'run_report.json').read_text())['n_segmented'] == 1
+
+    @pytest.mark.exceptionhandling
+    def test_main_handles_exception_for_missing_log_folder(self, tmp_path):
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.sharding.main([str(tmp_path / 'missing')])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 3)
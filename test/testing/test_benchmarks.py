@@ -0,0 +1,50 @@
+# coding: utf-8
+
+from pathlib import Path
+
+import pytest
+
+from AxonDeepSeg.testing.benchmarks import *
+from AxonDeepSeg.segment import read_stitching_defaults
+
+
+class TestCore(object):
+    def setup(self):
+        # [stitching_mode, overlap_value, seconds, axon dice, myelin dice] rows of benchmark_stitching_mode
+        self.results = [
+            ['crop', 5, 10.0, 0.880, 0.800],
+            ['crop', 25, 14.0, 0.900, 0.820],
+            ['blend', 5, 11.0, 0.898, 0.818],
+            ['blend', 25, 16.0, 0.901, 0.821]
+            ]
+
+    # --------------recommend_stitching tests-------------- #
+    @pytest.mark.unit
+    def test_recommend_stitching_chooses_the_fastest_setting_close_to_the_best_dice(self):
+        assert recommend_stitching(self.results, max_dice_loss=0.005) == ['blend', 5, 11.0, 0.898, 0.818]
+        assert recommend_stitching(self.results, max_dice_loss=0.) == ['blend', 25, 16.0, 0.901, 0.821]
+
+    # --------------write_stitching_defaults tests-------------- #
+    @pytest.mark.unit
+    def test_write_stitching_defaults_sets_the_defaults_of_the_model(self, tmp_path):
+        write_stitching_defaults(tmp_path, self.results, max_dice_loss=0.005)
+
+        assert read_stitching_defaults(tmp_path) == ('blend', 5)
+
+    # --------------main tests-------------- #
+    @pytest.mark.exceptionhandling
+    def test_main_handles_exception_for_read_only_model_folder(self, tmp_path, monkeypatch):
+        import AxonDeepSeg.segment
+        import AxonDeepSeg.testing.benchmarks
+
+        path_model = tmp_path / 'missing_model'
+        monkeypatch.setattr(AxonDeepSeg.segment, 'generate_default_parameters',
+                            lambda type_acquisition, new_path: (path_model, {'trainingset_patchsize': 512}))
+        monkeypatch.setattr(AxonDeepSeg.testing.benchmarks, 'benchmark_stitching_mode',
+                            lambda *args, **kwargs: self.results)
+
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            AxonDeepSeg.testing.benchmarks.main(['stitching_mode', '-i', str(tmp_path / 'image.png'), '-s', '0.1',
+                                                 '--save'])
+
+        assert (pytest_wrapped_e.type == SystemExit) and (pytest_wrapped_e.value.code == 3)
@@ -49,7 +49,35 @@ class TestCore(object):
         assert axonFile.is_file()
         assert myelinFile.is_file()
 
+    @pytest.mark.unit
+    def test_split_segmentation_returns_same_masks_as_get_masks(self):
+        pred_img = self.path_folder / ('image' + str(axonmyelin_suffix))
+
+        axon_prediction, myelin_prediction = get_masks(str(pred_img))
+        axon_mask, myelin_mask = split_segmentation(imageio.imread(pred_img))
+
+        assert np.array_equal(axon_mask, axon_prediction)
+        assert np.array_equal(myelin_mask, myelin_prediction)
+
+    @pytest.mark.unit
+    def test_masks_paths_returns_axon_and_myelin_paths(self):
+        path_axon, path_myelin = masks_paths(self.path_folder / ('image' + str(axonmyelin_suffix)))
+
+        assert path_axon == self.path_folder / ('image' + str(axon_suffix))
+        assert path_myelin == self.path_folder / ('image' + str(myelin_suffix))
+
     # --------------rgb_rendering_of_mask tests-------------- #
+    @pytest.mark.unit
+    def test_rgb_rendering_of_mask_paints_axon_blue_and_myelin_red(self):
+        pred_img = np.array([[0, 127], [255, 0]], dtype=np.uint8)
+
+        rgb_mask = rgb_rendering_of_mask(pred_img)
+
+        assert rgb_mask.dtype == np.uint8
+        assert np.array_equal(rgb_mask[0, 1], [255, 0, 0])
+        assert np.array_equal(rgb_mask[1, 0], [0, 0, 255])
+        assert not rgb_mask[0, 0].any() and not rgb_mask[1, 1].any()
+
     @pytest.mark.unit
     def test_rgb_rendering_of_mask_returns_array_with_extra_dim_of_len_3(self):
         pred_img = imageio.imread(self.path_folder / ('image' + str(axonmyelin_suffix)))